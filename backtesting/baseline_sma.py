@@ -1,14 +1,16 @@
 import datetime  # For datetime objects
-import pandas as pd
 import backtrader as bt
 from backtrader import analyzers
 
-from database.db_queries import get_all_resampled_data
+from backtesting.precomputed import cached_sma
+from backtesting.recording import RecordingStrategy
+from database.db_queries import get_ohlc
 
 
-class BaselineSMAStrategy(bt.Strategy):
+class BaselineSMAStrategy(RecordingStrategy):
     params = (('sma_short_period', 5),
               ('sma_long_period', 14),
+              ('indicators', None),  # IndicatorCache with the SMAs
               )
 
     def __init__(self):
@@ -17,12 +19,12 @@ class BaselineSMAStrategy(bt.Strategy):
         self.buyprice = None
         self.buycomm = None
         # Add a MovingAverageSimple indicator
-        self.short_sma = bt.indicators.SimpleMovingAverage(self.datas[0], period=self.params.sma_short_period)
-        self.long_sma = bt.indicators.SimpleMovingAverage(self.datas[0], period=self.params.sma_long_period)
-
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s' % (dt.isoformat(), txt))
+        if self.params.indicators is not None:
+            self.short_sma = cached_sma(self, self.params.indicators, self.params.sma_short_period)
+            self.long_sma = cached_sma(self, self.params.indicators, self.params.sma_long_period)
+        else:
+            self.short_sma = bt.indicators.SimpleMovingAverage(self.datas[0], period=self.params.sma_short_period)
+            self.long_sma = bt.indicators.SimpleMovingAverage(self.datas[0], period=self.params.sma_long_period)
 
     def next(self):
         # Simply log the closing price of the series from the reference
@@ -36,28 +38,29 @@ class BaselineSMAStrategy(bt.Strategy):
             # if self.datas[0].close[0]<self.datas[0].close[1]: # Cheating !!!
                 if self.datas[0].close >= self.datas[0].open[1]: comp = '>='
                 else: comp = '<'
-                self.log('BUY CREATE, Close:%.4f %s Next Open:%.4f' % (self.datas[0].close[0], comp, self.datas[0].open[1]))
+                self.log('BUY CREATE, Close:%.4f %s Next Open:%.4f', self.datas[0].close[0], comp, self.datas[0].open[1])
                 # BUY, BUY, BUY!!! (with all possible default parameters)
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.buy()
         else:
             if self.short_sma[0] <= self.long_sma[0]:
                 # SELL, SELL, SELL!!! (with all possible default parameters)
-                self.log('SELL CREATE, %.4f' % self.datas[0].close[0])
+                self.log('SELL CREATE, %.4f', self.datas[0].close[0])
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.sell()
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             return  # Buy/Sell order submitted/accepted to/by broker - Nothing to do
+        self.record_order(order)
         # Check if an order has been completed  Attention: broker could reject order if not enougth cash
         if order.status in [order.Completed]:
             if order.isbuy():
-                self.log('BUY EXECUTED, Size: %.4f Price: %.4f, Cost: %.4f, Comm %.4f' % (self.position.size, order.executed.price, order.executed.value, order.executed.comm))
+                self.log('BUY EXECUTED, Size: %.4f Price: %.4f, Cost: %.4f, Comm %.4f', self.position.size, order.executed.price, order.executed.value, order.executed.comm)
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             else:  # Sell
-                self.log('SELL EXECUTED, Size: %.4f Price: %.4f, Cost: %.4f, Comm %.4f' % (self.position.size, order.executed.price, order.executed.value, order.executed.comm))
+                self.log('SELL EXECUTED, Size: %.4f Price: %.4f, Cost: %.4f, Comm %.4f', self.position.size, order.executed.price, order.executed.value, order.executed.comm)
 
             self.bar_executed = len(self)  # Todo: can be removed?
 
@@ -69,17 +72,15 @@ class BaselineSMAStrategy(bt.Strategy):
 
     def notify_trade(self, trade):
         if not trade.isclosed: return
-        self.log('OPERATION PROFIT, GROSS %.4f, NET %.4f' % (trade.pnl, trade.pnlcomm))
+        self.record_trade(trade)
+        self.log('OPERATION PROFIT, GROSS %.4f, NET %.4f', trade.pnl, trade.pnlcomm)
 
 
 if __name__ == '__main__':
     # Create a Data Feed
-    usd_open = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='open')
-    usd_high = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='high')
-    usd_low = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='low')
-    usd_close = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='close')
-    usd_data = pd.concat([usd_open, usd_high, usd_low, usd_close], axis=1)
-    data = bt.feeds.PandasData(dataname=usd_data, fromdate=datetime.datetime(2014, 1, 1), todate=datetime.datetime(2020, 12, 7))
+    fromdate, todate = datetime.datetime(2014, 1, 1), datetime.datetime(2020, 12, 7)
+    usd_data = get_ohlc(currency='EURUSD', type='resampled', frequency='D', begin=fromdate, end=todate)
+    data = bt.feeds.PandasData(dataname=usd_data, fromdate=fromdate, todate=todate)
 
     cash = 1000.0
     size = 90  # %
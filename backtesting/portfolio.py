@@ -0,0 +1,170 @@
+'''
+Portfolio backtest: 1 strategy on several currencies at once, on 1 aligned time axis with shared cash.
+The signals of all pairs are computed at once on the (bars x pairs) panel (see db_queries.get_panel()).
+Only the bars where a pair can buy or sell are visited, in date order because the pairs share the cash.
+The broker rules are those of vectorized.run_signals(), per pair:
+- buy size = portfolio value * percents / 100 * weight of the pair / close (on the close of the signal bar)
+- the orders of a bar are filled at the next open: first the sells, then the buys in currency order
+- a buy is rejected if its cost + commission at the fill price is more than the cash
+The bars that get_panel() filled for a pair (panel['real'] is False) aren't bars of that pair: its signals are computed
+on its real bars only, and an order is only placed if the next bar of the pair is real (it's filled at a real open).
+'''
+import datetime
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from backtesting import vectorized
+
+Portfolio = namedtuple('Portfolio', ['equity', 'positions', 'trades', 'value'])
+
+TRADE_COLUMNS = ['currency', 'entry_bar', 'exit_bar', 'entry_price', 'exit_price', 'size', 'pnl', 'pnlcomm']
+
+
+def next_true(mask):
+    '''
+    Per column: for every bar the first bar >= it where mask is True (number of bars if there's none).
+    '''
+    n = len(mask)
+    bars = np.where(mask, np.arange(n).reshape((n,) + (1,) * (mask.ndim - 1)), n)
+    return np.minimum.accumulate(bars[::-1], axis=0)[::-1]
+
+
+def run_portfolio(open, close, entry, exit, cash=1000.0, percents=90, weights=None, commission=0., start=0,
+                  stop=None, currencies=None, dates=None, real=None):
+    '''
+    Runs a long only strategy on (bars x pairs) entry/exit signals and returns a Portfolio:
+    - equity: portfolio value at every bar
+    - positions: (bars x pairs) size held
+    - trades: dataframe with 1 row per trade (exit_bar = -1 if still open)
+    - value: final portfolio value
+    'weights' is the fraction of the portfolio per pair (default: equal weights).
+    'real': (bars x pairs) False on the filled bars (see get_panel()): no order is placed on them or filled on them.
+    '''
+    open = np.asarray(open, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    n, pairs = close.shape
+    stop = n if stop is None else stop
+    pct = percents / 100.
+    weights = np.full(pairs, 1. / pairs) if weights is None else np.asarray(weights, dtype=np.float64)
+    currencies = list(range(pairs)) if currencies is None else list(currencies)
+    valuation = pd.DataFrame(close).ffill().fillna(0.).values
+
+    window = np.zeros((n, 1), dtype=bool)
+    window[start:stop - 1] = True  # An order at the last bar is never filled
+    with np.errstate(invalid='ignore'):
+        fillable = window & np.isfinite(np.append(open[1:], np.full((1, pairs), np.nan), axis=0))
+    if real is not None:
+        real = np.asarray(real, dtype=bool)
+        fillable &= real & np.append(real[1:], np.zeros((1, pairs), dtype=bool), axis=0)
+    next_entry = next_true(entry & fillable)
+    next_exit = next_true(exit & fillable)
+
+    held = np.zeros(pairs, dtype=bool)
+    sizes = np.zeros(pairs)
+    entries = [None] * pairs  # Open trade per pair
+    flows = np.zeros(n)  # Cash flow at every bar
+    fills = np.zeros((n, pairs))  # Size bought (+) or sold (-) at every bar
+    trades = []
+    balance = cash
+    bar = start
+    while bar < n:
+        candidates = np.where(held, next_exit[bar], next_entry[bar])
+        bar = candidates.min()
+        if bar >= n:
+            break
+        acting = candidates == bar
+        selling, buying = acting & held, acting & ~held
+        fill = bar + 1
+        value = balance + np.dot(sizes, valuation[bar])
+        for pair in np.flatnonzero(selling):
+            size, price = sizes[pair], open[fill, pair]
+            comm = size * price * commission
+            balance += size * price - comm
+            flows[fill] += size * price - comm
+            fills[fill, pair] -= size
+            trade = entries[pair]
+            pnl = size * (price - trade['entry_price'])
+            trade.update(exit_bar=fill, exit_price=price, pnl=pnl, pnlcomm=pnl - trade['pnlcomm'] - comm)
+            trades.append(trade)
+            held[pair], sizes[pair], entries[pair] = False, 0., None
+        for pair in np.flatnonzero(buying):
+            price = open[fill, pair]
+            size = value * pct * weights[pair] / close[bar, pair]
+            cost = size * price
+            comm = cost * commission
+            if cost + comm > balance:
+                continue  # Rejected (Margin)
+            balance -= cost + comm
+            flows[fill] -= cost + comm
+            fills[fill, pair] += size
+            held[pair], sizes[pair] = True, size
+            # 'pnlcomm' holds the entry commission till the trade is closed
+            entries[pair] = {'currency': currencies[pair], 'entry_bar': fill, 'exit_bar': -1, 'entry_price': price,
+                             'exit_price': np.nan, 'size': size, 'pnl': np.nan, 'pnlcomm': comm}
+        bar += 1
+    for trade in entries:
+        if trade is not None:
+            trade['pnlcomm'] = np.nan
+            trades.append(trade)
+
+    positions = np.cumsum(fills, axis=0)
+    equity = cash + np.cumsum(flows) + (positions * valuation).sum(axis=1)
+    trades = pd.DataFrame(trades, columns=TRADE_COLUMNS).sort_values('entry_bar').reset_index(drop=True)
+    if dates is not None:
+        trades['entry_date'] = dates[trades.entry_bar.values]
+        trades['exit_date'] = pd.NaT
+        trades.loc[trades.exit_bar >= 0, 'exit_date'] = dates[trades.exit_bar[trades.exit_bar >= 0].values]
+        equity = pd.Series(equity, index=dates)
+        positions = pd.DataFrame(positions, index=dates, columns=currencies)
+    equity, positions = equity[start:stop], positions[start:stop]
+    value = float(np.asarray(equity)[-1]) if len(equity) else cash
+    return Portfolio(equity=equity, positions=positions, trades=trades, value=value)
+
+
+def real_signals(signals, close, real, **params):
+    '''
+    Computes the signals of every pair on its real bars only, so the filled bars don't count in its indicators.
+    The signals are False on the filled bars.
+    '''
+    entry, exit = np.zeros(close.shape, dtype=bool), np.zeros(close.shape, dtype=bool)
+    for pair in range(close.shape[1]):
+        bars = np.flatnonzero(real[:, pair])
+        entry[bars, pair], exit[bars, pair] = signals(close[bars, pair], **params)
+    return entry, exit
+
+
+def backtest_portfolio(strategy, panel, cash=1000.0, percents=90, weights=None, commission=0., indicators=None,
+                       **params):
+    '''
+    Runs a strategy with vectorized signals (a bt.Strategy class or its name, see vectorized.SIGNALS)
+    with 'params' on a panel from db_queries.get_panel().
+    '''
+    name = strategy if isinstance(strategy, basestring) else strategy.__name__
+    close = panel['close']
+    real = panel['real'].values if 'real' in panel else None
+    if real is None:
+        entry, exit = vectorized.SIGNALS[name](close.values, indicators=indicators, **params)
+    else:
+        entry, exit = real_signals(vectorized.SIGNALS[name], close.values, real, indicators=indicators, **params)
+    return run_portfolio(panel['open'].values, close.values, entry, exit, cash=cash, percents=percents,
+                         weights=weights, commission=commission, currencies=close.columns, dates=close.index, real=real)
+
+
+if __name__ == '__main__':
+    from database.db_queries import get_panel
+    from database.db_settings import CURRENCIES
+
+    fromdate, todate = datetime.datetime(2014, 1, 1), datetime.datetime(2020, 12, 7)
+    panel = get_panel(currencies=CURRENCIES, type='resampled', frequency='D', begin=fromdate, end=todate)
+    result = backtest_portfolio('BaselineSMAStrategy', panel, cash=1000.0, percents=90,
+                                sma_short_period=7, sma_long_period=28)
+    metrics = vectorized.backtest_metrics(result, cash=1000.0)
+    print 'Final Portfolio Value: %.2f' % metrics['value']
+    print 'Total return: {:.2f}% '.format(metrics['total_return'])
+    print 'Anualized return: {:.2f}% '.format(metrics['rnorm100'])
+    print 'SQN: {:.2f}'.format(metrics['sqn'])
+    print 'Draw Down Lenght: {} \nMax Draw Down: {:.2f}%'.format(metrics['max_drawdown_len'], metrics['max_drawdown'])
+    print 'P/L per currency:'
+    print result.trades.groupby('currency').pnlcomm.sum().to_string()
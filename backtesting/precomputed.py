@@ -0,0 +1,33 @@
+import backtrader as bt
+import numpy as np
+
+
+class Precomputed(bt.Indicator):
+    '''
+    Indicator with precomputed values (a numpy array with 1 value per bar of the data),
+    eg: from business_logic.indicator_cache.IndicatorCache.
+    '''
+    lines = ('value',)
+    params = (('values', None),
+              ('period', 1),  # Minimum period, like the indicator that was precomputed
+              )
+
+    def __init__(self):
+        self.addminperiod(self.params.period)
+
+    def next(self):
+        self.lines.value[0] = self.params.values[len(self) - 1]
+
+    def once(self, start, end):
+        dst = self.lines.value.array
+        for i in range(start, end):
+            dst[i] = self.params.values[i]
+
+
+def cached_sma(strategy, cache, period):
+    '''
+    SMA of the close of the strategy's first data, from the cache (computed once per series and period).
+    The data must be preloaded (the default in cerebro).
+    '''
+    close = np.frombuffer(strategy.datas[0].close.array, dtype=np.float64)
+    return Precomputed(strategy.datas[0], values=cache.sma(close, period), period=period)
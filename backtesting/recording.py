@@ -0,0 +1,31 @@
+import backtrader as bt
+
+from database import db_events
+from database.db_events import EventBuffer, ORDER_FIELDS, TRADE_FIELDS, INFO
+
+
+class RecordingStrategy(bt.Strategy):
+    '''
+    Base strategy: records the orders and trades in columnar buffers (self.orders, self.trades)
+    and logs through db_events.log, so the messages cost nothing when the log level is lower.
+    '''
+
+    def start(self):
+        self.orders = EventBuffer(ORDER_FIELDS, capacity=256)
+        self.trades = EventBuffer(TRADE_FIELDS, capacity=256)
+
+    def log(self, txt, *args, **kwargs):
+        '''
+        Logs txt % args, with the date of the current bar. kwargs: level (default INFO)
+        '''
+        level = kwargs.get('level', INFO)
+        if not db_events.log.enabled(level): return
+        db_events.log.log(level, '%s, ' + txt, self.datas[0].datetime.date(0).isoformat(), *args)
+
+    def record_order(self, order):
+        executed = order.executed
+        self.orders.append(executed.dt or self.datas[0].datetime[0], len(self), 1 if order.isbuy() else -1,
+                           order.status, executed.size, executed.price, executed.value, executed.comm)
+
+    def record_trade(self, trade):
+        self.trades.append(trade.dtclose, len(self), trade.barlen, trade.price, trade.pnl, trade.pnlcomm)
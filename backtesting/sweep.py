@@ -0,0 +1,224 @@
+'''
+Parameter sweeps (grid optimization) of a strategy over currencies and date windows.
+The price data is loaded once and shared with the worker processes (shared memory, no pickled frames).
+Strategies with a vectorized version (vectorized.SIGNALS) are run with numpy, other strategies with backtrader.
+'''
+import ctypes
+import datetime
+import itertools
+import time
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pandas as pd
+
+from backtesting import vectorized
+from business_logic.indicator_cache import IndicatorCache
+from database import db_events
+from database.db_events import ERROR
+from database.db_queries import get_ohlc
+from database.db_settings import PRICETYPES
+
+METRICS = ['total_return', 'rnorm100', 'sqn', 'max_drawdown', 'max_drawdown_len', 'max_moneydown', 'trades', 'value']
+
+# Shared price data and indicator cache, set in the workers by _init_worker()
+_shared = {}
+
+
+def share_prices(frames):
+    '''
+    Copies {currency: ohlc} into 2 shared arrays (prices and dates of all currencies after each other).
+    Returns (prices, dates, layout) with layout = {currency: (first row, number of rows)}.
+    '''
+    rows = sum(len(frame) for frame in frames.values())
+    prices = RawArray(ctypes.c_double, max(rows, 1) * len(PRICETYPES))
+    dates = RawArray(ctypes.c_int64, max(rows, 1))
+    price_view, date_view = shared_views(prices, dates)
+    layout, row = {}, 0
+    for currency, frame in frames.items():
+        n = len(frame)
+        price_view[row:row + n] = frame[PRICETYPES].values
+        date_view[row:row + n] = frame.index.values.astype('datetime64[ns]').astype(np.int64)
+        layout[currency] = (row, n)
+        row += n
+    return prices, dates, layout
+
+
+def shared_views(prices, dates):
+    '''
+    Numpy views (no copy) on the shared arrays.
+    '''
+    price_view = np.frombuffer(prices, dtype=np.float64).reshape(-1, len(PRICETYPES))
+    date_view = np.frombuffer(dates, dtype=np.int64)
+    return price_view, date_view
+
+
+def _init_worker(prices, dates, layout):
+    _shared['prices'], _shared['dates'] = shared_views(prices, dates)
+    _shared['layout'] = layout
+    _shared['indicators'] = IndicatorCache()
+    db_events.configure(level=ERROR)  # No order/trade messages from the workers
+
+
+def window_bars(currency, begin=None, end=None):
+    '''
+    (first, last + 1) bar of the window begin ... end (both included) in the shared data of a currency.
+    '''
+    row, n = _shared['layout'][currency]
+    dates = _shared['dates'][row:row + n]
+    first = 0 if begin is None else dates.searchsorted(pd.Timestamp(begin).value)
+    last = n if end is None else dates.searchsorted(pd.Timestamp(end).value, side='right')
+    return first, last
+
+
+def shared_frame(currency, begin=None, end=None):
+    '''
+    The ohlc of a currency from the shared arrays, between begin and end (both included).
+    '''
+    row, n = _shared['layout'][currency]
+    dates = _shared['dates'][row:row + n]
+    first, last = window_bars(currency, begin, end)
+    index = pd.DatetimeIndex(dates[first:last].view('datetime64[ns]'), name='date')
+    return pd.DataFrame(_shared['prices'][row + first:row + last], index=index, columns=PRICETYPES)
+
+
+def run_vectorized(strategy, open, close, params, cash, percents, commission, indicators=None, start=0, stop=None):
+    entry, exit = vectorized.SIGNALS[strategy](close, indicators=indicators, **params)
+    result = vectorized.run_signals(open, close, entry, exit, cash=cash, percents=percents, commission=commission,
+                                    start=start, stop=stop)
+    return vectorized.backtest_metrics(result, cash)
+
+
+def run_backtrader(strategy, ohlc, params, cash, percents, commission, indicators=None):
+    import backtrader as bt
+    from backtrader import analyzers
+
+    if indicators is not None and 'indicators' in strategy.params._getkeys():
+        params = dict(params, indicators=indicators)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(strategy, **params)
+    cerebro.adddata(bt.feeds.PandasData(dataname=ohlc))
+    cerebro.broker.setcash(cash)
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=percents)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(analyzers.Returns, _name='myreturns')
+    cerebro.addanalyzer(analyzers.SQN, _name='mysqn')
+    cerebro.addanalyzer(analyzers.DrawDown, _name='mydrawdown')
+    strat = cerebro.run()[0]
+    value = cerebro.broker.getvalue()
+    sqn = strat.analyzers.mysqn.get_analysis()
+    drawdown = strat.analyzers.mydrawdown.get_analysis()
+    return {'value': value,
+            'total_return': 100. * (value - cash) / cash,
+            'rnorm100': strat.analyzers.myreturns.get_analysis()['rnorm100'],
+            'sqn': sqn['sqn'],
+            'trades': sqn['trades'],
+            'max_drawdown': drawdown['max']['drawdown'],
+            'max_moneydown': drawdown['max']['moneydown'],
+            'max_drawdown_len': drawdown['max']['len']}
+
+
+def _run_task(task):
+    '''
+    Runs all parameter combinations of 1 (currency, window) and returns a list of result rows.
+    With 'warmup' the vectorized strategies use the indicators of the full history (computed once per currency),
+    so there's no warm-up period inside the window.
+    '''
+    strategy, currency, (begin, end), combinations, cash, percents, commission, warmup = task
+    vectorized_run = isinstance(strategy, basestring)
+    if warmup and vectorized_run:
+        ohlc = shared_frame(currency)
+        start, stop = window_bars(currency, begin, end)
+    else:
+        ohlc = shared_frame(currency, begin, end)
+        start, stop = 0, len(ohlc)
+    open, close = ohlc['open'].values, ohlc['close'].values
+    indicators = _shared['indicators']
+    rows = []
+    for params in combinations:
+        row = {'currency': currency, 'begin': begin, 'end': end}
+        row.update(params)
+        if stop <= start:
+            rows.append(row)
+            continue
+        if vectorized_run:
+            row.update(run_vectorized(strategy, open, close, params, cash, percents, commission, indicators,
+                                      start, stop))
+        else:
+            row.update(run_backtrader(strategy, ohlc, params, cash, percents, commission, indicators))
+        rows.append(row)
+    return rows
+
+
+def parameter_grid(grid):
+    '''
+    {'a': [1, 2], 'b': [3]} => [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    '''
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def load_prices(currencies, windows, frequency='D'):
+    '''
+    {currency: ohlc} covering all windows.
+    '''
+    begin = min(window[0] for window in windows)
+    end = max(window[1] for window in windows)
+    return {currency: get_ohlc(currency=currency, type='resampled', frequency=frequency, begin=begin, end=end)
+            for currency in currencies}
+
+
+def runner(strategy):
+    '''
+    Vectorized strategies are passed to the workers by name, others as class (pickled by reference)
+    '''
+    return strategy.__name__ if strategy.__name__ in vectorized.SIGNALS else strategy
+
+
+def run_tasks(tasks, frames, processes=None):
+    '''
+    Runs the tasks (see _run_task()) in a pool of workers sharing the prices of 'frames'. Returns all result rows.
+    '''
+    prices, dates, layout = share_prices(frames)
+    pool = Pool(processes=processes or cpu_count(), initializer=_init_worker, initargs=(prices, dates, layout))
+    try:
+        return [row for result in pool.imap_unordered(_run_task, tasks) for row in result]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def sweep(strategy, grid, currencies=('EURUSD',), windows=None, frequency='D', cash=1000.0, percents=90,
+          commission=0., processes=None, chunksize=250, frames=None, sort_by='sqn', warmup=False):
+    '''
+    Runs 'strategy' (a bt.Strategy class) for all combinations of the parameters in 'grid' ({param: [values]}),
+    all currencies and all date windows [(begin, end), ...].
+    Returns a dataframe with 1 row per run: currency, begin, end, the parameters and the metrics (see
+    vectorized.backtest_metrics()), sorted by 'sort_by'.
+    'frames' ({currency: ohlc}) can be passed instead of loading the data from the database.
+    '''
+    windows = windows or [(datetime.datetime(2000, 1, 1), datetime.datetime(2020, 12, 31))]
+    frames = frames if frames is not None else load_prices(currencies, windows, frequency)
+    combinations = parameter_grid(grid)
+    tasks = [(runner(strategy), currency, window, combinations[i:i + chunksize], cash, percents, commission, warmup)
+             for currency in currencies for window in windows
+             for i in range(0, len(combinations), chunksize)]
+    rows = run_tasks(tasks, frames, processes)
+    columns = ['currency', 'begin', 'end'] + sorted(grid) + METRICS
+    results = pd.DataFrame(rows, columns=columns)
+    if sort_by in results:
+        results = results.sort_values(sort_by, ascending=False).reset_index(drop=True)
+    return results
+
+
+if __name__ == '__main__':
+    from backtesting.baseline_sma import BaselineSMAStrategy
+    from database.db_settings import CURRENCIES
+
+    windows = [(datetime.datetime(2014, 1, 1), datetime.datetime(2020, 12, 7))]
+    grid = {'sma_short_period': range(2, 52), 'sma_long_period': range(10, 210, 4)}
+    started = time.time()
+    results = sweep(BaselineSMAStrategy, grid, currencies=CURRENCIES, windows=windows)
+    print 'Runs: {} in {:.1f}s'.format(len(results), time.time() - started)
+    print results.head(20).to_string()
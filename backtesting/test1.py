@@ -10,19 +10,16 @@ import backtrader as bt
 
 
 # Create a Stratey
-from database.db_queries import get_all_resampled_data
+from backtesting.recording import RecordingStrategy
+from database.db_events import DEBUG
+from database.db_queries import get_ohlc
 
 
-class TestStrategy(bt.Strategy):
+class TestStrategy(RecordingStrategy):
     params = (
         ('maperiod', 5),
     )
 
-    def log(self, txt, dt=None):
-        ''' Logging function fot this strategy'''
-        dt = dt or self.datas[0].datetime.date(0)
-        print('%s, %s' % (dt.isoformat(), txt))
-
     def __init__(self):
         # Keep a reference to the "close" line in the data[0] dataseries
         self.dataclose = self.datas[0].close
@@ -50,24 +47,25 @@ class TestStrategy(bt.Strategy):
         if order.status in [order.Submitted, order.Accepted]:
             # Buy/Sell order submitted/accepted to/by broker - Nothing to do
             return
+        self.record_order(order)
 
         # Check if an order has been completed
         # Attention: broker could reject order if not enougth cash
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' %
-                    (order.executed.price,
-                     order.executed.value,
-                     order.executed.comm))
+                    'BUY EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f',
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm)
 
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             else:  # Sell
-                self.log('SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f' %
-                         (order.executed.price,
-                          order.executed.value,
-                          order.executed.comm))
+                self.log('SELL EXECUTED, Price: %.2f, Cost: %.2f, Comm %.2f',
+                         order.executed.price,
+                         order.executed.value,
+                         order.executed.comm)
 
             self.bar_executed = len(self)
 
@@ -80,13 +78,14 @@ class TestStrategy(bt.Strategy):
     def notify_trade(self, trade):
         if not trade.isclosed:
             return
+        self.record_trade(trade)
 
-        self.log('OPERATION PROFIT, GROSS %.2f, NET %.2f' %
-                 (trade.pnl, trade.pnlcomm))
+        self.log('OPERATION PROFIT, GROSS %.2f, NET %.2f',
+                 trade.pnl, trade.pnlcomm)
 
     def next(self):
         # Simply log the closing price of the series from the reference
-        self.log('Close, %.2f' % self.dataclose[0])
+        self.log('Close, %.2f', self.dataclose[0], level=DEBUG)
 
         # dt = self.data.datetime.date()
         #
@@ -111,7 +110,7 @@ class TestStrategy(bt.Strategy):
             # Not yet ... we MIGHT BUY if ...
             if self.dataclose[0] > self.sma[0]*1.01:
                 # BUY, BUY, BUY!!! (with all possible default parameters)
-                self.log('BUY CREATE, %.2f' % self.dataclose[0])
+                self.log('BUY CREATE, %.2f', self.dataclose[0])
 
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.buy()
@@ -121,7 +120,7 @@ class TestStrategy(bt.Strategy):
         else:
             if self.dataclose[0] < self.sma[0]:
                 # SELL, SELL, SELL!!! (with all possible default parameters)
-                self.log('SELL CREATE, %.2f' % self.dataclose[0])
+                self.log('SELL CREATE, %.2f', self.dataclose[0])
 
                 # Keep track of the created order to avoid a 2nd order
                 self.order = self.sell()
@@ -140,12 +139,9 @@ if __name__ == '__main__':
     # datapath = os.path.join(modpath, 'datas/orcl-1995-2014.txt')
 
     # Create a Data Feed
-    usd_open = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='open')
-    usd_high = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='high')
-    usd_low = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='low')
-    usd_close = get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='close')
-    usd_data = pd.concat([usd_open, usd_high, usd_low, usd_close], axis=1)
-    data = bt.feeds.PandasData(dataname=usd_data, fromdate=datetime.datetime(2004, 1, 1), todate=datetime.datetime(2005, 1, 1))
+    fromdate, todate = datetime.datetime(2004, 1, 1), datetime.datetime(2005, 1, 1)
+    usd_data = get_ohlc(currency='EURUSD', type='resampled', frequency='D', begin=fromdate, end=todate)
+    data = bt.feeds.PandasData(dataname=usd_data, fromdate=fromdate, todate=todate)
 
     # Add the Data Feed to Cerebro
     cerebro.adddata(data)
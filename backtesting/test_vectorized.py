@@ -0,0 +1,116 @@
+'''
+Parity of the vectorized backtests (vectorized.py) with the backtrader strategies:
+the fills (bar, side, size, price), the trades and the portfolio value at every bar must be the same.
+The fixture is a random walk with 4 decimals (PRICE_DECIMALS), like the stored prices: see the limits in vectorized.py.
+    python -m unittest backtesting.test_vectorized
+'''
+import unittest
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+from backtesting.baseline_sma import BaselineSMAStrategy
+from backtesting.simple_sma import SimpleSMAStrategy
+from backtesting.vectorized import backtest_baseline_sma, backtest_simple_sma
+from database.db_events import quiet, ERROR
+from database.db_settings import PRICE_DECIMALS
+
+CASH = 1000.0
+PERCENTS = 90
+
+
+def ohlc_fixture(bars=1500, seed=1):
+    '''
+    Daily ohlc bars of a random walk, rounded to PRICE_DECIMALS
+    '''
+    random = np.random.RandomState(seed)
+    close = 1.1 + np.cumsum(random.normal(0, 0.01, bars))
+    open = np.append(close[0], close[:-1]) + random.normal(0, 0.001, bars)
+    high = np.maximum(open, close) + np.abs(random.normal(0, 0.002, bars))
+    low = np.minimum(open, close) - np.abs(random.normal(0, 0.002, bars))
+    index = pd.date_range('2010-01-01', periods=bars, freq='D', name='date')
+    return pd.DataFrame({'open': open, 'high': high, 'low': low, 'close': close}, index=index,
+                        columns=['open', 'high', 'low', 'close']).round(PRICE_DECIMALS)
+
+
+class Equity(bt.Analyzer):
+    '''
+    The portfolio value at the end of every bar (also before the indicators are ready)
+    '''
+
+    def start(self):
+        self.values = []
+
+    def prenext(self):
+        self.next()
+
+    def next(self):
+        self.values.append(self.strategy.broker.getvalue())
+
+    def get_analysis(self):
+        return self.values
+
+
+def run_backtrader(ohlc, strategy, commission, **params):
+    '''
+    Returns (fills, trades, equity): the completed orders and closed trades recorded by the strategy
+    (see recording.py) and the value at every bar
+    '''
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(strategy, **params)
+    cerebro.adddata(bt.feeds.PandasData(dataname=ohlc))
+    cerebro.broker.setcash(CASH)
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=PERCENTS)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(Equity, _name='equity')
+    with quiet(ERROR):
+        strat = cerebro.run()[0]
+    orders = strat.orders.to_frame()
+    fills = orders[orders.status == bt.Order.Completed]
+    return fills, strat.trades.to_frame(), np.array(strat.analyzers.equity.get_analysis())
+
+
+class VectorizedParityTest(unittest.TestCase):
+    ohlc = ohlc_fixture()
+
+    def check_parity(self, strategy, vectorized, commission, **params):
+        fills, trades, equity = run_backtrader(self.ohlc, strategy, commission, **params)
+        result = vectorized(self.ohlc, cash=CASH, percents=PERCENTS, commission=commission, **params)
+        closed = result.trades[result.trades.exit_bar >= 0]
+        self.assertGreater(len(closed), 10)  # The fixture must trade
+
+        # Fills: 1 buy per trade, 1 sell per closed trade, in bar order (the bar is len(strategy): 1 based)
+        buys, sells = fills[fills.side == 1], fills[fills.side == -1]
+        np.testing.assert_array_equal(buys.bar.values - 1, result.trades.entry_bar.values)
+        np.testing.assert_array_equal(sells.bar.values - 1, closed.exit_bar.values)
+        np.testing.assert_allclose(buys.price.values, result.trades.entry_price.values, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(sells.price.values, closed.exit_price.values, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(buys['size'].values, result.trades['size'].values, rtol=1e-12)
+        np.testing.assert_allclose(-sells['size'].values, closed['size'].values, rtol=1e-12)
+
+        # Closed trades
+        self.assertEqual(len(trades), len(closed))
+        np.testing.assert_allclose(trades.pnl.values, closed.pnl.values, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(trades.pnlcomm.values, closed.pnlcomm.values, rtol=1e-9, atol=1e-9)
+
+        # Equity curve
+        self.assertEqual(len(equity), len(result.equity))
+        np.testing.assert_allclose(equity, np.asarray(result.equity), rtol=1e-9)
+        self.assertAlmostEqual(equity[-1], result.value, places=6)
+
+    def test_baseline_sma(self):
+        self.check_parity(BaselineSMAStrategy, backtest_baseline_sma, 0., sma_short_period=7, sma_long_period=28)
+
+    def test_baseline_sma_commission(self):
+        self.check_parity(BaselineSMAStrategy, backtest_baseline_sma, 0.001, sma_short_period=7, sma_long_period=28)
+
+    def test_simple_sma(self):
+        self.check_parity(SimpleSMAStrategy, backtest_simple_sma, 0., smaperiod=5)
+
+    def test_simple_sma_commission(self):
+        self.check_parity(SimpleSMAStrategy, backtest_simple_sma, 0.001, smaperiod=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
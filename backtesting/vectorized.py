@@ -0,0 +1,230 @@
+'''
+Vectorized (numpy) versions of the SMA strategies, for parameter sweeps on long or minute level series.
+The rules and the broker behaviour are the same as with backtrader:
+- the signals are evaluated on the close of a bar, the orders are filled at the open of the next bar
+- buy size = cash * percents / 100 / close (PercentSizer), sell size = position size
+- commission = size * price * commission (percentage commission, like broker.setcommission())
+- a buy is rejected (Margin) if its cost + commission at the fill price is more than the cash
+With percents=100 backtrader also rejects some buys where the cost equals the cash (rounding of
+cash - cash / close * close), so the results only match exactly with percents < 100.
+The SMAs are exact sums of the prices in units of 10 ** -PRICE_DECIMALS (see sma()), so the results only match
+backtrader on prices with at most PRICE_DECIMALS decimals, like the stored data. On prices with more decimals the
+prices are rounded, a cross can fall on another bar and the trades differ.
+The parity is tested in test_vectorized.py.
+'''
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from business_logic.rolling import rolling_mean
+from database.db_settings import PRICE_DECIMALS
+
+Backtest = namedtuple('Backtest', ['equity', 'position', 'trades', 'value'])
+
+
+def sma(close, period, indicators=None):
+    if indicators is not None:
+        return indicators.sma(close, period)
+    return rolling_mean(close, period, PRICE_DECIMALS)
+
+
+def baseline_sma_signals(close, sma_short_period=5, sma_long_period=14, short_sma=None, long_sma=None, indicators=None):
+    '''
+    Signals of BaselineSMAStrategy: buy when short SMA > long SMA, sell when short SMA <= long SMA.
+    Precomputed SMA arrays or an IndicatorCache ('indicators') can be passed in.
+    '''
+    if short_sma is None: short_sma = sma(close, sma_short_period, indicators)
+    if long_sma is None: long_sma = sma(close, sma_long_period, indicators)
+    ready = np.isfinite(short_sma) & np.isfinite(long_sma)
+    with np.errstate(invalid='ignore'):
+        return ready & (short_sma > long_sma), ready & (short_sma <= long_sma)
+
+
+def simple_sma_signals(close, smaperiod=5, close_sma=None, indicators=None):
+    '''
+    Signals of SimpleSMAStrategy: buy when close > SMA * 1.01, sell when close < SMA.
+    '''
+    if close_sma is None: close_sma = sma(close, smaperiod, indicators)
+    ready = np.isfinite(close_sma)
+    with np.errstate(invalid='ignore'):
+        return ready & (close > close_sma * 1.01), ready & (close < close_sma)
+
+
+# Vectorized signals of the backtrader strategies (by class name), called with the strategy params
+SIGNALS = {'BaselineSMAStrategy': baseline_sma_signals,
+           'SimpleSMAStrategy': simple_sma_signals}
+
+
+def run_signals(open, close, entry, exit, cash=1000.0, percents=100, commission=0., start=0, stop=None, dates=None):
+    '''
+    Runs a long only strategy on entry/exit signal arrays and returns a Backtest:
+    - equity: portfolio value (cash + size * close) at every bar
+    - position: size held at every bar
+    - trades: dataframe with 1 row per trade (the last one can still be open: exit_bar = -1)
+    - value: final portfolio value
+    Only bars start ... stop - 1 are traded. Signals before 'start' are ignored,
+    so indicators computed on the full history can be used (no warm-up inside the window).
+    'commission' is a fraction (0.001 = 0.1%) and 'percents' the PercentSizer percentage.
+    '''
+    open = np.asarray(open, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    stop = n if stop is None else stop
+    pct = percents / 100.
+
+    # A buy at bar i is filled at open[i + 1]; it's rejected if it costs more than the cash.
+    # The size is a fixed fraction of the cash, so this doesn't depend on the cash itself.
+    fill_open = np.append(open[1:], np.nan)
+    accepted = pct * (1 + commission) <= 1
+    with np.errstate(invalid='ignore'):
+        accepted = accepted & (pct * fill_open * (1 + commission) <= close)
+    window = np.zeros(n, dtype=bool)
+    window[start:stop - 1] = True  # An order at the last bar is never filled
+    buy = window & entry & accepted
+    sell = window & exit & ~buy
+
+    # Wanted position after each bar: 1 after a buy signal, 0 after a sell signal, unchanged otherwise
+    wanted = np.full(n, np.nan)
+    wanted[buy] = 1.
+    wanted[sell] = 0.
+    wanted[:start] = 0.
+    wanted = pd.Series(wanted).ffill().fillna(0.).values
+    held = np.zeros(n, dtype=bool)
+    held[1:] = wanted[:-1] > 0  # Orders are filled on the next bar
+    held[:start] = False
+
+    changes = np.diff(np.concatenate([[0], held.astype(np.int8)]))
+    entry_bars = np.flatnonzero(changes == 1)  # Bars where a buy was filled (at the open)
+    exit_bars = np.flatnonzero(changes == -1)  # Bars where a sell was filled (at the open)
+
+    # Cash after each closed trade: every trade multiplies the cash by a growth factor
+    entry_open = open[entry_bars]
+    entry_size_per_cash = pct / close[entry_bars - 1]  # PercentSizer on the close of the signal bar
+    closed = len(exit_bars)
+    growth = 1 + entry_size_per_cash[:closed] * (open[exit_bars] * (1 - commission) - entry_open[:closed] * (1 + commission))
+    cash_before = cash * np.concatenate([[1.], np.cumprod(growth)])[:len(entry_bars)]
+    sizes = cash_before * entry_size_per_cash
+    cash_in_market = cash_before - sizes * entry_open * (1 + commission)  # Cash left after the buy
+
+    # Equity at every bar
+    trade = np.cumsum(changes == 1) - 1  # Index of the current / last trade
+    done = np.cumsum(changes == -1)  # Number of closed trades
+    flat_cash = cash * np.concatenate([[1.], np.cumprod(growth)])[done]
+    if len(entry_bars):
+        position = np.where(held, sizes[trade.clip(0)], 0.)
+        equity = np.where(held, cash_in_market[trade.clip(0)] + position * close, flat_cash)
+    else:
+        position, equity = np.zeros(n), flat_cash
+
+    exit_price = np.full(len(entry_bars), np.nan)
+    exit_price[:closed] = open[exit_bars]
+    pnl = sizes * (exit_price - entry_open)
+    comm = sizes * entry_open * commission + np.nan_to_num(sizes * exit_price * commission)
+    exits = np.full(len(entry_bars), -1)
+    exits[:closed] = exit_bars
+    trades = pd.DataFrame({'entry_bar': entry_bars, 'exit_bar': exits,
+                           'entry_price': entry_open, 'exit_price': exit_price,
+                           'size': sizes, 'pnl': pnl, 'pnlcomm': pnl - comm},
+                          columns=['entry_bar', 'exit_bar', 'entry_price', 'exit_price', 'size', 'pnl', 'pnlcomm'])
+    if dates is not None:
+        trades['entry_date'] = dates[entry_bars]
+        trades['exit_date'] = pd.NaT
+        trades.loc[trades.exit_bar >= 0, 'exit_date'] = dates[exit_bars]
+        equity = pd.Series(equity, index=dates)
+    equity = equity[start:stop]
+    value = float(np.asarray(equity)[-1]) if len(equity) else cash
+    return Backtest(equity=equity, position=position[start:stop], trades=trades, value=value)
+
+
+def backtest_baseline_sma(ohlc, sma_short_period=5, sma_long_period=14, cash=1000.0, percents=100, commission=0.):
+    close = ohlc['close'].values
+    entry, exit = baseline_sma_signals(close, sma_short_period, sma_long_period)
+    return run_signals(ohlc['open'].values, close, entry, exit, cash=cash, percents=percents, commission=commission,
+                       dates=ohlc.index)
+
+
+def backtest_simple_sma(ohlc, smaperiod=5, cash=1000.0, percents=100, commission=0.):
+    close = ohlc['close'].values
+    entry, exit = simple_sma_signals(close, smaperiod)
+    return run_signals(ohlc['open'].values, close, entry, exit, cash=cash, percents=percents, commission=commission,
+                       dates=ohlc.index)
+
+
+def backtest_metrics(result, cash=1000.0, tann=252):
+    '''
+    The metrics of the backtrader analyzers used in the scripts, computed from a Backtest:
+    - total_return: % (like 'Total return')
+    - rnorm100: annualized return in % (Returns analyzer, 'tann' periods per year)
+    - sqn: System Quality Number of the closed trades (SQN analyzer)
+    - max_drawdown, max_moneydown, max_drawdown_len: (DrawDown analyzer)
+    '''
+    equity = np.asarray(result.equity, dtype=np.float64)
+    value = result.value
+    rtot = np.log(value / cash) if value > 0 else -np.inf
+    rnorm100 = np.expm1(rtot / len(equity) * tann) * 100 if len(equity) else 0.
+
+    pnl = result.trades.pnlcomm.values[result.trades.exit_bar.values >= 0]
+    if len(pnl) > 1:
+        std = pnl.std()  # Population std, like backtrader
+        sqn = np.sqrt(len(pnl)) * pnl.mean() / std if std else np.nan
+    else:
+        sqn = 0.
+
+    maxvalue = np.maximum.accumulate(np.concatenate([[cash], equity]))[1:]
+    moneydown = maxvalue - equity
+    drawdown = 100. * moneydown / maxvalue
+    # Length of a drawdown: number of bars since the last new high
+    down = drawdown > 0
+    bars = np.arange(len(down))
+    last_high = np.maximum.accumulate(np.where(down, -1, bars))
+    lengths = np.where(down, bars - last_high, 0)
+    return {'value': value,
+            'total_return': 100. * (value - cash) / cash,
+            'rnorm100': rnorm100,
+            'sqn': sqn,
+            'trades': len(pnl),
+            'max_drawdown': drawdown.max() if len(drawdown) else 0.,
+            'max_moneydown': moneydown.max() if len(moneydown) else 0.,
+            'max_drawdown_len': int(lengths.max()) if len(lengths) else 0}
+
+
+def compare_with_backtrader(ohlc, sma_short_period=7, sma_long_period=28, cash=1000.0, percents=90, commission=0.):
+    '''
+    Runs BaselineSMAStrategy with backtrader and with backtest_baseline_sma() on the same data.
+    Returns ((backtrader value, trades), (vectorized value, trades)).
+    '''
+    import backtrader as bt
+    from backtrader import analyzers
+    from backtesting.baseline_sma import BaselineSMAStrategy
+    from database.db_events import quiet, ERROR
+
+    cerebro = bt.Cerebro()
+    cerebro.addstrategy(BaselineSMAStrategy, sma_short_period=sma_short_period, sma_long_period=sma_long_period)
+    cerebro.adddata(bt.feeds.PandasData(dataname=ohlc))
+    cerebro.broker.setcash(cash)
+    cerebro.addsizer(bt.sizers.PercentSizer, percents=percents)
+    cerebro.broker.setcommission(commission=commission)
+    cerebro.addanalyzer(analyzers.TradeAnalyzer, _name='trades')
+    with quiet(ERROR):
+        strat = cerebro.run()[0]
+    bt_trades = strat.analyzers.trades.get_analysis()
+    bt_trades = bt_trades.total.total if 'total' in bt_trades else 0
+
+    result = backtest_baseline_sma(ohlc, sma_short_period, sma_long_period, cash=cash, percents=percents,
+                                   commission=commission)
+    return (cerebro.broker.getvalue(), bt_trades), (result.value, len(result.trades))
+
+
+if __name__ == '__main__':
+    # Parity check with backtrader on the stored daily data
+    import datetime
+    from database.db_queries import get_ohlc
+
+    fromdate, todate = datetime.datetime(2014, 1, 1), datetime.datetime(2020, 12, 7)
+    usd_data = get_ohlc(currency='EURUSD', type='resampled', frequency='D', begin=fromdate, end=todate)
+    for commission in [0., 0.001]:
+        (bt_value, bt_trades), (value, trades) = compare_with_backtrader(usd_data, commission=commission)
+        print 'Commission: {} Backtrader: {:.4f} ({} trades) Vectorized: {:.4f} ({} trades) => {}'.format(
+            commission, bt_value, bt_trades, value, trades,
+            'OK' if abs(bt_value - value) < 1e-6 and bt_trades == trades else 'DIFFERENT')
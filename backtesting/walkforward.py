@@ -0,0 +1,92 @@
+'''
+Walk-forward evaluation: the history is split in rolling in-sample / out-of-sample windows,
+the parameters are optimized (sweep) on every in-sample window and evaluated on the next out-of-sample window.
+The prices are loaded once; vectorized strategies use the indicators of the full history in every window,
+so the warm-up isn't repeated at the start of each window. The windows run in parallel (see sweep.run_tasks()).
+'''
+import datetime
+import time
+
+import pandas as pd
+
+from backtesting.sweep import METRICS, load_prices, run_tasks, runner, sweep
+
+# Window ends are included: a window ends 1 ns before the next one begins
+ONE_NS = pd.Timedelta(1)
+
+
+def walk_forward_windows(begin, end, in_sample=pd.DateOffset(years=2), out_sample=pd.DateOffset(months=6),
+                         anchored=False):
+    '''
+    [((in-sample begin, in-sample end), (out-of-sample begin, out-of-sample end)), ...]
+    The out-of-sample windows follow each other. With 'anchored' all in-sample windows start at 'begin'.
+    '''
+    begin, end = pd.Timestamp(begin), pd.Timestamp(end)
+    windows = []
+    is_begin, oos_begin = begin, begin + in_sample
+    while oos_begin <= end:
+        oos_end = min(oos_begin + out_sample - ONE_NS, end)
+        windows.append(((is_begin, oos_begin - ONE_NS), (oos_begin, oos_end)))
+        oos_begin = oos_begin + out_sample
+        is_begin = begin if anchored else is_begin + out_sample
+    return windows
+
+
+def walk_forward(strategy, grid, currencies=('EURUSD',), begin=datetime.datetime(2010, 1, 1),
+                 end=datetime.datetime(2020, 12, 7), in_sample=pd.DateOffset(years=2),
+                 out_sample=pd.DateOffset(months=6), anchored=False, frequency='D', cash=1000.0, percents=90,
+                 commission=0., sort_by='sqn', processes=None, frames=None):
+    '''
+    Returns a dataframe with 1 row per (currency, out-of-sample window): the in-sample window, the best
+    parameters on it (highest 'sort_by'), its in-sample 'sort_by' and the out-of-sample metrics.
+    '''
+    windows = walk_forward_windows(begin, end, in_sample, out_sample, anchored)
+    if not windows:
+        return pd.DataFrame()
+    if frames is None:
+        frames = load_prices(currencies, [(windows[0][0][0], windows[-1][1][1])], frequency)
+
+    # Optimize on the in-sample windows
+    optimized = sweep(strategy, grid, currencies, windows=[window[0] for window in windows], cash=cash,
+                      percents=percents, commission=commission, processes=processes, frames=frames,
+                      sort_by=sort_by, warmup=True)
+    best = optimized.dropna(subset=[sort_by]).drop_duplicates(['currency', 'begin']).set_index(['currency', 'begin'])
+
+    # Evaluate the best parameters on the out-of-sample windows
+    tasks, in_samples = [], {}
+    for currency in currencies:
+        for is_window, oos_window in windows:
+            if (currency, is_window[0]) not in best.index:
+                continue
+            optimum = best.loc[(currency, is_window[0])]
+            params = dict((name, optimum[name]) for name in grid)
+            in_samples[(currency, oos_window[0])] = (is_window[0], is_window[1], optimum[sort_by])
+            tasks.append((runner(strategy), currency, oos_window, [params], cash, percents, commission, True))
+    rows = run_tasks(tasks, frames, processes)
+    for row in rows:
+        row['is_begin'], row['is_end'], row['is_' + sort_by] = in_samples[(row['currency'], row['begin'])]
+
+    columns = ['currency', 'is_begin', 'is_end', 'begin', 'end'] + sorted(grid) + ['is_' + sort_by] + METRICS
+    return pd.DataFrame(rows, columns=columns).sort_values(['currency', 'begin']).reset_index(drop=True)
+
+
+def chained_returns(results):
+    '''
+    Total return (%) per currency of trading the out-of-sample windows after each other.
+    '''
+    growth = (1 + results['total_return'].fillna(0.) / 100.).groupby(results['currency']).prod()
+    return 100. * (growth - 1)
+
+
+if __name__ == '__main__':
+    from backtesting.baseline_sma import BaselineSMAStrategy
+    from database.db_settings import CURRENCIES
+
+    grid = {'sma_short_period': range(2, 30), 'sma_long_period': range(10, 110, 4)}
+    started = time.time()
+    results = walk_forward(BaselineSMAStrategy, grid, currencies=CURRENCIES, begin=datetime.datetime(2010, 1, 1),
+                           end=datetime.datetime(2020, 12, 7))
+    print 'Walk forward in {:.1f}s'.format(time.time() - started)
+    print results.to_string()
+    print 'Chained out-of-sample returns (%):'
+    print chained_returns(results).to_string()
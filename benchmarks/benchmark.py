@@ -0,0 +1,224 @@
+'''
+Benchmark of the data pipeline and a backtest, on deterministic synthetic minute data for all CURRENCIES:
+csv parsing (load_raw_data), storing, querying, resampling, returns and a BaselineSMAStrategy run.
+By default it runs against mongomock (an in-memory stand-in for mongodb), with --mongo against the local mongod
+(database BENCHMARK_DATABASE, dropped first). The caches are emptied before every step that reads data.
+Every step reports its time and its memory: the peak RSS during the step above the RSS at its start
+(ru_maxrss can't be used: it's the peak of the whole process so far). With a baseline JSON the results are compared
+to it and a step is a regression if it's more than 'tolerance' slower (or bigger).
+    python -m benchmarks.benchmark --save        # writes the baseline
+    python -m benchmarks.benchmark               # compares with it, exit code 1 on a regression
+'''
+import argparse
+import ctypes
+import gc
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from database import db_cache, db_events, db_memo, db_queries, db_setup, db_workers
+from database.db_events import ERROR
+from database.db_settings import CURRENCIES, HISTDATA_EST_OFFSET
+
+BENCHMARK_DATABASE = 'forex_benchmark'
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MIN_SECONDS = 0.05  # Time differences below this are noise
+MIN_MB = 5.  # Memory differences below this are noise (allocator, sampling)
+
+
+def write_histdata(currency, year, months, seed):
+    '''
+    Writes the first 'months' of a year of random walk minute bars (weekdays only) as a histdata csv file (EST timestamps)
+    '''
+    state = np.random.RandomState(seed)
+    dates = pd.date_range('{}-01-01'.format(year), pd.Timestamp('{}-01-01'.format(year)) + pd.DateOffset(months=months),
+                          freq='min', closed='left')
+    dates = dates[dates.dayofweek < 5]
+    close = np.round(1.2 + state.randn(len(dates)).cumsum() * 0.0001, 4)
+    open = np.round(np.append(close[0], close[:-1]), 4)
+    spread = np.round(np.abs(state.randn(len(dates))) * 0.0002, 4)
+    frame = pd.DataFrame({'date': (dates - pd.Timedelta(hours=HISTDATA_EST_OFFSET)).strftime('%Y%m%d %H%M%S'),
+                          'open': open, 'high': np.maximum(open, close) + spread,
+                          'low': np.minimum(open, close) - spread, 'close': close, 'volume': 0},
+                         columns=['date', 'open', 'high', 'low', 'close', 'volume'])
+    filename = db_workers.raw_data_file(currency, year)
+    if not os.path.isdir(os.path.dirname(filename)): os.makedirs(os.path.dirname(filename))
+    frame.to_csv(filename, sep=';', header=False, index=False, float_format='%.4f')
+
+
+def empty_caches(cache_dir):
+    db_memo.frame_cache.clear()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def release_memory():
+    '''
+    Returns the memory freed by the earlier steps to the os (glibc malloc_trim), so a step that reuses it
+    still shows its memory
+    '''
+    gc.collect()
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def rss_mb():
+    '''
+    Current resident memory of the process (linux: /proc/self/statm)
+    '''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 1024. ** 2
+
+
+class PeakMemory(threading.Thread):
+    '''
+    Samples the RSS every 'interval' seconds till stop(): peak_mb() is the highest RSS above the RSS at the start
+    '''
+
+    def __init__(self, interval=0.005):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_mb = self.peak = rss_mb()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, rss_mb())
+
+    def peak_mb(self):
+        return self.peak - self.start_mb
+
+
+def run_benchmarks(years=(2017,), months=12, mongo=False, frequency='H'):
+    '''
+    Runs all steps and returns {step: {'seconds': ..., 'step_mb': ...}} ('step_mb': see PeakMemory)
+    '''
+    from backtesting.baseline_sma import BaselineSMAStrategy
+    from backtesting.sweep import run_backtrader
+    from business_logic.analytics import calculate_returns
+
+    if mongo:
+        db_queries.DB = BENCHMARK_DATABASE
+        db_queries.get_client().drop_database(BENCHMARK_DATABASE)
+    else:
+        import mongomock
+        db_queries._client = mongomock.MongoClient()
+    db_events.configure(level=ERROR)
+    db_setup.setup_database_forex()
+    workdir = tempfile.mkdtemp(prefix='forex_benchmark_')
+    db_workers.RAW_DATA_PATH = os.path.join(workdir, 'raw') + os.sep
+    db_cache.CACHE_DIR = os.path.join(workdir, 'cache')
+    for i, currency in enumerate(CURRENCIES):
+        for year in years:
+            write_histdata(currency, year, months, seed=1000 * i + year)
+
+    results = {}
+
+    def step(name, function):
+        release_memory()
+        memory = PeakMemory()
+        memory.start()
+        started = time.time()
+        try:
+            result = function()
+        finally:
+            memory.stop()
+        results[name] = {'seconds': time.time() - started, 'step_mb': memory.peak_mb()}
+        return result
+
+    try:
+        frames = step('load_raw_data', lambda: dict(((cur, year), db_workers.load_raw_data(cur, year))
+                                                    for cur in CURRENCIES for year in years))
+        step('store_raw_data', lambda: [db_queries.store_raw_data(cur, year, 0, ohlc)
+                                        for (cur, year), ohlc in sorted(frames.items())])
+        frames.clear()  # Free the parsed data before the next steps
+        empty_caches(db_cache.CACHE_DIR)
+        step('get_all_raw_data', lambda: [db_queries.get_all_raw_data(cur, 'min', str(years[0]), str(years[-1]), 'close')
+                                          for cur in CURRENCIES])
+        empty_caches(db_cache.CACHE_DIR)
+        step('resample_store_raw_data', lambda: [db_workers.resample_store_raw_data(cur, 'min', scale)
+                                                 for cur in CURRENCIES for scale in ['D', frequency]])
+        empty_caches(db_cache.CACHE_DIR)
+        step('calculate_returns', lambda: calculate_returns(CURRENCIES, 'D'))
+        ohlc = db_queries.get_ohlc('EURUSD', 'resampled', frequency)
+        step('BaselineSMAStrategy', lambda: run_backtrader(BaselineSMAStrategy, ohlc,
+                                                           {'sma_short_period': 7, 'sma_long_period': 28},
+                                                           cash=1000., percents=90, commission=0.))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if mongo: db_queries.get_client().drop_database(BENCHMARK_DATABASE)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    '''
+    Returns [(step, metric, baseline value, value, ratio), ...] of the regressions:
+    a value more than 'tolerance' (fraction) above the baseline
+    '''
+    regressions = []
+    for name, metrics in sorted(results.items()):
+        for metric, value in sorted(metrics.items()):
+            base = baseline.get(name, {}).get(metric)
+            if not base: continue
+            if metric == 'seconds' and value - base < MIN_SECONDS: continue
+            if metric == 'step_mb' and value - base < MIN_MB: continue
+            if value > base * (1 + tolerance):
+                regressions.append((name, metric, base, value, value / base))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the data pipeline and a backtest')
+    parser.add_argument('--years', type=int, nargs='+', default=[2017], help='years of synthetic minute data')
+    parser.add_argument('--months', type=int, default=12, help='months of data per year')
+    parser.add_argument('--mongo', action='store_true', help='use the local mongod instead of mongomock')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown, eg: 0.25 = 25%%')
+    args = parser.parse_args(args)
+
+    config = {'years': args.years, 'months': args.months, 'mongo': args.mongo}
+    results = run_benchmarks(years=args.years, months=args.months, mongo=args.mongo)
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['config'] == config:
+            baseline = saved['steps']
+        else:
+            print 'The baseline was made with {}: not compared'.format(saved['config'])
+    print '{:<25} {:>10} {:>10} {:>12} {:>12}'.format('step', 'seconds', 'baseline', 'step MB', 'baseline')
+    for name in ['load_raw_data', 'store_raw_data', 'get_all_raw_data', 'resample_store_raw_data', 'calculate_returns',
+                 'BaselineSMAStrategy']:
+        base = baseline.get(name, {})
+        print '{:<25} {:>10.3f} {:>10} {:>12.1f} {:>12}'.format(
+            name, results[name]['seconds'], '{:.3f}'.format(base['seconds']) if 'seconds' in base else '-',
+            results[name]['step_mb'], '{:.1f}'.format(base['step_mb']) if 'step_mb' in base else '-')
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': config, 'steps': results}, f, indent=2, sort_keys=True)
+        print 'Saved the baseline in {}'.format(args.baseline)
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, base, value, ratio in regressions:
+        print 'REGRESSION {} {}: {:.3f} -> {:.3f} ({:+.0f}%)'.format(name, metric, base, value, 100 * (ratio - 1))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+'''
+Returns and cross-pair statistics of all currencies, computed on 1 aligned (dates x currencies) close matrix,
+for any stored frequency. Replaces db_workers.calculate_returns().
+The bars that get_panel() fills for a pair that doesn't have them aren't real prices: their returns are NaN
+(the next real bar has the return over the gap) and the volatility of a pair is computed on its real bars only,
+so the flat filled bars don't count as 0 returns. A correlation/covariance window with a filled bar of either pair is NaN.
+The results can be stored as documents of type 'analytics' (1 per currency and year), see store_analytics().
+'''
+import numpy as np
+import pandas as pd
+
+from business_logic.rolling import rolling_std, rolling_cov, rolling_corr
+from database.db_queries import get_panel, get_ohlc, store_series, BulkWriter
+from database.db_settings import CURRENCIES
+
+ANALYTICS_TYPE = 'analytics'
+
+
+def get_closes(currencies=CURRENCIES, frequency='D', begin=None, end=None, pricetype='close', real=False):
+    '''
+    Dataframe (dates x currencies) of the resampled 'pricetype'.
+    With real=True returns (prices, real): real is True where the currency has a stored bar (see get_panel()).
+    '''
+    panel = get_panel(currencies, 'resampled', frequency, begin, end, columns=[pricetype])
+    return (panel[pricetype], panel['real']) if real else panel[pricetype]
+
+
+def returns(prices, periods=1, log=False, real=None):
+    '''
+    Simple (or log) returns over 'periods' bars of every column, NaN where 'real' (dates x currencies) is False
+    '''
+    values = prices.values
+    result = np.full(values.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if log:
+            result[periods:] = np.log(values[periods:] / values[:-periods])
+        else:
+            result[periods:] = values[periods:] / values[:-periods] - 1
+    if real is not None: result[~np.asarray(real, dtype=bool)] = np.nan
+    return pd.DataFrame(result, index=prices.index, columns=prices.columns)
+
+
+def calculate_returns(currencies=CURRENCIES, frequency='D', begin=None, end=None, periods=1, log=False,
+                      pricetype='close'):
+    closes, real = get_closes(currencies, frequency, begin, end, pricetype, real=True)
+    return returns(closes, periods, log, real)
+
+
+def rolling_volatility(returns, window=20, annualize=None):
+    '''
+    Rolling std of the returns, multiplied by sqrt(annualize) if given (eg: 252 for daily returns)
+    '''
+    volatility = rolling_std(returns.values, window)
+    if annualize: volatility = volatility * np.sqrt(annualize)
+    return pd.DataFrame(volatility, index=returns.index, columns=returns.columns)
+
+
+def _matrix_frame(matrices, returns):
+    '''
+    (dates x currencies x currencies) array => dataframe with index (date, currency), like pandas rolling().corr()
+    '''
+    currencies = list(returns.columns)
+    index = pd.MultiIndex.from_product([returns.index, currencies], names=['date', 'currency'])
+    return pd.DataFrame(matrices.reshape(-1, len(currencies)), index=index, columns=currencies)
+
+
+def rolling_correlation(returns, window=20):
+    return _matrix_frame(rolling_corr(returns.values, window), returns)
+
+
+def rolling_covariance(returns, window=20):
+    return _matrix_frame(rolling_cov(returns.values, window), returns)
+
+
+def real_volatility(returns, real, window=20):
+    '''
+    Rolling std of every column on its real bars only (NaN on the other bars), like portfolio.real_signals()
+    '''
+    values = returns.values
+    real = np.asarray(real, dtype=bool)
+    volatility = np.full(values.shape, np.nan)
+    for i in range(values.shape[1]):
+        bars = np.flatnonzero(real[:, i])
+        volatility[bars, i] = rolling_std(values[bars, i], window)
+    return volatility
+
+
+def analytics_frames(closes, window=20, periods=1, real=None):
+    '''
+    {currency: dataframe} with the columns return, log_return, volatility_<window>,
+    corr_<window>_<other currency> and cov_<window>_<other currency>.
+    'real' (dates x currencies, see get_closes()): the returns and volatility of the filled bars are NaN.
+    '''
+    simple = returns(closes, periods, real=real)
+    logs = returns(closes, periods, log=True, real=real)
+    if real is None: volatility = rolling_std(simple.values, window)
+    else: volatility = real_volatility(simple, real, window)
+    cov = rolling_cov(simple.values, window)
+    corr = rolling_corr(simple.values, window)
+    frames = {}
+    for i, currency in enumerate(closes.columns):
+        columns = {'return': simple.values[:, i], 'log_return': logs.values[:, i],
+                   'volatility_{}'.format(window): volatility[:, i]}
+        for j, other in enumerate(closes.columns):
+            if i == j: continue
+            columns['corr_{}_{}'.format(window, other)] = corr[:, i, j]
+            columns['cov_{}_{}'.format(window, other)] = cov[:, i, j]
+        frames[currency] = pd.DataFrame(columns, index=closes.index, columns=sorted(columns))
+    return frames
+
+
+def store_analytics(currencies=CURRENCIES, frequency='D', begin=None, end=None, window=20, periods=1):
+    '''
+    Computes the analytics of all currencies in 1 pass and stores them as documents of type 'analytics'.
+    '''
+    closes, real = get_closes(currencies, frequency, begin, end, real=True)
+    frames = analytics_frames(closes, window, periods, real)
+    with BulkWriter() as writer:
+        for currency, frame in frames.items():
+            store_series(currency, ANALYTICS_TYPE, frequency, frame, writer=writer)
+    return frames
+
+
+def get_analytics(currency='EURUSD', frequency='D', begin=None, end=None, columns=('return', 'log_return')):
+    '''
+    Stored analytics of a currency, see store_analytics()
+    '''
+    return get_ohlc(currency=currency, type=ANALYTICS_TYPE, frequency=frequency, begin=begin, end=end,
+                    columns=list(columns))
+
+
+if __name__ == '__main__':
+    print calculate_returns(begin='2007', end='2008', periods=1)
+    print rolling_correlation(calculate_returns(begin='2017', end='2017'), window=20).tail(10)
@@ -0,0 +1,52 @@
+'''
+Cache of indicator series, so every distinct indicator of a price series is computed only once
+(eg: during a parameter sweep SMA(7) of EURUSD is shared by all grid cells with period 7).
+'''
+import hashlib
+
+import numpy as np
+
+from business_logic.rolling import rolling_mean, rolling_sum
+from database.db_memo import LRUCache
+from database.db_settings import PRICE_DECIMALS
+
+# name -> function(values, **params)
+INDICATORS = {'sma': lambda values, period: rolling_mean(values, period, PRICE_DECIMALS),
+              'sum': lambda values, period: rolling_sum(values, period)}
+
+
+def series_id(values):
+    '''
+    Identity of a series: hash of its values
+    '''
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=np.float64).tobytes()).hexdigest()
+
+
+class IndicatorCache(object):
+    '''
+    Indicator arrays keyed on (series, indicator, params). The arrays are read-only.
+    'series' identifies the values: a key given by the caller (eg: (currency, begin, end)) or the hash of the values.
+    '''
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.cache = LRUCache(max_bytes)
+        self.last_series = (None, None)  # (values, id) of the last hashed series
+
+    def get(self, values, indicator, series=None, **params):
+        values = np.asarray(values, dtype=np.float64)
+        if series is None:
+            if self.last_series[0] is not values:
+                self.last_series = (values, series_id(values))
+            series = self.last_series[1]
+        key = (series, indicator, tuple(sorted(params.items())))
+        result = self.cache.get(key)
+        if result is None:
+            result = INDICATORS[indicator](values, **params)
+            self.cache.put(key, result)
+        return result
+
+    def sma(self, values, period, series=None):
+        return self.get(values, 'sma', series=series, period=period)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,208 @@
+'''
+Batch technical indicators (SMA, EMA, Bollinger bands, RSI, ATR, MACD) of all currencies and timeframes,
+stored as documents of type 'indicator' (1 per currency, timeframe and year, see db_queries.store_series()),
+so notebooks and strategies read them with get_indicators() instead of computing them.
+The indicators work on contiguous float64 arrays (1 pair); the pairs are spread over a process pool.
+Every document holds the INDICATOR_VERSION it was computed with: documents of another version are recomputed.
+The definitions follow ta-lib: the EMA (and the Wilder averages of RSI and ATR) start with the SMA of the first bars.
+'''
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+
+from business_logic.rolling import rolling_mean, rolling_std
+from database import db_events, db_queries
+from database.db_events import log, ERROR
+from database.db_queries import get_db, get_ohlc, store_series, BulkWriter
+from database.db_settings import CURRENCIES, TIMEFRAMES, INDICATOR_SET, INDICATOR_VERSION
+
+INDICATOR_TYPE = 'indicator'
+
+
+def _first_valid(values):
+    valid = np.flatnonzero(np.isfinite(values))
+    return valid[0] if len(valid) else len(values)
+
+
+def smoothed(values, alpha, period):
+    '''
+    Exponential smoothing y[i] = alpha * x[i] + (1 - alpha) * y[i - 1], starting with the mean of the first 'period'
+    values (after leading NaNs). Computed per block of bars with cumulative sums instead of a python loop:
+    in a block y[i] = d ** i * (y0 + alpha * sum(x[k] / d ** k)) with d = 1 - alpha, the block is short enough
+    for d ** -i to stay finite.
+    '''
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    start = _first_valid(values)
+    if len(values) - start < period:
+        return out
+    decay = 1. - alpha
+    out[start + period - 1] = y = values[start:start + period].mean()
+    if decay == 0:
+        out[start + period:] = values[start + period:]
+        return out
+    block = max(1, int(100 * np.log(10) / -np.log(decay)))
+    powers = decay ** np.arange(1, block + 1)
+    for b in range(start + period, len(values), block):
+        x = values[b:b + block]
+        p = powers[:len(x)]
+        out[b:b + len(x)] = p * (y + alpha * np.cumsum(x / p))
+        y = out[b + len(x) - 1]
+    return out
+
+
+def sma(close, period=20):
+    return {'': rolling_mean(close, period)}
+
+
+def ema(close, period=20):
+    return {'': smoothed(close, 2. / (period + 1), period)}
+
+
+def bbands(close, period=20, nbdev=2):
+    '''
+    Middle band = SMA, upper / lower band = SMA +/- nbdev * population std
+    '''
+    middle, std = rolling_mean(close, period), rolling_std(close, period, ddof=0)
+    return {'upper': middle + nbdev * std, 'middle': middle, 'lower': middle - nbdev * std}
+
+
+def rsi(close, period=14):
+    '''
+    Wilder's RSI: 100 - 100 / (1 + average gain / average loss)
+    '''
+    change = np.append(np.nan, np.diff(close))
+    with np.errstate(invalid='ignore'):
+        gains, losses = np.where(change > 0, change, 0.), np.where(change < 0, -change, 0.)
+    gains[np.isnan(change)], losses[np.isnan(change)] = np.nan, np.nan
+    average_gain, average_loss = smoothed(gains, 1. / period, period), smoothed(losses, 1. / period, period)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'': np.where(average_loss == 0, 100., 100. - 100. / (1. + average_gain / average_loss))}
+
+
+def atr(high, low, close, period=14):
+    '''
+    Wilder's average of the true range max(high, previous close) - min(low, previous close)
+    '''
+    previous = np.append(np.nan, close[:-1])
+    with np.errstate(invalid='ignore'):
+        true_range = np.fmax(high, previous) - np.fmin(low, previous)
+    true_range[0] = np.nan  # Like ta-lib: the first bar has no previous close
+    return {'': smoothed(true_range, 1. / period, period)}
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    line = ema(close, fast)[''] - ema(close, slow)['']
+    signal_line = ema(line, signal)['']
+    return {'': line, 'signal': signal_line, 'hist': line - signal_line}
+
+
+# name -> (function, price columns it needs, outputs)
+INDICATORS = {'sma': (sma, ['close'], ['']),
+              'ema': (ema, ['close'], ['']),
+              'bbands': (bbands, ['close'], ['upper', 'middle', 'lower']),
+              'rsi': (rsi, ['close'], ['']),
+              'atr': (atr, ['high', 'low', 'close'], ['']),
+              'macd': (macd, ['close'], ['', 'signal', 'hist'])}
+
+
+def column_name(name, output, params):
+    '''
+    ('bbands', 'upper', {'period': 20, 'nbdev': 2}) => 'bbands_upper_2_20' (params sorted by name)
+    '''
+    return '_'.join([name] + ([output] if output else []) + [str(params[key]) for key in sorted(params)])
+
+
+def compute_indicators(ohlc, indicators=INDICATOR_SET):
+    '''
+    Dataframe with 1 column per output of the 'indicators' [(name, params), ...] on a ohlc dataframe
+    '''
+    prices = dict((col, np.ascontiguousarray(ohlc[col].values, dtype=np.float64)) for col in ohlc.columns)
+    columns = {}
+    for name, params in indicators:
+        function, inputs, _ = INDICATORS[name]
+        for output, values in function(*[prices[col] for col in inputs], **params).items():
+            columns[column_name(name, output, params)] = values
+    return pd.DataFrame(columns, index=ohlc.index, columns=sorted(columns))
+
+
+def is_current(currency, scale):
+    '''
+    True if the stored indicators of currency/scale have the current version and reach the last resampled bar
+    '''
+    query = {'currency': currency, 'freq': scale, 'year': {'$exists': True}}
+    last_bar = get_db().forex.find_one(dict(query, type='resampled'), {'end': True}, sort=[('end', -1)])
+    last = get_db().forex.find_one(dict(query, type=INDICATOR_TYPE), {'end': True}, sort=[('end', -1)])
+    outdated = get_db().forex.find_one(dict(query, type=INDICATOR_TYPE, version={'$ne': INDICATOR_VERSION}), {'_id': True})
+    return last_bar is not None and last is not None and outdated is None and last['end'] >= last_bar['end']
+
+
+def _init_worker():
+    db_queries._client = None  # Every worker has its own connection pool
+    db_events.configure(level=ERROR)
+
+
+def _store_task(task):
+    '''
+    Runs in a worker: computes and stores the indicators of 1 currency for all its timeframes.
+    Returns [(currency, scale, stored bars), ...]
+    '''
+    currency, scales, indicators, rebuild = task
+    results = []
+    with BulkWriter() as writer:
+        for scale in scales:
+            if not rebuild and is_current(currency, scale): continue
+            ohlc = get_ohlc(currency=currency, type='resampled', frequency=scale)
+            if ohlc.empty: continue
+            store_series(currency, INDICATOR_TYPE, scale, compute_indicators(ohlc, indicators), writer=writer,
+                         fields={'version': INDICATOR_VERSION})
+            writer.flush()
+            results.append((currency, scale, len(ohlc)))
+    return results
+
+
+def store_indicators(currency=None, scales=TIMEFRAMES, indicators=INDICATOR_SET, rebuild=False, processes=None):
+    '''
+    If currency == '' then all currencies
+    Computes and stores the indicators of all currencies and 'scales', 1 currency per worker.
+    The timeframes whose stored indicators are current (see is_current()) are skipped unless 'rebuild'.
+    Returns the number of stored bars.
+    '''
+    if currency: currencies = [currency]
+    else: currencies = CURRENCIES
+    tasks = [(cur, list(scales), indicators, rebuild) for cur in currencies]
+    if processes == 1:
+        results = map(_store_task, tasks)
+    else:
+        pool = Pool(processes=min(processes or cpu_count(), len(tasks)), initializer=_init_worker)
+        try:
+            results = pool.map(_store_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    stored = 0
+    for cur, scale, bars in [row for result in results for row in result]:
+        log.info('Stored %s %s-%s indicator bars', bars, cur, scale)
+        stored += bars
+    return stored
+
+
+def get_indicators(currency='EURUSD', frequency='D', columns=None, begin=None, end=None):
+    '''
+    Stored indicators of currency/frequency. 'columns': names from column_name(), eg: ['rsi_14', 'bbands_upper_2_20']
+    (default: all the columns of INDICATOR_SET).
+    '''
+    if columns is None:
+        columns = [column_name(name, output, params) for name, params in INDICATOR_SET
+                   for output in INDICATORS[name][2]]
+    return get_ohlc(currency=currency, type=INDICATOR_TYPE, frequency=frequency, begin=begin, end=end,
+                    columns=sorted(columns))
+
+
+if __name__ == '__main__':
+    started = time.time()
+    stored = store_indicators(rebuild=True)
+    print 'Stored {} indicator bars in {:.1f}s'.format(stored, time.time() - started)
+    print get_indicators(currency='EURUSD', frequency='D').tail(10)
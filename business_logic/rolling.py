@@ -0,0 +1,120 @@
+'''
+O(n) rolling window statistics on numpy arrays, computed from running sums instead of summing every window.
+The arrays can be 1D or 2D (bars x series); windows are taken along axis 0.
+A window with a NaN gives NaN, like the first window - 1 bars.
+'''
+import numpy as np
+
+
+def _window_sums(values, window):
+    '''
+    Returns (sums, counts, shift) of the windows ending at bar window - 1 ... n - 1.
+    The values are shifted by the mean of the first window before summing, to limit the rounding error of long running sums.
+    '''
+    valid = np.isfinite(values)
+    shift = np.nanmean(values[:window], axis=0) if np.any(valid[:window]) else 0.
+    shift = np.where(np.isfinite(shift), shift, 0.)
+    filled = np.where(valid, values - shift, 0.)
+    zeros = np.zeros((1,) + values.shape[1:])
+    csum = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    return csum[window:] - csum[:-window], ccount[window:] - ccount[:-window], shift
+
+
+def _decimal_window_sums(values, window, decimals):
+    '''
+    Like _window_sums() but exact, for values with a fixed number of decimals (like prices):
+    returns the sums as integers in units of 10 ** -decimals.
+    '''
+    valid = np.isfinite(values)
+    units = np.where(valid, np.round(values * 10 ** decimals), 0).astype(np.int64)
+    zeros = np.zeros((1,) + values.shape[1:], dtype=np.int64)
+    csum = np.concatenate([zeros, np.cumsum(units, axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    return csum[window:] - csum[:-window], ccount[window:] - ccount[:-window]
+
+
+def rolling_sum(values, window, decimals=None):
+    '''
+    With 'decimals' the sums are exact (see _decimal_window_sums()).
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if window < 1 or window > len(values):
+        return out
+    if decimals is None:
+        sums, counts, shift = _window_sums(values, window)
+        sums = sums + shift * window
+    else:
+        sums, counts = _decimal_window_sums(values, window, decimals)
+        sums = sums / float(10 ** decimals)
+    out[window - 1:] = np.where(counts == window, sums, np.nan)
+    return out
+
+
+def rolling_mean(values, window, decimals=None):
+    '''
+    With 'decimals' the mean is the correctly rounded result of the exact window sum / window,
+    so equal means (eg: 2 SMAs that cross) compare as equal, like with math.fsum() in backtrader.
+    '''
+    if decimals is None:
+        return rolling_sum(values, window) / window
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if window < 1 or window > len(values):
+        return out
+    sums, counts = _decimal_window_sums(values, window, decimals)
+    out[window - 1:] = np.where(counts == window, sums / float(window * 10 ** decimals), np.nan)
+    return out
+
+
+def rolling_std(values, window, ddof=1):
+    '''
+    Rolling standard deviation (ddof=1: sample std, like pandas)
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if window <= ddof or window > len(values):
+        return out
+    sums, counts, shift = _window_sums(values, window)
+    squares, _, square_shift = _window_sums((values - shift) ** 2, window)
+    squares = squares + square_shift * window
+    variance = np.maximum(squares - sums ** 2 / window, 0.) / (window - ddof)
+    out[window - 1:] = np.where(counts == window, np.sqrt(variance), np.nan)
+    return out
+
+
+def rolling_cov(values, window, ddof=1):
+    '''
+    Rolling covariance matrices of the columns of a 2D array (bars x series): returns a (bars x series x series) array.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    n, k = values.shape
+    out = np.full((n, k, k), np.nan)
+    if window <= ddof or window > n:
+        return out
+    valid = np.isfinite(values)
+    shift = np.nanmean(values[:window], axis=0) if np.any(valid[:window]) else np.zeros(k)
+    shift = np.where(np.isfinite(shift), shift, 0.)
+    filled = np.where(valid, values - shift, 0.)
+    zeros = np.zeros((1, k))
+    csum = np.concatenate([zeros, np.cumsum(filled, axis=0)])
+    ccount = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    cprod = np.concatenate([np.zeros((1, k, k)), np.cumsum(filled[:, :, None] * filled[:, None, :], axis=0)])
+    sums = csum[window:] - csum[:-window]
+    counts = ccount[window:] - ccount[:-window]
+    products = cprod[window:] - cprod[:-window]
+    cov = (products - sums[:, :, None] * sums[:, None, :] / window) / (window - ddof)
+    complete = counts == window
+    out[window - 1:] = np.where(complete[:, :, None] & complete[:, None, :], cov, np.nan)
+    return out
+
+
+def rolling_corr(values, window):
+    '''
+    Rolling correlation matrices of the columns of a 2D array: returns a (bars x series x series) array.
+    '''
+    cov = rolling_cov(values, window)
+    std = np.sqrt(np.maximum(np.diagonal(cov, axis1=1, axis2=2), 0.))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cov / (std[:, :, None] * std[:, None, :])
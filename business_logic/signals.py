@@ -0,0 +1,108 @@
+'''
+Batch signal engine: evaluates the SMA rules of the strategies (vectorized) on the stored resampled data
+of every currency and timeframe and stores the signal events as documents of type 'signal'
+(see db_queries.store_signals() / get_signals()).
+A signal event is a change of the wanted position: direction 1 = buy, -1 = sell, at the close of a bar.
+With incremental=True only the bars after the watermark (the last bar evaluated before) are evaluated.
+The watermarks are stored with type 'signal' and freq '<timeframe>/<rule id>'.
+'''
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from backtesting.vectorized import baseline_sma_signals, simple_sma_signals, sma
+from database.db_events import log
+from database.db_queries import get_ohlc, get_watermark, set_watermark, get_last_signal, store_signals, BulkWriter
+from database.db_settings import CURRENCIES, TIMEFRAMES, SIGNAL_RULES
+
+FLAT = -1  # State before the first event: flat like after a sell, so the first event is a buy
+
+
+def baseline_sma(close, sma_short_period=7, sma_long_period=28):
+    '''
+    BaselineSMAStrategy. Strength: (short SMA - long SMA) / long SMA
+    '''
+    short_sma, long_sma = sma(close, sma_short_period), sma(close, sma_long_period)
+    entry, exit = baseline_sma_signals(close, short_sma=short_sma, long_sma=long_sma)
+    return entry, exit, (short_sma - long_sma) / long_sma
+
+
+def simple_sma(close, smaperiod=5):
+    '''
+    SimpleSMAStrategy. Strength: (close - SMA) / SMA
+    '''
+    close_sma = sma(close, smaperiod)
+    entry, exit = simple_sma_signals(close, close_sma=close_sma)
+    return entry, exit, (close - close_sma) / close_sma
+
+
+# name -> (function, number of bars needed before a signal)
+RULES = {'baseline_sma': (baseline_sma, lambda params: params.get('sma_long_period', 28)),
+         'simple_sma': (simple_sma, lambda params: params.get('smaperiod', 5))}
+
+
+def rule_id(name, params):
+    '''
+    ('baseline_sma', {'sma_short_period': 7, 'sma_long_period': 28}) => 'baseline_sma_28_7' (params sorted by name)
+    '''
+    return '_'.join([name] + [str(params[key]) for key in sorted(params)])
+
+
+def signal_events(ohlc, name, params, state=0, after=None):
+    '''
+    Dataframe with the signal events (date, direction, strength, price) of rule 'name' on 'ohlc'.
+    'state' is the direction of the last event before the bars after 'after' (only those are evaluated),
+    0 if there's none: a sell is only an event after a buy.
+    '''
+    state = state or FLAT
+    close = ohlc['close'].values
+    entry, exit, strength = RULES[name][0](close, **params)
+    wanted = pd.Series(float('nan'), index=ohlc.index)
+    wanted[entry] = 1.
+    wanted[exit] = -1.
+    if after is not None: wanted = wanted[wanted.index > after]
+    wanted = wanted.ffill().fillna(state)
+    changed = wanted.values != pd.Series(wanted.values).shift(1).fillna(state).values
+    dates = wanted.index[changed]
+    positions = ohlc.index.get_indexer(dates)
+    return pd.DataFrame({'date': dates, 'direction': wanted.values[changed].astype(int),
+                         'strength': strength[positions], 'price': close[positions]},
+                        columns=['date', 'direction', 'strength', 'price'])
+
+
+def generate_signals(currency=None, scales=TIMEFRAMES, rules=SIGNAL_RULES, incremental=True):
+    '''
+    If currency == '' then all currencies
+    Evaluates all 'rules' [(name, params), ...] on the resampled data of all 'scales' and stores the signal events.
+    Returns the number of stored events.
+    '''
+    if currency: currencies = [currency]
+    else: currencies = CURRENCIES
+    stored = 0
+    with BulkWriter() as writer:
+        for cur in currencies:
+            for scale in scales:
+                for name, params in rules:
+                    rule = rule_id(name, params)
+                    watermark = get_watermark(cur, 'signal', '{}/{}'.format(scale, rule)) if incremental else None
+                    begin, state = None, 0
+                    if watermark is not None:
+                        # Enough bars before the watermark for the indicators (twice the period for gaps like weekends)
+                        begin = watermark - to_offset(scale) * (2 * RULES[name][1](params) + 10)
+                        last = get_last_signal(cur, scale, rule)
+                        state = last['direction'] if last else 0
+                    ohlc = get_ohlc(currency=cur, type='resampled', frequency=scale, begin=begin)
+                    if ohlc.empty or (watermark is not None and ohlc.index[-1] <= watermark): continue
+                    events = signal_events(ohlc, name, params, state=state, after=watermark)
+                    events['currency'], events['freq'], events['rule'] = cur, scale, rule
+                    store_signals(events, writer=writer)
+                    writer.flush()
+                    set_watermark(cur, 'signal', '{}/{}'.format(scale, rule), ohlc.index[-1].to_pydatetime())
+                    stored += len(events)
+                    log.info('Stored %s %s-%s-%s signals', len(events), cur, scale, rule)
+    return stored
+
+
+if __name__ == '__main__':
+    generate_signals()
+    from database.db_queries import get_signals
+    print get_signals(limit=20)
@@ -0,0 +1,317 @@
+'''
+Streaming (live) mode: minute bars arrive one at a time (from a file that is tailed or a local socket) and
+- are appended to the raw documents,
+- update the open bar of every timeframe (the completed bars are appended to the resampled documents),
+- update the SMA rules in O(1) per completed bar: a signal fires as soon as a bar completes.
+The bars and signals are written in batches (every STREAM_FLUSH_BARS bars), so the database isn't hit per bar.
+Only aligned timeframes are built (see db_workers.is_aligned()).
+'''
+import calendar
+import socket
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from business_logic.signals import rule_id, FLAT
+from database.db_queries import append_bars, get_ohlc, get_last_signal, store_signals, BulkWriter, SIGNAL_FIELDS
+from database.db_settings import CURRENCIES, TIMEFRAMES, SIGNAL_RULES, PRICETYPES, PRICE_DECIMALS, \
+    HISTDATA_EST_OFFSET, STREAM_FLUSH_BARS, STREAM_PORT
+from database.db_workers import bin_start, is_aligned, is_intraday, DAY_NANOS
+
+
+class RollingSMA(object):
+    '''
+    O(1) simple moving average: keeps the last 'period' values as integer units of 10 ** -decimals,
+    so the mean is exactly the one of rolling.rolling_mean(..., decimals) (and the batch signals).
+    '''
+
+    def __init__(self, period, decimals=PRICE_DECIMALS):
+        self.period = period
+        self.scale = 10 ** decimals
+        self.divisor = float(period * self.scale)
+        self.window = deque()
+        self.total = 0
+        self.value = np.nan
+
+    def update(self, value):
+        units = int(round(value * self.scale))
+        self.window.append(units)
+        self.total += units
+        if len(self.window) > self.period:
+            self.total -= self.window.popleft()
+        if len(self.window) == self.period:
+            self.value = self.total / self.divisor
+        return self.value
+
+
+class BaselineSMARule(object):
+    '''
+    Streaming version of signals.baseline_sma()
+    '''
+
+    def __init__(self, sma_short_period=7, sma_long_period=28):
+        self.short_sma = RollingSMA(sma_short_period)
+        self.long_sma = RollingSMA(sma_long_period)
+
+    def update(self, close):
+        '''
+        Returns (wanted direction or None, strength)
+        '''
+        short, long = self.short_sma.update(close), self.long_sma.update(close)
+        if long != long or short != short:  # NaN: not enough bars yet
+            return None, np.nan
+        return (1 if short > long else -1), (short - long) / long
+
+
+class SimpleSMARule(object):
+    '''
+    Streaming version of signals.simple_sma()
+    '''
+
+    def __init__(self, smaperiod=5):
+        self.sma = RollingSMA(smaperiod)
+
+    def update(self, close):
+        sma = self.sma.update(close)
+        if sma != sma:
+            return None, np.nan
+        if close > sma * 1.01: return 1, (close - sma) / sma
+        if close < sma: return -1, (close - sma) / sma
+        return None, (close - sma) / sma
+
+
+STREAM_RULES = {'baseline_sma': BaselineSMARule, 'simple_sma': SimpleSMARule}
+
+
+class BarBuilder(object):
+    '''
+    Builds the bars of 1 timeframe from minute bars. Dates are int nanoseconds (UTC).
+    '''
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.step = to_offset(scale).nanos if is_intraday(scale) else None
+        self.day, self.day_label = None, None
+        self.label = None  # label of the open bar
+        self.bar = None  # [open, high, low, close] of the open bar
+        self.closed_label = None
+
+    def bin_label(self, date):
+        if self.step: return date - date % self.step
+        day = date // DAY_NANOS
+        if day != self.day:  # Bins of D, W, M, ... only change at midnight: 1 pandas call per day
+            self.day, self.day_label = day, bin_start(pd.Timestamp(day * DAY_NANOS), self.scale).value
+        return self.day_label
+
+    def update(self, date, open, high, low, close):
+        '''
+        Adds a minute bar. Returns the completed bar (label, [open, high, low, close]) if the bar starts a new bin.
+        '''
+        label = self.bin_label(date)
+        if label == self.label:
+            bar = self.bar
+            if high > bar[1]: bar[1] = high
+            if low < bar[2]: bar[2] = low
+            bar[3] = close
+            return None
+        if self.closed_label is not None and label <= self.closed_label:
+            return None  # Late bar of a bin that was closed already
+        completed = (self.label, self.bar) if self.label is not None else None
+        self.label, self.bar = label, [open, high, low, close]
+        return completed
+
+    def close(self, now):
+        '''
+        Completes the open bar if its bin ended before 'now' (intraday timeframes only)
+        '''
+        if self.step is None or self.label is None or now < self.label + self.step:
+            return None
+        completed = (self.label, self.bar)
+        self.closed_label, self.label, self.bar = self.label, None, None
+        return completed
+
+
+def to_nanos(date):
+    if isinstance(date, (int, long, np.integer)): return int(date)
+    return pd.Timestamp(date).value
+
+
+class LiveEngine(object):
+    '''
+    engine = LiveEngine(on_signal=callback)
+    engine.warm_up()  # Indicators, open bars and signal states from the stored data
+    for currency, date, open, high, low, close in source: engine.on_bar(currency, date, open, high, low, close)
+    engine.flush()
+    on_signal(event) is called for every signal event (a dict with the fields of db_queries.SIGNAL_FIELDS).
+    '''
+
+    def __init__(self, currencies=CURRENCIES, scales=TIMEFRAMES, rules=SIGNAL_RULES, on_signal=None, store=True,
+                 flush_bars=STREAM_FLUSH_BARS):
+        self.currencies = list(currencies)
+        self.scales = [scale for scale in scales if is_aligned(scale)]
+        self.on_signal = on_signal
+        self.store = store
+        self.flush_bars = flush_bars
+        self.builders = dict((currency, [BarBuilder(scale) for scale in self.scales]) for currency in currencies)
+        # (currency, scale) -> [[rule id, rule, state], ...]
+        self.rules = dict(((currency, scale), [[rule_id(name, params), STREAM_RULES[name](**params), FLAT]
+                                                for name, params in rules])
+                          for currency in currencies for scale in self.scales)
+        self.raw = dict((currency, []) for currency in currencies)  # Minute bars to store
+        self.completed = dict(((currency, scale), []) for currency in currencies for scale in self.scales)
+        self.events = []  # Signal events to store
+        self.pending = 0
+
+    def warm_up(self, begin=None):
+        '''
+        Feeds the stored resampled bars since 'begin' (default: 90 days ago) to the rules, restores the signal
+        states and keeps the last stored bar of every timeframe as the open bar.
+        '''
+        begin = begin or datetime.utcnow() - timedelta(days=90)
+        for currency in self.currencies:
+            for builder in self.builders[currency]:
+                ohlc = get_ohlc(currency=currency, type='resampled', frequency=builder.scale, begin=begin)
+                rules = self.rules[(currency, builder.scale)]
+                for entry in rules:
+                    last = get_last_signal(currency, builder.scale, entry[0])
+                    entry[2] = last['direction'] if last else FLAT
+                if ohlc.empty: continue
+                for close in ohlc['close'].values[:-1]:
+                    for entry in rules:
+                        entry[1].update(close)
+                builder.label, builder.bar = ohlc.index[-1].value, ohlc[PRICETYPES].values[-1].tolist()
+
+    def on_bar(self, currency, date, open, high, low, close):
+        date = to_nanos(date)
+        if self.store: self.raw[currency].append((date, open, high, low, close))
+        for builder in self.builders[currency]:
+            completed = builder.update(date, open, high, low, close)
+            if completed is not None: self.on_completed(currency, builder.scale, completed)
+        self.pending += 1
+        if self.store and self.pending >= self.flush_bars: self.flush()
+
+    def tick(self, now=None):
+        '''
+        Completes the intraday bars whose time is over, so their signals don't wait for the next minute bar.
+        '''
+        now = to_nanos(now or datetime.utcnow())
+        for currency in self.currencies:
+            for builder in self.builders[currency]:
+                completed = builder.close(now)
+                if completed is not None: self.on_completed(currency, builder.scale, completed)
+
+    def on_completed(self, currency, scale, completed):
+        label, bar = completed
+        if self.store: self.completed[(currency, scale)].append((label, bar))
+        for entry in self.rules[(currency, scale)]:
+            direction, strength = entry[1].update(bar[3])
+            if direction is None or direction == entry[2]: continue
+            entry[2] = direction
+            event = {'currency': currency, 'freq': scale, 'rule': entry[0], 'date': pd.Timestamp(label),
+                     'direction': direction, 'strength': strength, 'price': bar[3]}
+            if self.store: self.events.append(event)
+            if self.on_signal: self.on_signal(event)
+
+    def flush(self):
+        '''
+        Writes the buffered minute bars, completed bars and signal events
+        '''
+        with BulkWriter() as writer:
+            for currency, bars in self.raw.items():
+                if bars: append_bars(currency, 'raw', 'min', bars_frame(bars), writer=writer)
+                self.raw[currency] = []
+            for (currency, scale), bars in self.completed.items():
+                if bars: append_bars(currency, 'resampled', scale,
+                                     bars_frame([(label,) + tuple(bar) for label, bar in bars]), writer=writer)
+                self.completed[(currency, scale)] = []
+            if self.events: store_signals(pd.DataFrame(self.events, columns=SIGNAL_FIELDS), writer=writer)
+            self.events = []
+        self.pending = 0
+
+
+def bars_frame(bars):
+    '''
+    [(date nanos, open, high, low, close), ...] => ohlc dataframe
+    '''
+    values = np.array(bars, dtype=np.float64)
+    index = pd.DatetimeIndex(np.array([bar[0] for bar in bars], dtype=np.int64).view('M8[ns]'), name='date')
+    return pd.DataFrame(values[:, 1:], index=index, columns=PRICETYPES)
+
+
+def parse_line(line, currency=None):
+    '''
+    Parses a histdata line 'yyyymmdd HHMMSS;open;high;low;close;volume' (EST, see db_workers.parse_histdata_dates())
+    or 'CURRENCY;yyyymmdd HHMMSS;open;...' into (currency, date nanos UTC, open, high, low, close).
+    '''
+    fields = line.strip().split(';')
+    if currency is None: currency, fields = fields[0], fields[1:]
+    stamp = fields[0]
+    seconds = calendar.timegm((int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                               int(stamp[9:11]), int(stamp[11:13]), int(stamp[13:15])))
+    date = (seconds + HISTDATA_EST_OFFSET * 3600) * 10 ** 9
+    return (currency, date, round(float(fields[1]), 4), round(float(fields[2]), 4), round(float(fields[3]), 4),
+            round(float(fields[4]), 4))
+
+
+def tail_file(filename, currency, follow=True, poll=0.1):
+    '''
+    Yields the bars of a histdata csv file; with 'follow' it waits for new lines (like tail -f).
+    A line without its newline is still being written: it's kept until the rest arrives
+    (without 'follow' the last line of the file doesn't need a newline).
+    '''
+    partial = ''
+    with open(filename) as f:
+        while True:
+            line = f.readline()
+            if line.endswith('\n'):
+                line, partial = partial + line, ''
+                if line.strip(): yield parse_line(line, currency)
+                continue
+            partial += line
+            if line: continue
+            if not follow:
+                if partial.strip(): yield parse_line(partial, currency)
+                return
+            time.sleep(poll)
+
+
+def socket_bars(port=STREAM_PORT, host='localhost'):
+    '''
+    Local socket source: accepts 1 connection and yields the bars sent as lines 'CURRENCY;yyyymmdd HHMMSS;open;...'
+    '''
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(1)
+    connection, _ = server.accept()
+    try:
+        for line in connection.makefile():
+            if line.strip(): yield parse_line(line)
+    finally:
+        connection.close()
+        server.close()
+
+
+def run(source, engine):
+    for bar in source:
+        engine.on_bar(*bar)
+    engine.flush()
+
+
+if __name__ == '__main__':
+    # Processing time per minute bar for all currencies, without storing
+    engine = LiveEngine(store=False)
+    closes = 1.2 + np.random.randn(len(CURRENCIES), 100000).cumsum(axis=1) * 0.0001
+    start = pd.Timestamp('2017-01-02').value
+    started = time.time()
+    for i in range(closes.shape[1]):
+        date = start + i * 60 * 10 ** 9
+        for c, currency in enumerate(CURRENCIES):
+            close = round(closes[c, i], 4)
+            engine.on_bar(currency, date, close, close, close, close)
+    elapsed = time.time() - started
+    print '{:.1f} us per bar'.format(1e6 * elapsed / closes.size)
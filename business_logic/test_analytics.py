@@ -0,0 +1,63 @@
+'''
+The analytics of pairs with missing bars: the bars that get_panel() fills mustn't count as 0 returns.
+    python -m unittest business_logic.test_analytics
+'''
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from business_logic.analytics import analytics_frames, returns
+
+WINDOW = 5
+
+
+def closes_fixture(bars=200, seed=1):
+    '''
+    (closes, real) like get_closes(real=True) for 2 pairs that miss different bars: the missing bars
+    are filled with the previous close
+    '''
+    random = np.random.RandomState(seed)
+    index = pd.date_range('2017-01-02', periods=bars, freq='D', name='date')
+    prices = pd.DataFrame(1.1 + np.cumsum(random.normal(0, 0.01, (bars, 2)), axis=0), index=index,
+                          columns=['EURUSD', 'GBPUSD']).round(4)
+    real = pd.DataFrame(True, index=index, columns=prices.columns)
+    real.iloc[30::17, 0] = False
+    real.iloc[40::11, 1] = False
+    return prices.where(real).ffill(), real
+
+
+class AnalyticsMissingBarsTest(unittest.TestCase):
+    closes, real = closes_fixture()
+
+    def test_returns(self):
+        result = returns(self.closes, real=self.real)
+        self.assertTrue(np.isnan(result.values[~self.real.values]).all())
+        for currency in self.closes.columns:
+            expected = self.closes[currency][self.real[currency]].pct_change()
+            np.testing.assert_allclose(result[currency].dropna().values, expected.dropna().values, rtol=1e-12)
+
+    def test_volatility_on_real_bars(self):
+        frames = analytics_frames(self.closes, WINDOW, real=self.real)
+        for currency in self.closes.columns:
+            real = self.real[currency].values
+            volatility = frames[currency]['volatility_{}'.format(WINDOW)]
+            expected = self.closes[currency][real].pct_change().rolling(WINDOW).std()
+            np.testing.assert_allclose(volatility.values[real], expected.values, rtol=1e-9, atol=1e-12)
+            self.assertTrue(volatility[~real].isnull().all())
+
+    def test_correlation_without_filled_bars(self):
+        frames = analytics_frames(self.closes, WINDOW, real=self.real)
+        simple = returns(self.closes, real=self.real)
+        expected = simple['EURUSD'].rolling(WINDOW).corr(simple['GBPUSD'])
+        corr = frames['EURUSD']['corr_{}_GBPUSD'.format(WINDOW)]
+        np.testing.assert_allclose(corr.values, expected.values, rtol=1e-9, atol=1e-12)
+        # A window with a filled bar of either pair (or the first bar, without return) has no correlation
+        missing = simple.isnull().any(axis=1).astype(int)
+        filled = missing.rolling(WINDOW).max().fillna(1).astype(bool)
+        self.assertTrue(corr[filled].isnull().all())
+        self.assertTrue(corr[~filled].notnull().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,20 @@
-import pandas as pd
 from bokeh.plotting import figure, output_file, show
-from bokeh.sampledata.stocks import AAPL
 
-df = pd.DataFrame(AAPL)
-df['date'] = pd.to_datetime(df['date'])
+from charting.lod import chart_data
 
-output_file("datetime.html")
 
-# create a new plot with a datetime axis type
-p = figure(plot_width=800, plot_height=250, x_axis_type="datetime")
+def plot(currency='EURUSD', begin=None, end=None, width=1000, height=300):
+    '''
+    Plots the window begin ... end of currency with 1 bar per pixel: the high-low range and the close.
+    '''
+    view, level = chart_data(currency, begin=begin, end=end, width=width, method='minmax')
+    p = figure(plot_width=width, plot_height=height, x_axis_type="datetime",
+               title='{} ({} bars)'.format(currency, level))
+    p.segment(view.index, view['low'], view.index, view['high'], color='navy', alpha=0.3)
+    p.line(view.index, view['close'], color='navy', line_width=0.5)
+    return p
 
-p.line(df['date'], df['close'], color='navy', alpha=0.5)
 
-show(p)
\ No newline at end of file
+if __name__ == '__main__':
+    output_file("datetime.html")
+    show(plot('EURUSD'))
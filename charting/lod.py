@@ -0,0 +1,136 @@
+'''
+Level of detail chart data: a view of a series that is decimated to the width of the chart in pixels.
+The stored timeframes form the pyramid: raw minutes, then the resampled TIMEFRAMES (5min ... W).
+chart_data() reads the window from the coarsest level whose bars are not longer than 1 pixel,
+so at most a few bars per pixel are read (from the caches, see db_queries.iter_ohlc()) whatever the zoom, and decimates them:
+- 'minmax': 1 ohlc bar per pixel (first open, highest high, lowest low, last close): the chart shows every extreme
+- 'lttb': 'width' points of the closes, chosen by Largest-Triangle-Three-Buckets: a line with the shape of the series
+'''
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from database.db_queries import get_db, get_ohlc, to_datetime
+from database.db_settings import PRICETYPES, TIMEFRAMES
+
+LEVELS = ['min'] + list(TIMEFRAMES)
+
+
+def level_type(scale):
+    return 'raw' if scale == 'min' else 'resampled'
+
+
+def bar_nanos(scale):
+    '''
+    Length of a bar of 'scale' in ns (for W, M, ...: the length of 1 period)
+    '''
+    offset = to_offset(scale)
+    first = offset.rollforward(pd.Timestamp('2000-01-03'))
+    return ((first + offset) - first).value
+
+
+def pyramid(frequency='min'):
+    '''
+    The levels that can be used for 'frequency' (not finer than it), sorted from fine to coarse
+    '''
+    levels = sorted(LEVELS, key=bar_nanos)
+    return [level for level in levels if bar_nanos(level) >= bar_nanos(frequency)]
+
+
+def choose_level(begin, end, width, frequency='min'):
+    '''
+    The coarsest level whose bars are not longer than a pixel of the window begin ... end (datetimes)
+    '''
+    pixel = (pd.Timestamp(end).value - pd.Timestamp(begin).value) / float(width)
+    levels = pyramid(frequency)
+    chosen = levels[0]
+    for level in levels:
+        if bar_nanos(level) <= pixel: chosen = level
+    return chosen
+
+
+def series_range(currency, frequency='min'):
+    '''
+    (first, last) date of the stored data of currency/frequency, read from the document dates only
+    '''
+    query = {'currency': currency, 'type': level_type(frequency), 'freq': frequency, 'year': {'$exists': True}}
+    first = get_db().forex.find_one(query, {'begin': True}, sort=[('begin', 1)])
+    last = get_db().forex.find_one(query, {'end': True}, sort=[('end', -1)])
+    if first is None: return None, None
+    return first['begin'], last['end']
+
+
+def minmax(ohlc, begin, end, width):
+    '''
+    1 ohlc bar per pixel of the window begin ... end, with the number of bars in the column 'bars'.
+    Pixels without bars are left out.
+    '''
+    if ohlc.empty:
+        return pd.DataFrame(columns=PRICETYPES + ['bars'], index=pd.DatetimeIndex([], name='date'))
+    begin, end = pd.Timestamp(begin).value, pd.Timestamp(end).value
+    span = max(end - begin, 1)
+    pixels = np.clip((ohlc.index.asi8 - begin) * width // span, 0, width - 1)
+    starts = np.flatnonzero(np.append(True, np.diff(pixels) != 0))
+    values = ohlc[PRICETYPES].values
+    index = pd.DatetimeIndex(begin + pixels[starts] * span // width, name='date')
+    return pd.DataFrame({'open': values[starts, 0],
+                         'high': np.maximum.reduceat(values[:, 1], starts),
+                         'low': np.minimum.reduceat(values[:, 2], starts),
+                         'close': values[np.append(starts[1:], len(values)) - 1, 3],
+                         'bars': np.diff(np.append(starts, len(values)))},
+                        index=index, columns=PRICETYPES + ['bars'])
+
+
+def lttb(x, y, points):
+    '''
+    Positions of the 'points' (x, y) points chosen by Largest-Triangle-Three-Buckets (Steinarsson, 2013):
+    the first and last point, and per bucket the point that makes the largest triangle with the point chosen
+    in the previous bucket and the average of the next bucket.
+    '''
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    every = (n - 2) / float(points - 2)
+    bounds = (np.arange(points - 1) * every).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, stop = bounds[i], bounds[i + 1]
+        next_stop = bounds[i + 2] if i + 2 < len(bounds) else n
+        next_x, next_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = np.abs((x[a] - next_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def chart_data(currency='EURUSD', begin=None, end=None, width=1000, method='minmax', frequency='min'):
+    '''
+    Decimated view of the window begin ... end (default: all data) of currency, for a chart 'width' pixels wide.
+    'frequency' is the finest level that may be used. Returns (dataframe, level used):
+    - method 'minmax': see minmax()
+    - method 'lttb': the close of at most 'width' bars, see lttb()
+    '''
+    begin, end = to_datetime(begin), to_datetime(end, end=True)
+    if begin is None or end is None:
+        first, last = series_range(currency, pyramid(frequency)[0])
+        begin, end = begin or first, end or last
+    level = choose_level(begin, end, width, frequency)
+    ohlc = get_ohlc(currency=currency, type=level_type(level), frequency=level, begin=begin, end=end)
+    if method == 'minmax':
+        return minmax(ohlc, begin, end, width), level
+    dates = ohlc.index.asi8
+    selected = lttb((dates - dates[0]) / 1e9 if len(dates) else dates, ohlc['close'].values, width)
+    return ohlc[['close']].iloc[selected], level
+
+
+if __name__ == '__main__':
+    for window in [(None, None), ('2017-01-01', '2017-12-31'), ('2017-06-01', '2017-06-07'), ('2017-06-01 10:00', '2017-06-01 12:00')]:
+        for method in ['minmax', 'lttb']:
+            started = time.time()
+            view, level = chart_data('EURUSD', begin=window[0], end=window[1], width=1000, method=method)
+            print '{} {}: {} points from {} in {:.0f} ms'.format(window, method, len(view), level, 1000 * (time.time() - started))
@@ -0,0 +1,168 @@
+'''
+Local on-disk cache of decoded ohlc documents: 1 directory per document with
+    date.npy: int64 ns since epoch (UTC)
+    ohlc.npy: float64 array with columns open, high, low, close
+    meta.json: version (the 'updated' date of the document), begin, end, size
+The arrays are memory mapped on read. The least recently used entries are removed when the cache grows over CACHE_MAX_BYTES.
+The size of the cache is kept as a running total (per process), so the directory is only listed when it's over the limit.
+'''
+import json
+import os
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from db_settings import CACHE_DIR, CACHE_MAX_BYTES, PRICETYPES
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+EVICT_TO = 0.9  # evict() frees some room below the limit, so the next stores don't list the cache again
+_cached_bytes = None  # Bytes of all entries, counted by evict() on the first store, then kept up to date
+
+
+def doc_key(doc):
+    return doc['currency'], doc['type'], doc['freq'], doc['year'], doc.get('month', 0)
+
+
+def doc_version(doc):
+    '''
+    A cached entry is valid as long as the document wasn't updated: documents written before 'updated'
+    was stored fall back on their 'end' date.
+    '''
+    return str(doc.get('updated') or doc.get('end'))
+
+
+def entry_path(key):
+    currency, type, frequency, year, month = key
+    return os.path.join(CACHE_DIR, '{}_{}_{}_{}_{:02d}'.format(currency, type, frequency, year, month))
+
+
+def cached_version(key):
+    '''
+    Returns the version of the cached entry for 'key', or None if it isn't cached
+    '''
+    try:
+        with open(os.path.join(entry_path(key), 'meta.json')) as f:
+            return json.load(f)['version']
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def entry_bytes(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)['bytes']
+    except (IOError, ValueError, KeyError):
+        return 0
+
+
+def load(key, version=None, columns=PRICETYPES):
+    '''
+    Returns the cached frame for 'key' or None if it isn't cached or the cached 'version' is different.
+    '''
+    path = entry_path(key)
+    meta_file = os.path.join(path, 'meta.json')
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if version is not None and meta['version'] != version:
+            return None
+        dates = np.load(os.path.join(path, 'date.npy'), mmap_mode='r')
+        prices = np.load(os.path.join(path, 'ohlc.npy'), mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+    os.utime(meta_file, None)  # Last access, for the LRU eviction
+    index = pd.DatetimeIndex(dates.view('M8[ns]'), name='date')
+    frame = pd.DataFrame(prices, index=index, columns=PRICETYPES, copy=False)
+    if list(columns) != PRICETYPES:
+        frame = frame[list(columns)]
+    return frame
+
+
+def store(key, version, frame):
+    '''
+    Stores a frame with all PRICETYPES. The entry is written in a temporary directory first,
+    so a reader never sees a half written entry.
+    '''
+    path = entry_path(key)
+    tmp = path + '.tmp{}'.format(os.getpid())
+    if not os.path.isdir(tmp):
+        os.makedirs(tmp)
+    dates = frame.index.values.astype('M8[ns]').view(np.int64)
+    prices = np.ascontiguousarray(frame[PRICETYPES].values, dtype=np.float64)
+    np.save(os.path.join(tmp, 'date.npy'), dates)
+    np.save(os.path.join(tmp, 'ohlc.npy'), prices)
+    meta = {'version': version,
+            'begin': frame.index.min().strftime(DATE_FORMAT) if len(frame) else None,
+            'end': frame.index.max().strftime(DATE_FORMAT) if len(frame) else None,
+            'bytes': dates.nbytes + prices.nbytes}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    replaced = 0
+    if os.path.isdir(path):
+        replaced = entry_bytes(path)
+        shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+    global _cached_bytes
+    if _cached_bytes is not None:
+        _cached_bytes += meta['bytes'] - replaced
+    if _cached_bytes is None or _cached_bytes > CACHE_MAX_BYTES:
+        evict()
+
+
+def invalidate(key):
+    global _cached_bytes
+    path = entry_path(key)
+    if _cached_bytes is not None and os.path.isdir(path):
+        _cached_bytes -= entry_bytes(path)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def entries(currency, type, frequency, begin=None, end=None):
+    '''
+    Returns the keys of the cached entries of currency/type/frequency that overlap begin-end, in date order.
+    Used to read from the cache when mongodb can't be reached.
+    '''
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    prefix = '{}_{}_{}_'.format(currency, type, frequency)
+    found = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.startswith(prefix) or '.tmp' in name: continue
+        try:
+            with open(os.path.join(CACHE_DIR, name, 'meta.json')) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            continue
+        if meta['begin'] is None: continue
+        first = datetime.strptime(meta['begin'], DATE_FORMAT)
+        last = datetime.strptime(meta['end'], DATE_FORMAT)
+        if (end is not None and first > end) or (begin is not None and last < begin): continue
+        year, month = name[len(prefix):].split('_')
+        found.append((first, (currency, type, frequency, int(year), int(month))))
+    return [key for first, key in sorted(found)]
+
+
+def evict(max_bytes=CACHE_MAX_BYTES):
+    '''
+    Removes the least recently used entries until the cache is smaller than EVICT_TO * max_bytes (if it's over max_bytes).
+    Lists all entries: it also recounts the running total (other processes may have added entries).
+    '''
+    global _cached_bytes
+    sizes = []
+    for name in os.listdir(CACHE_DIR):
+        meta_file = os.path.join(CACHE_DIR, name, 'meta.json')
+        try:
+            with open(meta_file) as f:
+                sizes.append((os.path.getmtime(meta_file), json.load(f)['bytes'], name))
+        except (IOError, OSError, ValueError):
+            continue
+    total = sum(size for _, size, _ in sizes)
+    if total <= max_bytes: sizes = []
+    for _, size, name in sorted(sizes):
+        if total <= EVICT_TO * max_bytes: break
+        shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+        total -= size
+    _cached_bytes = total
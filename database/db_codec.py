@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+from bson.binary import Binary
+
+from db_settings import PRICE_DECIMALS
+
+NAN_INT32 = np.iinfo(np.int32).min  # Marks a missing price in a binary column
+MAX_INT32 = np.iinfo(np.int32).max
+
+
+def encode_dates(index):
+    '''
+    Encodes a DatetimeIndex as int64 second deltas from the first date.
+    Returns (t0, Binary) where t0 is the first date in seconds since epoch (UTC).
+    '''
+    seconds = index.asi8 // 10 ** 9  # ns since epoch (UTC) -> seconds
+    t0 = int(seconds[0]) if len(seconds) else 0
+    return t0, Binary((seconds - t0).astype('<i8').tobytes())
+
+
+def decode_dates(t0, data):
+    '''
+    Decodes the output of encode_dates() into a (naive UTC) DatetimeIndex, like pymongo returns for datetimes.
+    '''
+    seconds = np.frombuffer(data, dtype='<i8') + t0
+    return pd.DatetimeIndex(seconds.astype('datetime64[s]'), name='date')
+
+
+def encode_prices(values, decimals=PRICE_DECIMALS):
+    '''
+    Encodes prices as int32 scaled by 10**decimals. NaN is stored as NAN_INT32.
+    The prices are already rounded to 'decimals' in load_raw_data(), so no precision is lost.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    scaled = np.round(values * 10 ** decimals)
+    missing = np.isnan(scaled)
+    if np.any(np.abs(scaled[~missing]) > MAX_INT32):
+        raise ValueError('Price too large for int32 encoding with {} decimals'.format(decimals))
+    scaled[missing] = NAN_INT32
+    return Binary(scaled.astype('<i4').tobytes())
+
+
+def decode_prices(data, decimals=PRICE_DECIMALS):
+    scaled = np.frombuffer(data, dtype='<i4')
+    prices = scaled / float(10 ** decimals)
+    prices[scaled == NAN_INT32] = np.nan
+    return prices
@@ -0,0 +1,104 @@
+'''
+Event log and columnar event buffers, for runs with a lot of events (minute data, sweeps, ingest).
+- log: messages with a level. A disabled level costs 1 comparison: the message is only formatted when it's written.
+- EventBuffer: records (eg: orders and trades) in preallocated numpy arrays, 1 array per field.
+'''
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from db_settings import LOG_LEVEL, LOG_FILE
+
+QUIET, ERROR, INFO, DEBUG = -1, 0, 1, 2
+
+
+class EventLog(object):
+    def __init__(self, level=LOG_LEVEL, filename=LOG_FILE):
+        self.level = level
+        self.stream = sys.stdout
+        if filename: self.open(filename)
+
+    def open(self, filename):
+        '''
+        Writes the messages to a file (appended) instead of the console
+        '''
+        self.stream = open(filename, 'a')
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, level, message, *args):
+        '''
+        Writes message % args if level is enabled.
+        '''
+        if level > self.level: return
+        self.stream.write((message % args if args else message) + '\n')
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+
+log = EventLog()
+
+
+def configure(level=None, filename=None):
+    if level is not None: log.level = level
+    if filename is not None: log.open(filename)
+
+
+@contextmanager
+def quiet(level=QUIET):
+    '''
+    with quiet(): ... => only messages up to 'level' are written
+    '''
+    previous, log.level = log.level, min(log.level, level)
+    try:
+        yield log
+    finally:
+        log.level = previous
+
+
+class EventBuffer(object):
+    '''
+    Columnar buffer: 'fields' is a list of (name, numpy dtype). The arrays grow by doubling.
+    '''
+
+    def __init__(self, fields, capacity=1024):
+        self.fields = fields
+        self.size = 0
+        self.columns = [np.empty(capacity, dtype=dtype) for _, dtype in fields]
+
+    def append(self, *values):
+        if self.size == len(self.columns[0]):
+            self.columns = [np.concatenate([column, np.empty_like(column)]) for column in self.columns]
+        for column, value in zip(self.columns, values):
+            column[self.size] = value
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.size = 0
+
+    def to_frame(self):
+        return pd.DataFrame(dict((name, column[:self.size]) for (name, _), column in zip(self.fields, self.columns)),
+                            columns=[name for name, _ in self.fields])
+
+    def save(self, filename):
+        self.to_frame().to_csv(filename, index=False)
+
+
+# Fields of the orders and trades recorded by the strategies (dates are backtrader date numbers)
+ORDER_FIELDS = [('date', np.float64), ('bar', np.int64), ('side', np.int8), ('status', np.int8),
+                ('size', np.float64), ('price', np.float64), ('value', np.float64), ('comm', np.float64)]
+TRADE_FIELDS = [('date', np.float64), ('bar', np.int64), ('barlen', np.int64), ('price', np.float64),
+                ('pnl', np.float64), ('pnlcomm', np.float64)]
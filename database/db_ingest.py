@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sys
+import threading
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from Queue import Queue
+
+from db_events import log
+from db_quality import check_bucket
+from db_queries import BulkWriter, get_db, store_raw_data, merge_raw_month
+from db_settings import CURRENCIES, INGEST_WRITERS, INGEST_QUEUE_SIZE, MANIFEST_COLLECTION
+from db_workers import iter_raw_months, raw_data_file
+
+
+def file_checksum(filename, blocksize=1 << 20):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def get_manifest(currency, year):
+    '''
+    Returns {month: checksum} of the months of currency/year that are already stored.
+    Month 0 means the whole file was stored.
+    '''
+    docs = get_db()[MANIFEST_COLLECTION].find({'currency': currency, 'year': year}, {'month': True, 'checksum': True})
+    return dict((doc['month'], doc['checksum']) for doc in docs)
+
+
+def update_manifest(currency, year, month, checksum, rows=0):
+    get_db()[MANIFEST_COLLECTION].update_one({'currency': currency, 'year': year, 'month': month},
+                                             {'$set': {'checksum': checksum, 'rows': rows, 'stored': datetime.utcnow()}},
+                                             upsert=True)
+
+
+def parse_raw_file(task):
+    '''
+    Runs in a worker process: parses 1 histdata file and returns (currency, year, checksum, [(y, month, ohlc), ...]).
+    Months that are in the manifest with the same checksum are left out. The bars that moved into the next year
+    by the EST -> UTC shift (y == year + 1) aren't in the manifest, they're stored with the months of the file.
+    '''
+    currency, year, manifest = task
+    checksum = file_checksum(raw_data_file(currency, year))
+    months = [(y, m, ohlc) for y, m, ohlc in iter_raw_months(currency=currency, year=year)
+              if y != year or manifest.get(m) != checksum]
+    return currency, year, checksum, months
+
+
+def _writer_loop(queue, done, errors, lock, buckets):
+    writer = BulkWriter()
+    while True:
+        item = queue.get()
+        if item is None:
+            queue.task_done()
+            return
+        currency, year, y, month, checksum, ohlc = item
+        try:
+            with lock:
+                bucket_lock = buckets.setdefault((currency, y, month), threading.Lock())
+            with bucket_lock:  # A january is written by 2 files (see parse_raw_file()): 1 merge at a time
+                ohlc = merge_raw_month(currency, y, month, ohlc)
+                updated = datetime.utcnow()
+                ohlc = check_bucket(currency, 'raw', 'min', y, month, ohlc, checked=updated)
+                store_raw_data(currency=currency, year=y, month=month, ohlc=ohlc, writer=writer, updated=updated)
+                writer.flush()
+            if y == year: update_manifest(currency, year, month, checksum, rows=len(ohlc))
+            with lock:
+                done[(currency, year)] = done.get((currency, year), 0) + 1
+        except Exception:
+            with lock:
+                errors.append(sys.exc_info())
+        queue.task_done()
+
+
+def ingest_all_raw_data(currencies=CURRENCIES, years=range(2000, 2020), processes=None, writers=INGEST_WRITERS):
+    '''
+    Loads and stores the histdata files of all currencies and years:
+    - a process pool parses the csv files (cpu bound)
+    - a bounded queue feeds the parsed months to 'writers' threads that store them in mongodb (I/O bound)
+    - every stored month is recorded in the manifest collection with the checksum of its file,
+      so an interrupted run resumes where it stopped and unchanged files are skipped on a rerun.
+    Returns the number of stored months.
+    '''
+    processes = processes or cpu_count()
+    pool = Pool(processes)  # Start the workers before the mongodb client is created in this process
+    tasks = []
+    for cur in currencies:
+        for year in years:
+            filename = raw_data_file(cur, year)
+            if not os.path.exists(filename): continue
+            manifest = get_manifest(cur, year)
+            if manifest.get(0) == file_checksum(filename):
+                log.info('Skipped unchanged %s-%s', cur, year)
+                continue
+            tasks.append((cur, year, manifest))
+
+    queue = Queue(maxsize=INGEST_QUEUE_SIZE)
+    done, errors, lock, buckets = {}, [], threading.Lock(), {}
+    threads = [threading.Thread(target=_writer_loop, args=(queue, done, errors, lock, buckets)) for _ in range(writers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    expected = {}  # (currency, year) -> (checksum, number of months to store)
+    pending = []  # Keep at most 2 files per process in flight, so parsed data can't pile up before the writers
+    try:
+        for task in tasks:
+            pending.append(pool.apply_async(parse_raw_file, (task,)))
+            if len(pending) >= 2 * processes:
+                _queue_months(pending.pop(0).get(), queue, expected)
+        while pending:
+            _queue_months(pending.pop(0).get(), queue, expected)
+        pool.close()
+    except:
+        pool.terminate()  # Stop the workers now: the files they're parsing would never be read
+        raise
+    finally:
+        pool.join()
+        for _ in threads: queue.put(None)
+        for t in threads: t.join()
+    if errors:
+        exc_type, exc_value, tb = errors[0]
+        raise exc_type, exc_value, tb
+
+    for (cur, year), (checksum, months) in expected.items():
+        if done.get((cur, year), 0) == months:
+            update_manifest(cur, year, 0, checksum)  # Mark the whole file as stored
+    return sum(done.values())
+
+
+def _queue_months(result, queue, expected):
+    currency, year, checksum, months = result
+    expected[(currency, year)] = (checksum, len(months))
+    for y, month, ohlc in months:
+        queue.put((currency, year, y, month, checksum, ohlc))  # Blocks while the writers are behind
+
+
+if __name__ == '__main__':
+    ingest_all_raw_data()
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+from db_settings import MEMO_MAX_BYTES
+
+
+class LRUCache(object):
+    '''
+    In-process, byte bounded LRU cache of numpy arrays or dataframes.
+    The cached values are read-only, so they can be shared by all callers.
+    '''
+
+    def __init__(self, max_bytes=MEMO_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (version, value, bytes), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key, version=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or (version is not None and entry[0] != version):
+                if entry is not None: self.bytes -= entry[2]
+                self.misses += 1
+                return None
+            self.entries[key] = entry  # Most recently used
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key, version=None):
+        '''
+        Returns the cached value like get(), without counting a hit or a miss and without changing the LRU order
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry[1] if entry is not None and (version is None or entry[0] == version) else None
+
+    def contains(self, key, version=None):
+        return self.peek(key, version) is not None
+
+    def put(self, key, value, version=None, nbytes=None):
+        '''
+        Caches 'value'; 'nbytes' is its size (default: value.nbytes). Arrays are made read-only here,
+        dataframes must be built on read-only arrays (see frozen_frame()).
+        '''
+        if nbytes is None: nbytes = value.nbytes
+        if nbytes > self.max_bytes:
+            return
+        if isinstance(value, np.ndarray): value.flags.writeable = False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None: self.bytes -= old[2]
+            self.entries[key] = (version, value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, match):
+        '''
+        Removes the entries for which match(key) is True
+        '''
+        with self.lock:
+            for key in [key for key in self.entries if match(key)]:
+                self.bytes -= self.entries.pop(key)[2]
+
+    def clear(self):
+        self.invalidate(lambda key: True)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# Decoded frames, keyed on the bucket (currency, type, freq, year, month): see db_cache.doc_key()
+frame_cache = LRUCache()
+
+
+def frozen_frame(frame):
+    '''
+    A copy of a float frame as 1 read-only block: the cached frame is shared, slicing it (eg: db_queries.trim_frame())
+    returns views on the same block, and a write raises an error instead of changing the cached data.
+    '''
+    values = np.array(frame.values, dtype=np.float64)
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=pd.DatetimeIndex(frame.index.values, name='date'), columns=frame.columns, copy=False)
+
+
+def load_frame(bucket, version, columns):
+    '''
+    Returns the cached frame of a bucket (see db_cache.doc_key()) with 'columns', or None if it isn't cached.
+    With all the cached columns (in the same order) the cached frame itself is returned: no data is copied.
+    '''
+    frame = frame_cache.get(bucket, version)
+    if frame is None or not set(columns) <= set(frame.columns):
+        return None
+    return frame if list(columns) == list(frame.columns) else frame[list(columns)]
+
+
+def store_frame(bucket, version, frame):
+    frame = frozen_frame(frame)
+    frame_cache.put(bucket, frame, version, nbytes=frame.values.nbytes + frame.index.nbytes)
+
+
+def is_cached(bucket, version, columns):
+    frame = frame_cache.peek(bucket, version)
+    return frame is not None and set(columns) <= set(frame.columns)
+
+
+def invalidate_bucket(filter_doc):
+    '''
+    Called for every upsert (see db_queries.BulkWriter): drops the cached frame of the upserted document.
+    Filters without currency/type/freq/year/month drop everything they could match.
+    '''
+    expected = [filter_doc.get('currency'), filter_doc.get('type'), filter_doc.get('freq'),
+                filter_doc.get('year'), filter_doc.get('month', 0 if 'year' in filter_doc else None)]
+
+    def match(key):
+        return all(e is None or e == k for e, k in zip(expected, key))
+
+    frame_cache.invalidate(match)
+
+
+def cache_stats():
+    return frame_cache.stats()
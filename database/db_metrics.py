@@ -0,0 +1,196 @@
+'''
+Instrumentation of the database layer: per (operation, currency) the number of calls, a latency histogram,
+the documents read / written and the BSON bytes read / written.
+It's off by default (METRICS_ENABLED): a disabled timer or counter costs 1 attribute check.
+    configure(enabled=True)
+    ... ingest, queries, backtests ...
+    print summary().to_string()
+    write_prometheus('forex.prom')  # text format, eg: for the textfile collector of the node exporter
+The operations overlap: get_ohlc includes mongo_read, decode, dataframe and concat.
+'''
+import inspect
+import os
+import time
+from functools import wraps
+from threading import Lock
+
+import bson
+import numpy as np
+import pandas as pd
+
+from db_settings import METRICS_ENABLED, METRICS_BYTES
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1., 5., 10., float('inf')]
+COUNTERS = ['docs_read', 'docs_written', 'bytes_read', 'bytes_written']
+
+
+class Metrics(object):
+    def __init__(self, enabled=METRICS_ENABLED, track_bytes=METRICS_BYTES):
+        self.enabled = enabled
+        self.track_bytes = track_bytes  # Bytes are measured by encoding the documents to BSON: it costs time
+        self.lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.calls = {}  # (operation, currency) -> [calls, total seconds, histogram counts]
+            self.counters = {}  # (operation, currency) -> {counter: value}
+
+    def observe(self, operation, currency, seconds):
+        bucket = np.searchsorted(BUCKETS, seconds)
+        with self.lock:
+            entry = self.calls.get((operation, currency))
+            if entry is None:
+                entry = self.calls[(operation, currency)] = [0, 0., [0] * len(BUCKETS)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2][bucket] += 1
+
+    def count(self, operation, currency, **values):
+        with self.lock:
+            counters = self.counters.setdefault((operation, currency), dict.fromkeys(COUNTERS, 0))
+            for name, value in values.items():
+                counters[name] += value
+
+
+metrics = Metrics()
+
+
+def configure(enabled=None, track_bytes=None, clear=False):
+    if enabled is not None: metrics.enabled = enabled
+    if track_bytes is not None: metrics.track_bytes = track_bytes
+    if clear: metrics.clear()
+
+
+class _Timer(object):
+    __slots__ = ('operation', 'currency', 'started')
+
+    def __init__(self, operation, currency):
+        self.operation, self.currency = operation, currency
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        metrics.observe(self.operation, self.currency, time.time() - self.started)
+
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NO_TIMER = _NoTimer()
+
+
+def timer(operation, currency=None):
+    '''
+    with timer('concat', currency): ... => records the time of the block (if metrics are enabled)
+    '''
+    return _Timer(operation, currency) if metrics.enabled else NO_TIMER
+
+
+def timed(operation=None):
+    '''
+    Decorator: records the calls of a function, keyed by 'operation' (default: the function name)
+    and its 'currency' argument (if it has one).
+    '''
+    def decorator(function):
+        name = operation or function.__name__
+        arguments = inspect.getargspec(function).args
+        position = arguments.index('currency') if 'currency' in arguments else None
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            if position is None: currency = None
+            elif position < len(args): currency = args[position]
+            else: currency = kwargs.get('currency')
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe(name, currency, time.time() - started)
+        return wrapper
+    return decorator
+
+
+def bson_size(doc):
+    return len(bson.BSON.encode(doc)) if metrics.track_bytes else 0
+
+
+def count_read(operation, currency, doc):
+    if metrics.enabled: metrics.count(operation, currency, docs_read=1, bytes_read=bson_size(doc))
+
+
+def count_write(operation, currency, update_doc):
+    if metrics.enabled: metrics.count(operation, currency, docs_written=1, bytes_written=bson_size(update_doc))
+
+
+def timed_cursor(cursor, operation='mongo_read', currency=None):
+    '''
+    Yields the documents of a mongodb cursor, timing every fetch (the round trips happen while iterating)
+    '''
+    cursor = iter(cursor)
+    while True:
+        with timer(operation, currency):
+            doc = next(cursor, None)
+        if doc is None: return
+        count_read(operation, currency, doc)
+        yield doc
+
+
+def summary():
+    '''
+    Dataframe with 1 row per (operation, currency): calls, total and mean time, an estimate of the 95th percentile
+    (the upper bound of its histogram bucket) and the counters
+    '''
+    rows = []
+    with metrics.lock:
+        keys = set(metrics.calls) | set(metrics.counters)
+        for key in sorted(keys, key=lambda k: (k[0], k[1] or '')):
+            calls, seconds, histogram = metrics.calls.get(key, [0, 0., [0] * len(BUCKETS)])
+            row = {'operation': key[0], 'currency': key[1] or '', 'calls': calls, 'total_s': seconds,
+                   'mean_ms': 1000. * seconds / calls if calls else np.nan,
+                   'p95_ms': 1000. * BUCKETS[np.searchsorted(np.cumsum(histogram), 0.95 * calls)] if calls else np.nan}
+            row.update(metrics.counters.get(key, dict.fromkeys(COUNTERS, 0)))
+            rows.append(row)
+    return pd.DataFrame(rows, columns=['operation', 'currency', 'calls', 'total_s', 'mean_ms', 'p95_ms'] + COUNTERS)
+
+
+def prometheus_text(prefix='forex_db'):
+    '''
+    The metrics in the Prometheus text exposition format
+    '''
+    lines = ['# HELP {}_operation_seconds Duration of the database operations'.format(prefix),
+             '# TYPE {}_operation_seconds histogram'.format(prefix)]
+    with metrics.lock:
+        for (operation, currency), (calls, seconds, histogram) in sorted(metrics.calls.items()):
+            labels = 'operation="{}",currency="{}"'.format(operation, currency or '')
+            for bound, total in zip(BUCKETS, np.cumsum(histogram)):
+                lines.append('{}_operation_seconds_bucket{{{},le="{}"}} {}'.format(
+                    prefix, labels, '+Inf' if bound == float('inf') else repr(bound), total))
+            lines.append('{}_operation_seconds_sum{{{}}} {!r}'.format(prefix, labels, seconds))
+            lines.append('{}_operation_seconds_count{{{}}} {}'.format(prefix, labels, calls))
+        for counter in COUNTERS:
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, counter))
+            for (operation, currency), counters in sorted(metrics.counters.items()):
+                lines.append('{}_{}_total{{operation="{}",currency="{}"}} {}'.format(
+                    prefix, counter, operation, currency or '', counters[counter]))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(filename, prefix='forex_db'):
+    '''
+    Writes the metrics to a text file; it's replaced at once, so a scraper never reads half a file
+    '''
+    temporary = filename + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write(prometheus_text(prefix))
+    os.rename(temporary, filename)
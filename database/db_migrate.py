@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from db_events import log
+from db_queries import BulkWriter, get_db, doc_to_frame, ohlc_fields
+from db_settings import PRICETYPES, STORAGE_ENCODING
+
+OLD_INDEX = 'currency_1_type_1_pricetype_1_freq_1_year_1_month_1'
+
+
+def migrate_pricetype_documents(collection='forex', remove_old=True):
+    '''
+    Converts the old layout (1 document per open/high/low/close, each with its own copy of 'date')
+    into 1 ohlc document per (currency, type, freq, year[, month]):
+        {currency, type, freq, year, month, begin, end, updated, encoding: 'list',
+         date: [...], open: [...], high: [...], low: [...], close: [...]}
+    like the documents stored by db_queries.ohlc_fields() (the lists are copied as they are).
+    Buckets that miss one of the pricetypes are left untouched.
+    Run db_setup.setup_database_forex() afterwards to create the new unique index.
+    '''
+    coll = get_db()[collection]
+    if OLD_INDEX in coll.index_information():
+        coll.drop_index(OLD_INDEX)  # Old unique index includes 'pricetype' and would block the merged documents
+    keys = coll.aggregate([{'$match': {'pricetype': {'$exists': True}}},
+                           {'$group': {'_id': {'currency': '$currency', 'type': '$type', 'freq': '$freq',
+                                               'year': '$year', 'month': '$month'}}}])
+    migrated = 0
+    for key in keys:
+        bucket = dict((k, v) for k, v in key['_id'].items() if v is not None)
+        old_docs = list(coll.find(dict(bucket, pricetype={'$exists': True})))
+        by_pricetype = dict((doc['pricetype'], doc) for doc in old_docs)
+        if sorted(by_pricetype) != sorted(PRICETYPES):
+            log.info('Skipped incomplete bucket %s', bucket)
+            continue
+        fields = {'begin': by_pricetype['open'].get('begin'),
+                  'end': by_pricetype['open'].get('end'),
+                  'updated': datetime.utcnow(),  # version of the cached copies, see db_cache.py
+                  'encoding': 'list',
+                  'date': by_pricetype['open']['date']}
+        for pricetype in PRICETYPES:
+            fields[pricetype] = by_pricetype[pricetype][pricetype]
+        if fields['date']:  # old raw documents stored begin/end of the whole year
+            fields['begin'] = min(fields['date'])
+            fields['end'] = max(fields['date'])
+        # Store the merged document before its sources are removed
+        coll.update_one(dict(bucket, pricetype={'$exists': False}), {'$set': fields}, upsert=True)
+        if remove_old:
+            coll.delete_many({'_id': {'$in': [doc['_id'] for doc in old_docs]}})
+        migrated += 1
+        log.info('Migrated %s', bucket)
+    return migrated
+
+
+def reencode_documents(encoding=STORAGE_ENCODING, collection='forex'):
+    '''
+    Rewrites the ohlc documents that are not stored with 'encoding' ('list' or 'binary').
+    '''
+    coll = get_db()[collection]
+    query = {'type': {'$in': ['raw', 'resampled']}, 'pricetype': {'$exists': False}}
+    if encoding == 'binary': query['encoding'] = {'$ne': 'binary'}
+    else: query['encoding'] = 'binary'
+    with BulkWriter(collection=collection) as writer:
+        for doc in coll.find(query):
+            writer.upsert({'_id': doc['_id']}, {'$set': ohlc_fields(doc_to_frame(doc), encoding=encoding)})
+    return writer.upserted + writer.modified
+
+
+if __name__ == '__main__':
+    migrate_pricetype_documents()
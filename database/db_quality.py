@@ -0,0 +1,185 @@
+'''
+Data quality of the stored buckets (a raw document holds 1 month, a resampled document 1 year).
+scan_ohlc() checks a bucket in 1 vectorized pass and returns a summary:
+- duplicates: bars with the same date as another bar
+- out_of_order: bars with an earlier date than the bar before
+- missing / gaps / max_gap: missing bars while the market is open, number of gaps and longest gap (in bars)
+- ohlc_errors: high < low, or open / close outside low..high
+- nan_rows: bars with a NaN price
+- weekend_bars: bars inside the weekend (WEEKEND_START till WEEKEND_END)
+The summaries are stored in QUALITY_COLLECTION (1 per bucket), so ingest and resampling repair the bad buckets
+(repair_ohlc()) without scanning the data again. Missing bars are reported, but aren't an issue: they can't be repaired.
+'''
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
+
+from db_events import log
+from db_queries import get_db, doc_to_frame, DATA_PROJECTION, META_FIELDS
+from db_settings import CURRENCIES, PRICETYPES, QUALITY_COLLECTION, QUALITY_REPAIR, WEEKEND_START, WEEKEND_END
+
+ISSUES = ['duplicates', 'out_of_order', 'ohlc_errors', 'nan_rows', 'weekend_bars']
+HOUR_NANOS = to_offset('H').nanos
+WEEK_NANOS = to_offset('7D').nanos
+MONDAY_NANOS = pd.Timestamp('1970-01-05').value  # The epoch is a thursday
+
+
+def in_weekend(dates):
+    '''
+    True for the int64 dates (ns) between WEEKEND_START and WEEKEND_END
+    '''
+    offset = (dates - MONDAY_NANOS) % WEEK_NANOS
+    return (offset >= WEEKEND_START * HOUR_NANOS) & (offset < WEEKEND_END * HOUR_NANOS)
+
+
+def market_nanos(dates):
+    '''
+    Time (ns) the market was open between monday 1970-01-05 and the int64 dates (ns): the weekends are left out
+    '''
+    start, end = WEEKEND_START * HOUR_NANOS, WEEKEND_END * HOUR_NANOS
+    since = dates - MONDAY_NANOS
+    weeks, offset = since // WEEK_NANOS, since % WEEK_NANOS
+    return weeks * (WEEK_NANOS - (end - start)) + np.where(offset < start, offset,
+                                                           np.where(offset < end, start, offset - (end - start)))
+
+
+def scan_ohlc(ohlc, frequency='min'):
+    '''
+    Returns the quality summary of a ohlc dataframe (see above). Gaps and weekend bars are only checked
+    for fixed frequencies (min, H, D, ...); a bar is a weekend bar if it lies completely inside the weekend.
+    '''
+    dates = ohlc.index.asi8
+    summary = dict.fromkeys(ISSUES + ['missing', 'gaps', 'max_gap'], 0)
+    summary['rows'] = len(dates)
+    if len(dates):
+        summary['begin'], summary['end'] = pd.Timestamp(dates.min()).to_pydatetime(), pd.Timestamp(dates.max()).to_pydatetime()
+        summary['out_of_order'] = int((np.diff(dates) < 0).sum())
+        ordered = np.sort(dates) if summary['out_of_order'] else dates
+        same = np.diff(ordered) == 0
+        summary['duplicates'] = int(same.sum())
+        values = ohlc[PRICETYPES].values
+        open, high, low, close = values.T
+        with np.errstate(invalid='ignore'):
+            errors = (high < low) | (open > high) | (open < low) | (close > high) | (close < low)
+        summary['ohlc_errors'] = int(errors.sum())
+        summary['nan_rows'] = int(np.isnan(values).any(axis=1).sum())
+        offset = to_offset(frequency)
+        if isinstance(offset, Tick):
+            summary['weekend_bars'] = int((in_weekend(dates) & in_weekend(dates + offset.nanos - 1)).sum())
+            unique = ordered[np.append(True, ~same)]
+            missing = np.diff(market_nanos(unique)) // offset.nanos - 1
+            missing = missing[missing > 0]
+            if len(missing):
+                summary['missing'], summary['gaps'], summary['max_gap'] = int(missing.sum()), len(missing), int(missing.max())
+    summary['ok'] = not any(summary[issue] for issue in ISSUES)
+    return summary
+
+
+def repair_ohlc(ohlc, frequency='min'):
+    '''
+    Returns a repaired copy of a ohlc dataframe: sorted, without NaN rows, duplicates (the last bar is kept)
+    and weekend bars, with high and low widened to hold open and close.
+    '''
+    ohlc = ohlc[~np.isnan(ohlc[PRICETYPES].values).any(axis=1)]
+    if not ohlc.index.is_monotonic_increasing: ohlc = ohlc.sort_index(kind='mergesort')
+    ohlc = ohlc[~ohlc.index.duplicated(keep='last')]
+    offset = to_offset(frequency)
+    if isinstance(offset, Tick):
+        dates = ohlc.index.asi8
+        ohlc = ohlc[~(in_weekend(dates) & in_weekend(dates + offset.nanos - 1))]
+    ohlc = ohlc.copy()
+    values = ohlc[PRICETYPES].values
+    ohlc['high'], ohlc['low'] = values.max(axis=1), values.min(axis=1)
+    return ohlc
+
+
+def bucket_filter(currency, type, frequency, year, month=None):
+    filter_doc = {'currency': currency, 'type': type, 'freq': frequency, 'year': year}
+    if month is not None: filter_doc['month'] = month
+    return filter_doc
+
+
+def store_quality(currency, type, frequency, year, month, summary, checked=None):
+    get_db()[QUALITY_COLLECTION].update_one(bucket_filter(currency, type, frequency, year, month),
+                                            {'$set': dict(summary, checked=checked or datetime.utcnow())}, upsert=True)
+
+
+def check_bucket(currency, type, frequency, year, month, ohlc, repair=QUALITY_REPAIR, checked=None):
+    '''
+    Scans the data of a bucket before it's stored and stores its summary.
+    Returns the repaired data if it has issues and 'repair' is True, otherwise 'ohlc'.
+    'checked' must be the 'updated' time the document is stored with (see db_queries.store_raw_data()):
+    scan_buckets() skips the documents that weren't updated since they were checked.
+    '''
+    summary = scan_ohlc(ohlc, frequency)
+    summary['repaired'] = repair and not summary['ok']
+    store_quality(currency, type, frequency, year, month, summary, checked)
+    if not summary['ok']:
+        log.info('Quality %s-%s-%s-%s-%s: %s', currency, type, frequency, year, month,
+                 ', '.join('{} {}'.format(summary[issue], issue) for issue in ISSUES if summary[issue]))
+    return repair_ohlc(ohlc, frequency) if summary['repaired'] else ohlc
+
+
+def scan_buckets(currency=None, type='raw', frequency='min', rescan=False):
+    '''
+    If currency == '' then all currencies
+    Scans the stored documents that were updated since they were scanned (all with 'rescan') and stores their summaries.
+    Returns the number of scanned documents.
+    '''
+    if currency: currencies = [currency]
+    else: currencies = CURRENCIES
+    scanned = 0
+    for cur in currencies:
+        query = {'currency': cur, 'type': type, 'freq': frequency}
+        checked = dict(((doc['year'], doc.get('month')), doc['checked'])
+                       for doc in get_db()[QUALITY_COLLECTION].find(query, {'year': True, 'month': True, 'checked': True}))
+        for meta in get_db().forex.find(dict(query, year={'$exists': True}), dict.fromkeys(META_FIELDS, True)):
+            key = (meta['year'], meta.get('month'))
+            if not rescan and key in checked and checked[key] >= meta.get('updated', datetime.min): continue
+            doc = get_db().forex.find_one(meta['_id'], DATA_PROJECTION)
+            summary = scan_ohlc(doc_to_frame(doc), frequency)
+            summary['repaired'] = False
+            store_quality(cur, type, frequency, key[0], key[1], summary, checked=meta.get('updated'))
+            scanned += 1
+    return scanned
+
+
+def get_quality(currency=None, type='raw', frequency='min', bad_only=False):
+    '''
+    Dataframe with the stored summaries (1 row per bucket), in bucket order
+    '''
+    query = {'type': type, 'freq': frequency}
+    if currency: query['currency'] = currency
+    if bad_only: query['ok'] = False
+    docs = list(get_db()[QUALITY_COLLECTION].find(query, {'_id': False}).sort([('currency', 1), ('year', 1), ('month', 1)]))
+    return pd.DataFrame(docs)
+
+
+def quality_map(currency, type='raw', frequency='min'):
+    '''
+    {(year, month): summary} of the stored summaries of currency/type/frequency (month is None for resampled buckets)
+    '''
+    return dict(((doc['year'], doc.get('month')), doc)
+                for doc in get_db()[QUALITY_COLLECTION].find({'currency': currency, 'type': type, 'freq': frequency}))
+
+
+def repaired_months(currency, months, frequency='min'):
+    '''
+    Yields the raw months (dataframes from db_queries.iter_ohlc()), the ones whose stored summary
+    has issues that weren't repaired when they were stored are repaired. The other months aren't scanned.
+    '''
+    summaries = quality_map(currency, 'raw', frequency)
+    for ohlc in months:
+        if len(ohlc):
+            summary = summaries.get((ohlc.index[0].year, ohlc.index[0].month))
+            if summary is not None and not summary['ok'] and not summary.get('repaired'):
+                ohlc = repair_ohlc(ohlc, frequency)
+        yield ohlc
+
+
+if __name__ == '__main__':
+    scan_buckets()
+    print get_quality(bad_only=True).to_string()
@@ -1,159 +1,508 @@
-from calendar import monthrange
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import ConnectionFailure
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
-from db_settings import MONGO_HOST, MONGO_PORT, DB
+import db_cache
+import db_memo
+from db_events import log
+from db_metrics import timed, timer, timed_cursor, count_read, count_write
+from db_codec import encode_dates, decode_dates, encode_prices, decode_prices
+from db_settings import MONGO_HOST, MONGO_PORT, MONGO_POOL_SIZE, BULK_SIZE, DB, PRICETYPES, STORAGE_ENCODING, PRICE_DECIMALS, \
+    WATERMARK_COLLECTION, MONGO_TIMEOUT_MS, CACHE_ENABLED, CACHED_TYPES, CURRENCIES
+
+DATA_FIELDS = ['date', 'encoding', 't0', 'decimals']  # Fields needed to decode the data arrays
+META_FIELDS = ['currency', 'type', 'freq', 'year', 'month', 'begin', 'end', 'updated']
+DATA_PROJECTION = dict.fromkeys(META_FIELDS + DATA_FIELDS + PRICETYPES, True)
 
 
-# Todo: Check if it's good to initiate db connection for every method. (client = MongoClient(host=MONGO_HOST, port=MONGO_PORT))
 # Todo: Make methods more reusable. Use store_month(), store_year(), ... to store raw, resampled and signals
 
+_client = None  # Shared MongoClient, created on first use by get_client()
+
+
+def get_client():
+    '''
+    Returns the module wide MongoClient. The client is created on first use and keeps a connection pool,
+    so all queries share the same connections instead of opening a new one per call.
+    '''
+    global _client
+    if _client is None:
+        _client = MongoClient(host=MONGO_HOST, port=MONGO_PORT, maxPoolSize=MONGO_POOL_SIZE,
+                              serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+    return _client
+
+
+def get_db():
+    return get_client()[DB]
+
+
+class BulkWriter(object):
+    '''
+    Collects UpdateOne upserts and sends them with bulk_write() in batches of 'batch_size' operations.
+    The currency of every operation is kept for the metrics: a batch is sent in 1 bulk_write() per run of
+    operations of the same currency (usually the whole batch), timed as 'mongo_write' of that currency.
+    Use it as a context manager, or call flush() when done:
+        with BulkWriter() as writer:
+            writer.upsert(filter_doc, update_doc)
+    '''
+
+    def __init__(self, collection='forex', batch_size=BULK_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.operations = []
+        self.currencies = []  # Currency of every operation
+        self.upserted = 0
+        self.modified = 0
 
-def store_raw_data(currency, year, month, ohlc):
+    def upsert(self, filter_doc, update_doc):
+        db_memo.invalidate_bucket(filter_doc)
+        count_write('mongo_write', filter_doc.get('currency'), update_doc)
+        self.operations.append(UpdateOne(filter=filter_doc, update=update_doc, upsert=True))
+        self.currencies.append(filter_doc.get('currency'))
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.operations:
+            return None
+        bounds = [0] + [i for i in range(1, len(self.currencies)) if self.currencies[i] != self.currencies[i - 1]] + \
+                 [len(self.operations)]
+        for b, e in zip(bounds[:-1], bounds[1:]):
+            with timer('mongo_write', self.currencies[b]):
+                result = get_db()[self.collection].bulk_write(self.operations[b:e], ordered=False)
+            self.upserted += result.upserted_count
+            self.modified += result.modified_count
+        self.operations, self.currencies = [], []
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
+@timed()
+def store_raw_data(currency, year, month, ohlc, writer=None, updated=None):
     '''
-    Receives a ohlc dataframe, converts it in a raw-data document and stores the document in mongodb.
+    Receives a ohlc dataframe, converts it in a raw-data document per month and stores the documents in mongodb.
     Document format:
     { currency: 'EURUSD',
       type: 'raw',
-      freq: 'minute',
+      freq: 'min',
       year: 2017,
-      start: 20160101 050100 # datetime
-      end: 20161231 170100 # datetime
+      month: 1,
+      begin: 20170101 050100 # datetime
+      end: 20170131 170100 # datetime
       date: [ ... ],
       open: [ ... ],
       high: [ ... ],
       low: [ ... ],
-      close[ ... ]
+      close: [ ... ]
     }
+    The documents are queued on 'writer'. If no writer is given, a new one is used and flushed before returning.
+    'updated': the update time of the documents (default: now), eg: the time of their quality check (see db_quality.py).
     '''
     result = None
+    own_writer = writer is None
+    if own_writer: writer = BulkWriter()
     if month == 0:  # then it's a full year of data -> store new document per month (orherwise to big for bson)
-        for m in range(1, 13):
-            last_dom = monthrange(year, m)[1]  # last day of the month
-            ohlc_month = ohlc[datetime(year, m, 1):datetime(year, m, last_dom)]
-            for pricetype in ['open', 'high', 'low', 'close']:
-                # Todo: Now data is stored as {date:[...], close:[...] would it be better if stored as # {close: {date:price}} ?
-                filter_doc = {'currency': currency,
-                              'type': 'raw',
-                              'pricetype': pricetype,
-                              'freq': 'min',
-                              'year': year,
-                              'month': m
-                              }
-                update_doc = {'$set': {'begin': ohlc.index.min(),  # datetime
-                                       'end': ohlc.index.max(),  # datetime
-                                       'date': ohlc_month.index.tolist(),
-                                       pricetype: ohlc_month[pricetype].values.tolist(),
-                                       }}
-                client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-                db = client[DB]
-                result = db.forex.update_one(filter=filter_doc,
-                                             update=update_doc,
-                                             upsert=True)
-                print 'Saved {}-{}-{}-{} '.format(currency, year, m, pricetype)
-
-    else:  # then it's only a month of data -> update existing year with month document
-        pass  # Todo: make update document for month data
-        result = None
+        months = range(1, 13)
+    else:  # then it's only a month of data -> update the month document of that year
+        months = [month]
+    for m in months:
+        key = '{}-{:02d}'.format(year, m)
+        ohlc_month = ohlc.loc[key:key]
+        if ohlc_month.empty: continue
+        filter_doc = {'currency': currency,
+                      'type': 'raw',
+                      'freq': 'min',
+                      'year': year,
+                      'month': m
+                      }
+        writer.upsert(filter_doc, {'$set': ohlc_fields(ohlc_month, updated=updated)})
+        log.debug('Queued %s-%s-%s', currency, year, m)
+    if own_writer: result = writer.flush()
     return result
 
 
-def store_resampled_data(currency, ohlc):
-    # Remove NaN
-    freq = pd.infer_freq(ohlc.index)
-    ohlc.dropna(inplace=True)
+def merge_stored(filter_doc, frame, columns=PRICETYPES):
+    '''
+    Returns 'frame' completed with the bars of the stored document 'filter_doc' at the dates that aren't in 'frame',
+    so storing a part of a bucket (eg: the bars of a month that are in another file) doesn't erase its other bars.
+    The bars of 'frame' replace the stored bars at the same dates. Without stored bars 'frame' is returned as it is.
+    '''
+    frame = frame[list(columns)]
+    if frame.index.tz is not None: frame = frame.tz_convert('UTC').tz_localize(None)  # Stored dates are naive UTC
+    with timer('mongo_read', filter_doc.get('currency')):
+        stored = get_db().forex.find_one(filter_doc, dict.fromkeys(DATA_FIELDS + list(columns), True))
+    if stored is None: return frame
+    count_read('mongo_read', filter_doc.get('currency'), stored)
+    stored = doc_to_frame(stored, columns)
+    stored = stored[~stored.index.isin(frame.index)]
+    if stored.empty: return frame
+    return pd.concat([stored, frame]).sort_index(kind='mergesort')
+
+
+def merge_raw_month(currency, year, month, ohlc):
+    '''
+    merge_stored() for the raw month document currency/year/month
+    '''
+    return merge_stored({'currency': currency, 'type': 'raw', 'freq': 'min', 'year': year, 'month': month}, ohlc)
+
+
+@timed()
+def store_resampled_data(currency, ohlc, writer=None, frequency=None):
+    '''
+    Stores a resampled ohlc dataframe as 1 document per year:
+    {currency: 'EURUSD', type: 'resampled', freq: 'D', year: 2017, begin: ..., end: ..., date: [...], open: [...], ...}
+    If no 'frequency' is given, the frequency of the index is used (eg: the result of resample()).
+    '''
+    freq = frequency or ohlc.index.freqstr
+    if freq is None: raise ValueError('No frequency given for the resampled data of {}'.format(currency))
+    own_writer = writer is None
+    if own_writer: writer = BulkWriter()
+    ohlc = ohlc.dropna()  # Empty bins, without changing the caller's dataframe
     begin = ohlc.index.min()  # pandas.tslib.Timestamp
     end = ohlc.index.max()  # pandas.tslib.Timestamp
 
     for y in range(begin.year, end.year + 1):  # Store 1 year of data
-        ohlc_y = ohlc[datetime(y, 1, 1):datetime(y, 12, 31)]
-        begin = ohlc_y.index.min()  # pandas.tslib.Timestamp
-        end = ohlc_y.index.max()  # pandas.tslib.Timestamp
-        for pricetype in ['open', 'high', 'low', 'close']:
-            # Todo: Now data is stored as {date:[...], close:[...] would it be better if stored as # {close: {date:price}} ?
-            filter_doc = {'currency': currency,
-                          'type': 'resampled',
-                          'pricetype': pricetype,
-                          'freq': freq,
-                          'year': y
-                          }
-
-            update_doc = {'$set': {'begin': begin,
-                                   'end': end,
-                                   'date': ohlc_y.index.tolist(),
-                                   pricetype: ohlc_y[pricetype].values.tolist(),
-                                   }}
-
-            client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-            db = client[DB]
-            result = db.forex.update_one(filter=filter_doc,
-                                         update=update_doc,
-                                         upsert=True)
-            print 'Saved {}-{}-{}'.format(currency, y, pricetype)
-
-
-def get_raw_data(currency, frequency, year, month, pricetype):
-    client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-    db = client[DB]
+        ohlc_y = ohlc.loc[str(y):str(y)]
+        if ohlc_y.empty: continue
+        filter_doc = {'currency': currency,
+                      'type': 'resampled',
+                      'freq': freq,
+                      'year': y
+                      }
+        writer.upsert(filter_doc, {'$set': ohlc_fields(ohlc_y)})
+        log.debug('Queued %s-%s-%s', currency, freq, y)
+    if own_writer: return writer.flush()
+
+
+@timed()
+def append_bars(currency, type, frequency, ohlc, writer=None):
+    '''
+    Appends new bars (later than the stored ones) to the raw month documents (type 'raw')
+    or the resampled year documents, eg: live bars (see business_logic/streaming.py).
+    List encoded documents get the bars pushed; binary encoded documents, or documents that already
+    have bars from the first new date on (an updated bar), are rewritten.
+    Only the 'end' and 'encoding' of the documents are read, the data arrays only for a rewrite.
+    '''
+    own_writer = writer is None
+    if own_writer: writer = BulkWriter()
+    keys = ohlc.index.year * 100 + (ohlc.index.month if type == 'raw' else 0)
+    for key in np.unique(keys):
+        bars = ohlc[keys == key]
+        filter_doc = {'currency': currency, 'type': type, 'freq': frequency, 'year': key // 100}
+        if type == 'raw': filter_doc['month'] = key % 100
+        with timer('mongo_meta', currency):
+            stored = get_db().forex.find_one(filter_doc, {'end': True, 'encoding': True})  # Not the data arrays
+        if stored is not None: count_read('mongo_meta', currency, stored)
+        if stored is not None and (stored.get('encoding') == 'binary' or stored['end'] >= bars.index[0]):
+            with timer('mongo_read', currency):
+                stored = get_db().forex.find_one(filter_doc, DATA_PROJECTION)
+            count_read('mongo_read', currency, stored)
+            frame = pd.concat([doc_to_frame(stored), bars[PRICETYPES]])
+            writer.upsert(filter_doc, {'$set': ohlc_fields(frame[~frame.index.duplicated(keep='last')].sort_index())})
+            continue
+        update = {'$push': dict((col, {'$each': bars[col].values.tolist()}) for col in PRICETYPES),
+                  '$min': {'begin': bars.index[0].to_pydatetime()},
+                  '$max': {'end': bars.index[-1].to_pydatetime()},
+                  '$set': {'updated': datetime.utcnow(), 'encoding': 'list'}}
+        update['$push']['date'] = {'$each': bars.index.to_pydatetime().tolist()}
+        writer.upsert(filter_doc, update)
+    if own_writer: return writer.flush()
+
+
+def ohlc_fields(ohlc, encoding=STORAGE_ENCODING, columns=PRICETYPES, updated=None):
+    '''
+    Returns the document fields for a ohlc dataframe. The dates are stored once, next to the 4 price arrays.
+    With encoding='binary' the arrays are stored as binary columns (see db_codec.py).
+    '''
+    fields = {'begin': ohlc.index.min(),  # datetime
+              'end': ohlc.index.max(),  # datetime
+              'updated': updated or datetime.utcnow(),  # invalidates the cached copies, see db_cache.py
+              'encoding': encoding}
+    if encoding == 'binary':
+        fields['t0'], fields['date'] = encode_dates(ohlc.index)
+        fields['decimals'] = PRICE_DECIMALS
+        for pricetype in columns:
+            fields[pricetype] = encode_prices(ohlc[pricetype].values, PRICE_DECIMALS)
+    else:
+        fields['date'] = ohlc.index.tolist()
+        for pricetype in columns:
+            fields[pricetype] = ohlc[pricetype].values.tolist()
+    return fields
+
+
+@timed()
+def store_series(currency, type, frequency, frame, writer=None, fields=None):
+    '''
+    Stores a dataframe with any float columns (eg: returns, volatility) as 1 document per year
+    of type 'type'. Columns that aren't in 'frame' are kept in the stored documents (they must have the same dates).
+    The values are stored as lists (the binary encoding is only for prices).
+    'fields' are extra fields set in every document (eg: {'version': 2}).
+    '''
+    own_writer = writer is None
+    if own_writer: writer = BulkWriter()
+    if len(frame):
+        for y in range(frame.index.min().year, frame.index.max().year + 1):
+            frame_y = frame.loc[str(y):str(y)]
+            if frame_y.empty: continue
+            filter_doc = {'currency': currency, 'type': type, 'freq': frequency, 'year': y}
+            writer.upsert(filter_doc, {'$set': dict(ohlc_fields(frame_y, encoding='list', columns=frame.columns), **(fields or {}))})
+            log.debug('Queued %s-%s-%s-%s', currency, type, frequency, y)
+    if own_writer: return writer.flush()
+
+
+def doc_to_frame(doc, columns=PRICETYPES):
+    '''
+    Converts a stored document into a dataframe with a 'date' index and 'columns'
+    '''
+    currency = doc.get('currency')
+    if doc.get('encoding') == 'binary':
+        with timer('decode', currency):
+            index = decode_dates(doc['t0'], doc['date'])
+            data = dict((col, decode_prices(doc[col], doc['decimals'])) for col in columns)
+        with timer('dataframe', currency):
+            return pd.DataFrame(data, index=index, columns=list(columns))
+    data = {'date': doc['date']}
+    for col in columns:
+        data[col] = doc[col]
+    with timer('dataframe', currency):  # The lists are converted to arrays here
+        return pd.DataFrame(data, columns=['date'] + list(columns)).set_index(keys='date')
+
+
+def to_datetime(date, end=False):
+    '''
+    Converts 'date' into a naive UTC datetime, like the dates stored in mongodb.
+    Strings 'yyyy' and 'yyyy-mm' are a whole year/month: with end=True the last moment of that period is returned.
+    '''
+    if date is None:
+        return None
+    stamp = pd.Timestamp(date)
+    if stamp.tzinfo is not None:
+        stamp = stamp.tz_convert('UTC').tz_localize(None)
+    if end and isinstance(date, basestring) and len(date) in (4, 7):
+        stamp = (stamp + to_offset('AS' if len(date) == 4 else 'MS')) - pd.Timedelta(microseconds=1)
+    return stamp.to_pydatetime()
+
+
+def bucket_query(currency, type, frequency, begin=None, end=None):
+    '''
+    Returns the query for the 'type' documents of currency/frequency that overlap 'begin' till 'end'.
+    'begin' and 'end' are naive UTC datetimes. None means no limit.
+    The query is covered by the (currency, type, freq, year, end, begin) index: see db_setup.py
+    '''
+    query = {'currency': currency,
+             'type': type,
+             'freq': frequency,
+             }
+    if begin is not None:
+        query['year'] = {'$gte': begin.year}
+        query['end'] = {'$gte': begin}
+    if end is not None:
+        query.setdefault('year', {})['$lte'] = end.year
+        query['begin'] = {'$lte': end}
+    return query
+
+
+def find_buckets(currency, type, frequency, begin=None, end=None, columns=PRICETYPES):
+    '''
+    Returns a cursor, in date order, over the 'type' documents of currency/frequency that overlap 'begin' till 'end'.
+    'begin' and 'end' are datetimes (or strings: see to_datetime()). None means no limit.
+    Only the date and 'columns' arrays are fetched.
+    '''
+    query = bucket_query(currency, type, frequency, to_datetime(begin), to_datetime(end, end=True))
+    projection = dict.fromkeys(DATA_FIELDS + list(columns), True)
+    return get_db().forex.find(query, projection).sort([('begin', 1)])
+
+
+def trim_frame(frame, begin=None, end=None):
+    '''
+    Returns the rows of a date sorted frame between begin and end (naive UTC datetimes), without copying
+    '''
+    first = frame.index.searchsorted(begin, side='left') if begin is not None else 0
+    last = frame.index.searchsorted(end, side='right') if end is not None else len(frame)
+    return frame.iloc[first:last]
+
+
+def iter_ohlc(currency='EURUSD', type='resampled', frequency='D', begin=None, end=None, columns=PRICETYPES):
+    '''
+    Yields the data from 'begin' till 'end' as dataframes, one per document, in date order.
+    The documents at the edges of the window are trimmed to the window.
+    Raw and resampled documents are read through the in-memory cache (db_memo.py) and the local disk cache (db_cache.py):
+    only documents that aren't cached, or were updated since they were cached, are fetched.
+    If mongodb can't be reached, the data cached on disk is returned.
+    '''
+    begin, end = to_datetime(begin), to_datetime(end, end=True)
+    if not CACHE_ENABLED or type not in CACHED_TYPES or not set(columns) <= set(PRICETYPES):
+        for doc in timed_cursor(find_buckets(currency, type, frequency, begin, end, columns), 'mongo_read', currency):
+            yield trim_frame(doc_to_frame(doc, columns), begin, end)
+        return
+
+    query = bucket_query(currency, type, frequency, begin, end)
+    try:
+        metas = list(timed_cursor(get_db().forex.find(query, dict.fromkeys(META_FIELDS, True)).sort([('begin', 1)]),
+                                  'mongo_meta', currency))
+    except ConnectionFailure:
+        log.info('MongoDB not available: reading %s-%s-%s from cache', currency, type, frequency)
+        for key in db_cache.entries(currency, type, frequency, begin, end):
+            frame = db_cache.load(key, columns=columns)
+            if frame is not None:
+                yield trim_frame(frame, begin, end)
+        return
+
+    # Documents that are neither in memory (db_memo.py) nor on disk (db_cache.py) are fetched in 1 query
+    misses = [meta['_id'] for meta in metas
+              if not db_memo.is_cached(db_cache.doc_key(meta), db_cache.doc_version(meta), columns)
+              and db_cache.cached_version(db_cache.doc_key(meta)) != db_cache.doc_version(meta)]
+    # Fetched in date order, in step with 'metas'
+    missing_docs = timed_cursor(get_db().forex.find({'_id': {'$in': misses}}, DATA_PROJECTION).sort([('begin', 1)]),
+                                'mongo_read', currency) if misses else None
+    misses = set(misses)
+    for meta in metas:
+        key, version = db_cache.doc_key(meta), db_cache.doc_version(meta)
+        frame = db_memo.load_frame(key, version, columns)
+        if frame is None:
+            if meta['_id'] not in misses:
+                with timer('cache_load', currency):
+                    frame = db_cache.load(key, version)
+            if frame is None:
+                if meta['_id'] in misses:
+                    doc = next(missing_docs)
+                else:
+                    with timer('mongo_read', currency):
+                        doc = get_db().forex.find_one(meta['_id'], DATA_PROJECTION)
+                    count_read('mongo_read', currency, doc)
+                frame = doc_to_frame(doc)
+                db_cache.store(key, version, frame)
+            db_memo.store_frame(key, version, frame)
+            frame = frame[list(columns)]
+        yield trim_frame(frame, begin, end)
+
+
+@timed()
+def get_ohlc(currency='EURUSD', type='resampled', frequency='D', begin=None, end=None, columns=PRICETYPES):
+    '''
+    Get the data starting from 'begin' till 'end' for currency with 1 query
+    and return it as 1 dataframe with columns open, high, low, close.
+    '''
+    frames = list(iter_ohlc(currency, type, frequency, begin, end, columns))
+    log.info('Got %s %s-%s-%s documents', len(frames), currency, type, frequency)
+    if not frames:
+        return pd.DataFrame(columns=list(columns), index=pd.DatetimeIndex([], name='date'))
+    with timer('concat', currency):
+        return pd.concat(frames)  # The documents are already in date order
+
+
+@timed()
+def get_panel(currencies=CURRENCIES, type='resampled', frequency='D', begin=None, end=None, columns=PRICETYPES):
+    '''
+    The ohlc of several currencies on 1 time axis (the union of their dates), in columnar form:
+    {pricetype: dataframe with 1 column per currency}.
+    A missing bar of a currency is filled with its previous close (a flat bar), bars before its first bar stay NaN.
+    panel['real'] is True where the currency has a stored bar: the filled bars shouldn't be traded (see backtesting/portfolio.py).
+    '''
+    frames = [get_ohlc(currency, type, frequency, begin, end, columns) for currency in currencies]
+    dates = pd.DatetimeIndex(np.unique(np.concatenate([frame.index.values for frame in frames])), name='date')
+    panel = {'real': pd.DataFrame(dict((currency, dates.isin(frame.index)) for currency, frame in zip(currencies, frames)),
+                                  index=dates, columns=currencies)}
+    close = pd.DataFrame(dict((currency, frame['close'].reindex(dates)) for currency, frame in zip(currencies, frames)),
+                         columns=currencies).ffill() if 'close' in columns else None
+    for pricetype in columns:
+        panel[pricetype] = pd.DataFrame(dict((currency, frame[pricetype].reindex(dates))
+                                             for currency, frame in zip(currencies, frames)), columns=currencies)
+        if close is not None:
+            panel[pricetype] = panel[pricetype].fillna(close)
+    return panel
+
+
+def get_watermark(currency, type, frequency):
+    '''
+    Returns the date of the last raw bar that was processed into the 'type' documents of currency/frequency,
+    or None if they were never built.
+    '''
+    doc = get_db()[WATERMARK_COLLECTION].find_one({'currency': currency, 'type': type, 'freq': frequency})
+    return doc['watermark'] if doc else None
+
+
+def set_watermark(currency, type, frequency, watermark):
+    get_db()[WATERMARK_COLLECTION].update_one({'currency': currency, 'type': type, 'freq': frequency},
+                                              {'$set': {'watermark': watermark}},
+                                              upsert=True)
+
+
+SIGNAL_FIELDS = ['currency', 'freq', 'rule', 'date', 'direction', 'strength', 'price']
+
+
+def store_signals(events, writer=None):
+    '''
+    Stores signal events (a dataframe with the columns of SIGNAL_FIELDS) as 1 small document per event:
+    {currency: 'EURUSD', type: 'signal', freq: 'D', rule: 'baseline_sma_28_7', date: ..., direction: 1, strength: ..., price: ...}
+    '''
+    own_writer = writer is None
+    if own_writer: writer = BulkWriter()
+    for event in events[SIGNAL_FIELDS].itertuples(index=False):
+        filter_doc = {'currency': event.currency, 'type': 'signal', 'freq': event.freq, 'rule': event.rule,
+                      'date': event.date.to_pydatetime()}
+        writer.upsert(filter_doc, {'$set': {'direction': int(event.direction), 'strength': float(event.strength),
+                                            'price': float(event.price)}})
+    if own_writer: return writer.flush()
+
+
+def get_signals(currency=None, frequency=None, rule=None, since=None, limit=0):
+    '''
+    The most recent signal events first, as a dataframe with the columns of SIGNAL_FIELDS.
+    1 indexed read (see db_setup.setup_database_forex())
+    '''
+    query = {'type': 'signal'}
+    if currency: query['currency'] = currency
+    if frequency: query['freq'] = frequency
+    if rule: query['rule'] = rule
+    if since is not None: query['date'] = {'$gte': to_datetime(since)}
+    cursor = get_db().forex.find(query, dict.fromkeys(SIGNAL_FIELDS, True)).sort([('date', -1)]).limit(limit)
+    return pd.DataFrame(list(cursor), columns=SIGNAL_FIELDS)
+
+
+def get_last_signal(currency, frequency, rule):
+    '''
+    The last stored signal event (a dict) of a currency, frequency and rule, or None.
+    '''
+    return get_db().forex.find_one({'type': 'signal', 'currency': currency, 'freq': frequency, 'rule': rule},
+                                   sort=[('date', -1)])
+
+
+@timed()
+def get_raw_data(currency, frequency, year, month, pricetype=None):
+    db = get_db()
+    projection = None
+    if pricetype: projection = dict.fromkeys(['date', 'encoding', 't0', 'decimals', pricetype], True)
     result = db.forex.find_one({'currency': currency,
                                 'type': 'raw',
-                                'pricetype': pricetype,
                                 'freq': frequency,
                                 'year': year,
-                                'month': month})
+                                'month': month}, projection)
     return result
 
 
 def get_all_raw_data(currency='EURUSD', frequency='min', begin='1970-01', end='2020-12', pricetype='open'):
     '''
-    Get all the 'pricetype' raw documents starting from 'begin' till 'end' for currency
+    Get all the 'pricetype' raw data starting from 'begin' till 'end' for currency
     and return a dataframe
     '''
-    client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-    db = client[DB]
-    begin_y = int(begin[:4])
-    begin_m = int(begin[5:7])
-    end_y = int(end[:4])
-    end_m = int(end[5:7])
-    result = db.forex.find({'currency': currency,
-                            'type': 'raw',
-                            'pricetype': pricetype,
-                            'freq': frequency,
-                            'year': {'$gte': begin_y, '$lte': end_y},
-                            'month': {'$gte': begin_m, '$lte': end_m},
-                            })
-    frames = []
-    print 'Got {} {}-{}-{} documents'.format(result.count(), currency, frequency, pricetype)
-    for doc in result:
-        result_df = pd.DataFrame({'date': doc['date'], pricetype: doc[pricetype]})
-        result_df.set_index(keys='date', inplace=True)
-        frames.append(result_df)
-    return pd.concat(frames)
+    return get_ohlc(currency=currency, type='raw', frequency=frequency, begin=begin, end=end, columns=[pricetype])
 
 
 def get_all_resampled_data(currency='EURUSD', frequency='D', begin='1970', end='2020', pricetype='close'):
-    # Todo: Load ohlc data iso only o,h,l,c.
     # Todo: Move to db_workers.py
-    client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-    db = client[DB]
-    begin_y = int(begin)
-    end_y = int(end)
-    result = db.forex.find({'currency': currency,
-                            'type': 'resampled',
-                            'pricetype': pricetype,
-                            'freq': frequency,
-                            'year': {'$gte': begin_y, '$lte': end_y},
-                            })
-    frames = []
-    print 'Got {} {}-{}-{} documents'.format(result.count(), currency, frequency, pricetype)
-    for doc in result:
-        result_df = pd.DataFrame({'date': doc['date'], pricetype: doc[pricetype]})
-        result_df.set_index(keys='date', inplace=True)
-        frames.append(result_df)
-    return pd.concat(frames)
+    return get_ohlc(currency=currency, type='resampled', frequency=frequency, begin=begin, end=end, columns=[pricetype])
 
 
 if __name__ == '__main__':
     # print get_all_raw_data()
-    print get_all_resampled_data(currency='EURUSD', frequency='D', begin='2009', end='2010', pricetype='open')
+    print get_ohlc(currency='EURUSD', type='resampled', frequency='D', begin='2009', end='2010')
@@ -1,3 +1,5 @@
+import os
+
 # mongodb settings
 testing = True
 TEST_DATABASE = 'test_forex'
@@ -13,11 +15,79 @@ else:
 
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
+MONGO_POOL_SIZE = 10  # max connections in the shared client pool
+MONGO_TIMEOUT_MS = 2000  # give up (and read from the cache) if mongodb doesn't answer
+BULK_SIZE = 48  # operations per bulk_write() round trip (1 year of raw month documents)
 
 # Localization settings
 LOCAL_TIMEZONE = 'Europe/Brussels'
 LOCAL_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Price columns stored in every ohlc document
+PRICETYPES = ['open', 'high', 'low', 'close']
+
+# Storage of the date and price arrays in the ohlc documents:
+#   'list': BSON arrays of datetimes and floats
+#   'binary': int64 second deltas for the dates and 4-decimal scaled int32 for the prices (see db_codec.py)
+STORAGE_ENCODING = 'list'
+PRICE_DECIMALS = 4
+
+# Raw data files (histdata.com)
+RAW_DATA_PATH = '../raw_data/download/'
+RAW_CHUNKSIZE = 100000  # rows per chunk when streaming a csv file
+HISTDATA_EST_OFFSET = 5  # hours: histdata uses EST without daylight saving -> UTC = EST + 5h
+
+# Tick data (db_ticks.py)
+DUKASCOPY_PATH = '../raw_data/dukascopy/'
+TICK_COLLECTION = 'ticks'
+TICK_DECIMALS = 5  # ticks are stored as int32 in units of 10 ** -TICK_DECIMALS
+TICK_CHUNKSIZE = 1000000  # rows per chunk when streaming a tick csv file
+
+# Parallel ingest (db_ingest.py)
+INGEST_WRITERS = 2  # writer threads
+INGEST_QUEUE_SIZE = 24  # parsed months waiting to be written
+MANIFEST_COLLECTION = 'ingest_manifest'
+
+# Data quality summaries per bucket (db_quality.py)
+QUALITY_COLLECTION = 'quality'
+QUALITY_REPAIR = True  # Repair the months with issues before they're stored
+WEEKEND_START = 4 * 24 + 22  # hours since monday 00:00 UTC: friday 22:00 (17:00 EST)
+WEEKEND_END = 6 * 24 + 22  # sunday 22:00
+
+# Last processed raw bar per (currency, type, freq), for incremental updates
+WATERMARK_COLLECTION = 'watermarks'
+
+# Timeframes that are built from the raw minute data
+TIMEFRAMES = ['5min', '15min', 'H', '4H', 'D', 'W']
+
+# Local on-disk cache of the decoded documents (db_cache.py), in <repo>/cache from any working directory
+CACHE_ENABLED = True
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cache')
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHED_TYPES = ['raw', 'resampled']
+MEMO_MAX_BYTES = 512 * 1024 ** 2  # In-process cache of decoded series (db_memo.py)
+
+# Instrumentation of the database layer (db_metrics.py)
+METRICS_ENABLED = False  # Switch on at runtime with db_metrics.configure(enabled=True)
+METRICS_BYTES = True  # Measure the BSON size of the documents read and written (costs an encode per document)
+
+# Logging (db_events.py): 0 = errors only, 1 = info, 2 = debug (every document, order and trade)
+LOG_LEVEL = 1
+LOG_FILE = None  # None = console
+
+# Signal rules evaluated by business_logic/signals.py: (rule, params)
+SIGNAL_RULES = [('baseline_sma', {'sma_short_period': 7, 'sma_long_period': 28}),
+                ('simple_sma', {'smaperiod': 5})]
+
+# Indicators stored by business_logic/indicators.py: (indicator, params). Increase the version when they change.
+INDICATOR_SET = [('sma', {'period': 20}), ('ema', {'period': 20}), ('bbands', {'period': 20, 'nbdev': 2}),
+                 ('rsi', {'period': 14}), ('atr', {'period': 14}), ('macd', {'fast': 12, 'slow': 26, 'signal': 9})]
+INDICATOR_VERSION = 1
+
+# Live bars (business_logic/streaming.py)
+STREAM_FLUSH_BARS = 60  # minute bars buffered before they are written
+STREAM_PORT = 5555  # local socket source
+
 # Currency list
 CURRENCIES = ['EURUSD', 'EURCHF', 'EURGBP', 'EURJPY', 'USDCAD']
 # CURRENCIES=['EURUSD']
\ No newline at end of file
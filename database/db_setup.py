@@ -1,22 +1,53 @@
-from pymongo import MongoClient
-from db_settings import MONGO_HOST, MONGO_PORT, DB
+from db_queries import get_db
+from db_settings import MANIFEST_COLLECTION, WATERMARK_COLLECTION, QUALITY_COLLECTION, TICK_COLLECTION
 
-client = MongoClient(host=MONGO_HOST, port=MONGO_PORT)
-db = client[DB]
+OBSOLETE_INDEXES = ['type_1', 'freq_1', 'year_1', 'start_1', 'end_1']
+BUCKET_INDEX = 'currency_1_type_1_freq_1_year_1_month_1'
 
 
 def setup_database_forex():
-    collection = db.forex
+    collection = get_db().forex
 
-    collection.create_index([('currency', 1), ('type', 1), ('pricetype', 1), ('freq', 1), ('year', 1), ('month', 1)], unique=True)
-    collection.create_index('type')
-    collection.create_index('freq')
-    collection.create_index('year')
-    collection.create_index('start')
-    collection.create_index('end' )
+    existing = collection.index_information()
+    for name in OBSOLETE_INDEXES:
+        if name in existing:
+            collection.drop_index(name)
+    # The bucket index only applies to documents with a year (not to the signal events)
+    bucket_index = existing.get(BUCKET_INDEX)
+    if bucket_index and 'partialFilterExpression' not in bucket_index:
+        collection.drop_index(BUCKET_INDEX)
+    collection.create_index([('currency', 1), ('type', 1), ('freq', 1), ('year', 1), ('month', 1)], unique=True,
+                            partialFilterExpression={'year': {'$exists': True}})
+    # Date range queries: see db_queries.find_buckets()
+    collection.create_index([('currency', 1), ('type', 1), ('freq', 1), ('year', 1), ('end', 1), ('begin', 1)])
+    # Signal events: 1 document per (currency, freq, rule, date), read the most recent first (db_queries.get_signals())
+    collection.create_index([('type', 1), ('currency', 1), ('freq', 1), ('rule', 1), ('date', -1)], unique=True,
+                            partialFilterExpression={'type': 'signal'})
+    collection.create_index([('type', 1), ('date', -1)], partialFilterExpression={'type': 'signal'})
+
+
+def setup_database_manifest():
+    get_db()[MANIFEST_COLLECTION].create_index([('currency', 1), ('year', 1), ('month', 1)], unique=True)
+
+
+def setup_database_watermarks():
+    get_db()[WATERMARK_COLLECTION].create_index([('currency', 1), ('type', 1), ('freq', 1)], unique=True)
+
+
+def setup_database_quality():
+    get_db()[QUALITY_COLLECTION].create_index([('currency', 1), ('type', 1), ('freq', 1), ('year', 1), ('month', 1)],
+                                              unique=True)
+
+
+def setup_database_ticks():
+    get_db()[TICK_COLLECTION].create_index([('currency', 1), ('type', 1), ('day', 1)], unique=True)
 
 
 if __name__ == '__main__':
     setup_database_forex()
+    setup_database_manifest()
+    setup_database_watermarks()
+    setup_database_quality()
+    setup_database_ticks()
 
 
@@ -0,0 +1,291 @@
+'''
+Tick data (Dukascopy) ingestion and tick -> minute bar aggregation.
+Sources, read in a streaming way (1 day of ticks in memory):
+- the Dukascopy hour files {DUKASCOPY_PATH}/{CURRENCY}/{yyyy}/{mm - 1}/{dd}/{HH}h_ticks.bi5: lzma compressed records
+  of 20 bytes (big endian): ms since the hour, ask and bid in points (uint32), ask and bid volume (float32).
+  Reading them needs lzma (python 3, or backports.lzma on python 2).
+- the csv export of Dukascopy: 'Gmt time,Ask,Bid,AskVolume,BidVolume' with times 'dd.mm.yyyy HH:MM:SS.fff' (UTC).
+The ticks are stored in TICK_COLLECTION (type 'tick'), 1 document per currency and day, as zlib compressed binary columns:
+ms since midnight (uint32 deltas), bid and ask (int32 deltas in units of 10 ** -TICK_DECIMALS), volumes (float32).
+The minute bars (bid ohlc, rounded to PRICE_DECIMALS like the histdata bars) are stored as type 'raw' month documents,
+the spread statistics per minute (ticks, mean and max spread, volume) as type 'spread' month documents.
+'''
+import os
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from bson.binary import Binary
+
+from db_events import log
+from db_metrics import timed
+from db_quality import check_bucket
+from db_queries import BulkWriter, get_db, merge_raw_month, merge_stored, store_raw_data, ohlc_fields
+from db_settings import CURRENCIES, DUKASCOPY_PATH, TICK_COLLECTION, TICK_DECIMALS, TICK_CHUNKSIZE, PRICETYPES, \
+    PRICE_DECIMALS
+
+TICK_FIELDS = ['time', 'bid', 'ask', 'bid_volume', 'ask_volume']  # time: ms since epoch (int64)
+SPREAD_FIELDS = ['ticks', 'spread_mean', 'spread_max', 'volume']
+DAY_MS = 24 * 3600 * 1000
+BI5_RECORD = np.dtype([('ms', '>u4'), ('ask', '>u4'), ('bid', '>u4'), ('ask_volume', '>f4'), ('bid_volume', '>f4')])
+
+
+def dukascopy_point(currency):
+    '''
+    Price unit of the Dukascopy files: 0.001 for the JPY pairs, otherwise 0.00001
+    '''
+    return 1e-3 if currency.endswith('JPY') else 1e-5
+
+
+def bi5_file(currency, hour):
+    '''
+    Path of the Dukascopy file with the ticks of 'hour' (a datetime). The months are numbered from 0.
+    '''
+    return os.path.join(DUKASCOPY_PATH, currency, '{:04d}'.format(hour.year), '{:02d}'.format(hour.month - 1),
+                        '{:02d}'.format(hour.day), '{:02d}h_ticks.bi5'.format(hour.hour))
+
+
+def decode_bi5(data, hour_ms, point):
+    '''
+    Decodes the (decompressed) records of a bi5 file into tick arrays. 'hour_ms': start of the hour in ms since epoch.
+    '''
+    records = np.frombuffer(data, dtype=BI5_RECORD)
+    return {'time': hour_ms + records['ms'].astype(np.int64),
+            'bid': records['bid'] * point, 'ask': records['ask'] * point,
+            'bid_volume': records['bid_volume'].astype(np.float64),
+            'ask_volume': records['ask_volume'].astype(np.float64)}
+
+
+def read_bi5_day(currency, day):
+    '''
+    Ticks of 1 day (a datetime at midnight) from the 24 hour files; hours without a file (or an empty one) are skipped
+    '''
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    point = dukascopy_point(currency)
+    parts = []
+    for h in range(24):
+        hour = day + timedelta(hours=h)
+        filename = bi5_file(currency, hour)
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0: continue
+        with open(filename, 'rb') as f:
+            data = lzma.decompress(f.read())
+        parts.append(decode_bi5(data, pd.Timestamp(hour).value // 10 ** 6, point))
+    return concat_ticks(parts)
+
+
+def concat_ticks(parts):
+    if not parts:
+        return dict((field, np.zeros(0, dtype=np.int64 if field == 'time' else np.float64)) for field in TICK_FIELDS)
+    return dict((field, np.concatenate([part[field] for part in parts])) for field in TICK_FIELDS)
+
+
+def parse_dukascopy_dates(values):
+    '''
+    Parses 'dd.mm.yyyy HH:MM:SS.fff' (UTC) into ms since epoch, straight from the bytes like db_workers.parse_histdata_dates()
+    '''
+    chars = np.asarray(values, dtype='S23')
+    d = (np.frombuffer(chars.tobytes(), dtype=np.uint8).reshape(-1, 23) - 48).astype(np.int64)
+    day = d[:, 0] * 10 + d[:, 1]
+    month = d[:, 3] * 10 + d[:, 4]
+    year = d[:, 6] * 1000 + d[:, 7] * 100 + d[:, 8] * 10 + d[:, 9]
+    ms = ((d[:, 11] * 10 + d[:, 12]) * 3600 + (d[:, 14] * 10 + d[:, 15]) * 60 + d[:, 17] * 10 + d[:, 18]) * 1000 \
+        + d[:, 20] * 100 + d[:, 21] * 10 + d[:, 22]
+    months = ((year - 1970) * 12 + month - 1).astype('M8[M]').astype('M8[D]').astype(np.int64)  # days since epoch
+    return (months + day - 1) * DAY_MS + ms
+
+
+def read_tick_csv(filename, chunksize=TICK_CHUNKSIZE):
+    '''
+    Yields the ticks of a Dukascopy csv export in chunks of 'chunksize' rows
+    '''
+    reader = pd.read_csv(filename, header=0, names=['date', 'ask', 'bid', 'ask_volume', 'bid_volume'],
+                         dtype={'date': str}, chunksize=chunksize)
+    for chunk in reader:
+        yield {'time': parse_dukascopy_dates(chunk['date'].values), 'bid': chunk['bid'].values.astype(np.float64),
+               'ask': chunk['ask'].values.astype(np.float64), 'bid_volume': chunk['bid_volume'].values.astype(np.float64),
+               'ask_volume': chunk['ask_volume'].values.astype(np.float64)}
+
+
+def iter_tick_days(chunks):
+    '''
+    Regroups chunks of ticks (sorted by time) into days: yields (day as ms since epoch, ticks) as soon as a day is complete
+    '''
+    pieces, current = [], None
+    for chunk in chunks:
+        days = chunk['time'] // DAY_MS
+        bounds = [0] + (np.flatnonzero(np.diff(days)) + 1).tolist() + [len(days)]
+        for b, e in zip(bounds[:-1], bounds[1:]):
+            if b == e: continue
+            if days[b] != current and pieces:
+                yield current * DAY_MS, concat_ticks(pieces)
+                pieces = []
+            current = days[b]
+            pieces.append(dict((field, values[b:e]) for field, values in chunk.items()))
+    if pieces:
+        yield current * DAY_MS, concat_ticks(pieces)
+
+
+def ticks_to_minutes(ticks):
+    '''
+    Aggregates ticks (sorted by time) into minute bars, in 1 vectorized pass:
+    bid ohlc (rounded to PRICE_DECIMALS) and the spread statistics (ticks, mean and max spread, bid + ask volume).
+    Returns (ohlc, spread) dataframes with the same index (naive UTC).
+    '''
+    minutes = ticks['time'] // 60000
+    if not len(minutes):
+        index = pd.DatetimeIndex([], name='date')
+        return pd.DataFrame(columns=PRICETYPES, index=index), pd.DataFrame(columns=SPREAD_FIELDS, index=index)
+    starts = np.flatnonzero(np.append(True, np.diff(minutes) != 0))
+    ends = np.append(starts[1:], len(minutes))
+    bid, spread = ticks['bid'], ticks['ask'] - ticks['bid']
+    index = pd.DatetimeIndex((minutes[starts] * 60 * 10 ** 9).view('M8[ns]'), name='date')
+    ohlc = pd.DataFrame({'open': bid[starts], 'high': np.maximum.reduceat(bid, starts),
+                         'low': np.minimum.reduceat(bid, starts), 'close': bid[ends - 1]},
+                        index=index, columns=PRICETYPES).round(PRICE_DECIMALS)
+    counts = ends - starts
+    spread = pd.DataFrame({'ticks': counts, 'spread_mean': np.add.reduceat(spread, starts) / counts,
+                           'spread_max': np.maximum.reduceat(spread, starts),
+                           'volume': np.add.reduceat(ticks['bid_volume'] + ticks['ask_volume'], starts)},
+                          index=index, columns=SPREAD_FIELDS)
+    return ohlc, spread
+
+
+def _pack(values, dtype):
+    return Binary(zlib.compress(np.asarray(values).astype(dtype).tobytes(), 1))
+
+
+def _unpack(data, dtype):
+    return np.frombuffer(zlib.decompress(data), dtype=dtype)
+
+
+def tick_fields(day_ms, ticks):
+    '''
+    Document fields of 1 day of ticks (see above)
+    '''
+    scale = 10 ** TICK_DECIMALS
+    offsets = ticks['time'] - day_ms
+    bid, ask = np.round(ticks['bid'] * scale).astype(np.int64), np.round(ticks['ask'] * scale).astype(np.int64)
+    return {'begin': pd.Timestamp(int(ticks['time'][0]) * 10 ** 6).to_pydatetime(),
+            'end': pd.Timestamp(int(ticks['time'][-1]) * 10 ** 6).to_pydatetime(),
+            'count': len(offsets), 'decimals': TICK_DECIMALS, 'updated': datetime.utcnow(),
+            'time': _pack(np.append(offsets[:1], np.diff(offsets)), '<u4'),
+            'bid': _pack(np.append(bid[:1], np.diff(bid)), '<i4'),
+            'ask': _pack(np.append(ask[:1], np.diff(ask)), '<i4'),
+            'bid_volume': _pack(ticks['bid_volume'], '<f4'),
+            'ask_volume': _pack(ticks['ask_volume'], '<f4')}
+
+
+def doc_to_ticks(doc):
+    '''
+    Converts a stored tick document into a dataframe with a 'date' index and the columns bid, ask, bid_volume, ask_volume
+    '''
+    day_ms = pd.Timestamp(doc['day']).value // 10 ** 6
+    scale = float(10 ** doc['decimals'])
+    time = day_ms + np.cumsum(_unpack(doc['time'], '<u4').astype(np.int64))
+    return pd.DataFrame({'bid': np.cumsum(_unpack(doc['bid'], '<i4').astype(np.int64)) / scale,
+                         'ask': np.cumsum(_unpack(doc['ask'], '<i4').astype(np.int64)) / scale,
+                         'bid_volume': _unpack(doc['bid_volume'], '<f4').astype(np.float64),
+                         'ask_volume': _unpack(doc['ask_volume'], '<f4').astype(np.float64)},
+                        index=pd.DatetimeIndex((time * 10 ** 6).view('M8[ns]'), name='date'),
+                        columns=['bid', 'ask', 'bid_volume', 'ask_volume'])
+
+
+def store_tick_day(currency, day_ms, ticks, writer):
+    day = pd.Timestamp(day_ms * 10 ** 6).to_pydatetime()
+    writer.upsert({'currency': currency, 'type': 'tick', 'day': day}, {'$set': tick_fields(day_ms, ticks)})
+    log.debug('Queued %s ticks %s', currency, day.date())
+
+
+def get_ticks(currency='EURUSD', begin=None, end=None):
+    '''
+    Stored ticks of currency from the day of 'begin' till the day of 'end' (datetimes) as 1 dataframe
+    '''
+    query = {'currency': currency, 'type': 'tick'}
+    if begin is not None: query['day'] = {'$gte': datetime(begin.year, begin.month, begin.day)}
+    if end is not None: query.setdefault('day', {})['$lte'] = end
+    frames = [doc_to_ticks(doc) for doc in get_db()[TICK_COLLECTION].find(query).sort([('day', 1)])]
+    if not frames:
+        return pd.DataFrame(columns=['bid', 'ask', 'bid_volume', 'ask_volume'], index=pd.DatetimeIndex([], name='date'))
+    return pd.concat(frames)
+
+
+def store_minute_month(currency, year, month, ohlc, spread, writer):
+    '''
+    Stores the minute bars of a month as the raw document and its spread statistics as a 'spread' document.
+    Both are merged with the stored bars of the month (a later ingest of the same month adds its days),
+    the spread statistics are kept at the dates of the bars left after the quality repair.
+    '''
+    updated = datetime.utcnow()
+    ohlc = merge_raw_month(currency, year, month, ohlc)
+    ohlc = check_bucket(currency, 'raw', 'min', year, month, ohlc, checked=updated)
+    store_raw_data(currency=currency, year=year, month=month, ohlc=ohlc, writer=writer, updated=updated)
+    filter_doc = {'currency': currency, 'type': 'spread', 'freq': 'min', 'year': year, 'month': month}
+    spread = merge_stored(filter_doc, spread, columns=SPREAD_FIELDS).reindex(ohlc.index)
+    writer.upsert(filter_doc, {'$set': ohlc_fields(spread, encoding='list', columns=SPREAD_FIELDS, updated=updated)})
+
+
+@timed()
+def ingest_ticks(currency, days, store_ticks=True):
+    '''
+    Ingests an iterable of (day as ms since epoch, ticks) in date order (see iter_tick_days(), iter_bi5_days()):
+    stores every day of ticks and builds the minute bars per day; the bars of a month are stored
+    as soon as the month is complete. Returns the number of stored days.
+    '''
+    tick_writer = BulkWriter(collection=TICK_COLLECTION, batch_size=1)  # Tick documents are large: 1 per round trip
+    writer = BulkWriter()
+    month, bars, spreads, stored = None, [], [], 0
+    for day_ms, ticks in days:
+        if not len(ticks['time']): continue
+        if store_ticks: store_tick_day(currency, day_ms, ticks, tick_writer)
+        ohlc, spread = ticks_to_minutes(ticks)
+        day = pd.Timestamp(day_ms * 10 ** 6)
+        if month is not None and (day.year, day.month) != month and bars:
+            store_minute_month(currency, month[0], month[1], pd.concat(bars), pd.concat(spreads), writer)
+            writer.flush()
+            bars, spreads = [], []
+        month = (day.year, day.month)
+        bars.append(ohlc)
+        spreads.append(spread)
+        stored += 1
+    if bars:
+        store_minute_month(currency, month[0], month[1], pd.concat(bars), pd.concat(spreads), writer)
+    tick_writer.flush()
+    writer.flush()
+    log.info('Stored %s days of %s ticks', stored, currency)
+    return stored
+
+
+def iter_bi5_days(currency, begin, end):
+    '''
+    Yields (day as ms since epoch, ticks) for the days from 'begin' till 'end' (datetimes) from the Dukascopy hour files
+    '''
+    day = datetime(begin.year, begin.month, begin.day)
+    while day <= end:
+        yield pd.Timestamp(day).value // 10 ** 6, read_bi5_day(currency, day)
+        day += timedelta(days=1)
+
+
+def ingest_dukascopy(currency=None, begin=datetime(2017, 1, 1), end=datetime(2017, 12, 31), store_ticks=True):
+    '''
+    If currency == '' then all currencies
+    Ingests the Dukascopy hour files of the currencies from 'begin' till 'end'
+    '''
+    if currency: currencies = [currency]
+    else: currencies = CURRENCIES
+    for cur in currencies:
+        ingest_ticks(cur, iter_bi5_days(cur, begin, end), store_ticks=store_ticks)
+
+
+def ingest_tick_csv(currency, filename, store_ticks=True):
+    '''
+    Ingests a Dukascopy tick csv export (sorted by time)
+    '''
+    return ingest_ticks(currency, iter_tick_days(read_tick_csv(filename)), store_ticks=store_ticks)
+
+
+if __name__ == '__main__':
+    ingest_dukascopy()
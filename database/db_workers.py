@@ -1,13 +1,68 @@
-from calendar import monthrange
-from datetime import datetime
+import numpy as np
 import pandas as pd
 import sys
-from pymongo import MongoClient
+from datetime import datetime
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
+
+from db_events import log
+from db_metrics import timed, timer
+from db_quality import check_bucket, repaired_months
+from db_queries import BulkWriter, store_raw_data, store_resampled_data, get_ohlc, iter_ohlc, merge_raw_month, get_watermark, \
+    set_watermark
+from db_settings import CURRENCIES, PRICETYPES, RAW_DATA_PATH, RAW_CHUNKSIZE, HISTDATA_EST_OFFSET, TIMEFRAMES
+
+OHLC_AGGREGATION = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'}
+DAY_NANOS = to_offset('D').nanos
+
+
+def raw_data_file(currency, year, month=0):
+    '''
+    Returns the path of the histdata csv file for a full year (month == 0) or a month
+    '''
+    if month == 0:  # full year
+        f = 'DAT_ASCII_{}_M1_{}.csv'.format(currency, year)
+    else:  # month data
+        f = 'DAT_ASCII_{}_M1_{}{}.csv'.format(currency, year, str(month).zfill(2))
+    subdir = 'HISTDATA_COM_ASCII_{}_M1{}/'.format(currency, year)
+    return RAW_DATA_PATH + subdir + f
+
+
+def parse_histdata_dates(values):
+    '''
+    Parses histdata timestamps 'yyyymmdd HHMMSS' into UTC datetime64 values.
+    The format is fixed, so the digits are read straight from the bytes instead of letting pandas infer the format.
+    The timestamps are in "Eastern Standard Time (EST) time-zone WITHOUT Day Light Savings adjustments"
+    (See: http://www.histdata.com/f-a-q/data-files-detailed-specification/), so EST -> UTC is a fixed shift.
+    '''
+    chars = np.asarray(values, dtype='S15')
+    digits = (np.frombuffer(chars.tobytes(), dtype=np.uint8).reshape(-1, 15) - 48).astype(np.int64)
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    seconds = (digits[:, 9] * 10 + digits[:, 10]) * 3600 + (digits[:, 11] * 10 + digits[:, 12]) * 60 + digits[:, 13] * 10 + digits[:, 14]
+    dates = ((year - 1970) * 12 + month - 1).astype('M8[M]').astype('M8[s]')  # first of the month
+    dates += ((day - 1) * 86400 + seconds + HISTDATA_EST_OFFSET * 3600).astype('m8[s]')
+    return dates.astype('M8[ns]')
+
 
-from db_queries import store_raw_data, get_raw_data, get_all_raw_data, store_resampled_data, get_all_resampled_data
-from db_settings import MONGO_HOST, MONGO_PORT, DB, CURRENCIES
+@timed('parse_histdata')
+def histdata_frame(chunk):
+    '''
+    Converts a chunk read from a histdata csv file into a ohlc dataframe with a UTC index, rounded to 4 decimals
+    '''
+    index = pd.DatetimeIndex(parse_histdata_dates(chunk['date'].values), name='date').tz_localize('UTC')
+    ohlc = pd.DataFrame(np.round(chunk[PRICETYPES].values, 4), index=index, columns=PRICETYPES)
+    ohlc['volume'] = chunk['volume'].values
+    return ohlc
 
 
+def read_histdata(filename, chunksize=None):
+    return pd.read_csv(filename, delimiter=';', header=None, names=['date'] + PRICETYPES + ['volume'],
+                       dtype={'date': str}, chunksize=chunksize)
+
+
+@timed()
 def load_raw_data(currency='EURUSD', year=2017, month=0):
     '''
     - Download raw minute data at: http://www.histdata.com/download-free-forex-data/?/ascii/1-minute-bar-quotes
@@ -20,43 +75,192 @@ def load_raw_data(currency='EURUSD', year=2017, month=0):
     - load_raw_data() stares the raw quotes in mongodb
     - Delimiter is ';'
     '''
-
-    if month == 0:  # full year
-        f = 'DAT_ASCII_{}_M1_{}.csv'.format(currency, year)
-    else:  # month data
-        f = 'DAT_ASCII_{}_M1_{}{}.csv'.format(currency, year, str(month).zfill(2))
-
-    path = '../raw_data/download/'  # Todo: move path to settings.py
-    subdir = 'HISTDATA_COM_ASCII_{}_M1{}/'.format(currency, year)
     try:
-        ohlc = pd.read_csv(filepath_or_buffer=path + subdir + f, delimiter=';', header=None, index_col=0, parse_dates=True)
-        ohlc.columns = ['open', 'high', 'low', 'close', 'volume']
-        ohlc.index.name = 'date'
-        # Convert EST to UTC
-        # "Eastern Standard Time (EST) time-zone WITHOUT Day Light Savings adjustments"
-        # See: http://www.histdata.com/f-a-q/data-files-detailed-specification/
-        ohlc.index = ohlc.index.tz_localize('US/Eastern')  # data read is in EST format
-        ohlc.index = ohlc.index.tz_convert('UTC')  # convert to UTC
-        # Round to 4 decimals
-        ohlc = ohlc.round({'open': 4, 'high': 4, 'low': 4, 'close': 4})
-        return ohlc
+        return histdata_frame(read_histdata(raw_data_file(currency, year, month)))
     except IOError as e:
-        print 'Error!', sys.exc_info()[1]
+        log.error('Error! %s', sys.exc_info()[1])
         return None
     except:
-        print "Unexpected error:", sys.exc_info()[0]
+        log.error('Unexpected error: %s', sys.exc_info()[0])
         raise
 
 
-def load_store_all_raw_data():
-    for cur in CURRENCIES:
-        for year in range(2000, 2020):
-            ohlc = load_raw_data(currency=cur, year=year, month=0)
-            if ohlc is not None:
-                store_raw_data(currency=cur, year=year, month=0, ohlc=ohlc)
+def iter_raw_months(currency='EURUSD', year=2017, month=0, chunksize=RAW_CHUNKSIZE):
+    '''
+    Streaming version of load_raw_data(): reads the csv file in chunks of 'chunksize' rows
+    and yields (year, month, ohlc) as soon as a month is complete.
+    Only 1 month of data (+ 1 chunk) is kept in memory. The file must be sorted by date.
+    '''
+    pieces = []  # parts of the current, incomplete month
+    current = None  # current month as year * 12 + month - 1
+    for chunk in read_histdata(raw_data_file(currency, year, month), chunksize=chunksize):
+        ohlc = histdata_frame(chunk)
+        keys = ohlc.index.values.astype('M8[M]').astype(np.int64) + 1970 * 12
+        # Split the chunk where the month changes
+        bounds = [0] + (np.flatnonzero(np.diff(keys)) + 1).tolist() + [len(keys)]
+        for b, e in zip(bounds[:-1], bounds[1:]):
+            if b == e: continue
+            if keys[b] != current and pieces:
+                yield current // 12, current % 12 + 1, pd.concat(pieces)
+                pieces = []
+            current = keys[b]
+            pieces.append(ohlc.iloc[b:e])
+    if pieces:
+        yield current // 12, current % 12 + 1, pd.concat(pieces)
+
+
+@timed()
+def load_store_raw_data(currency='EURUSD', year=2017, month=0, writer=None):
+    '''
+    Streams a histdata csv file into the database. Every month is written as soon as it's read completely.
+    A month is merged with its stored bars (see db_queries.merge_raw_month()): the first hours of a month are in the file
+    of the month (or year) before, because of the EST -> UTC shift, eg: the bars of Dec 31 19:00 - 23:59 EST are stored
+    in the January document of the next year.
+    Returns the number of stored months.
+    '''
+    if writer is None: writer = BulkWriter()
+    stored = 0
+    try:
+        for y, m, ohlc in iter_raw_months(currency=currency, year=year, month=month):
+            ohlc = merge_raw_month(currency, y, m, ohlc)
+            updated = datetime.utcnow()
+            ohlc = check_bucket(currency, 'raw', 'min', y, m, ohlc, checked=updated)
+            store_raw_data(currency=currency, year=y, month=m, ohlc=ohlc, writer=writer, updated=updated)
+            writer.flush()
+            stored += 1
+    except IOError as e:
+        log.error('Error! %s', sys.exc_info()[1])
+    return stored
+
+
+def load_store_all_raw_data(streaming=True):
+    with BulkWriter() as writer:  # One shared writer -> documents are sent in bulk, over the pooled connection
+        for cur in CURRENCIES:
+            for year in range(2000, 2020):
+                if streaming:
+                    load_store_raw_data(currency=cur, year=year, month=0, writer=writer)
+                    continue
+                ohlc = load_raw_data(currency=cur, year=year, month=0)
+                if ohlc is not None:
+                    store_raw_data(currency=cur, year=year, month=0, ohlc=ohlc, writer=writer)
 
 
-def resample_store_raw_data(currency=None, frequency='min', scale='D'):
+def resample_ohlc(ohlc, scale, currency=None):
+    with timer('resample', currency):
+        return ohlc.resample(scale).agg(OHLC_AGGREGATION)[PRICETYPES]
+
+
+def bin_start(date, scale):
+    '''
+    Returns the label of the resample bin (for 'scale') that contains 'date'
+    '''
+    return pd.Series([0], index=pd.DatetimeIndex([date])).resample(scale).first().index[0]
+
+
+def is_intraday(scale):
+    '''
+    True if the bins of 'scale' never cross midnight, so they never cross the boundary of a raw month document
+    '''
+    offset = to_offset(scale)
+    return isinstance(offset, Tick) and DAY_NANOS % offset.nanos == 0
+
+
+def is_aligned(scale):
+    '''
+    True if the bins of 'scale' don't depend on where the data starts (intraday or anchored scales like W, M)
+    '''
+    return is_intraday(scale) or not isinstance(to_offset(scale), Tick)
+
+
+def plan_timeframes(scales, frequency='min'):
+    '''
+    Decides from which (lower) timeframe each scale is built. Returns (monthly, final, keep):
+    - monthly: [(scale, source), ...] intraday scales, built per raw month, finest first
+    - final: [(scale, source), ...] scales whose bins cross months (W, M, 2D, ...), built at the end
+    - keep: the timeframes whose monthly results are collected
+    An intraday scale is built from the largest finer intraday scale that divides it, eg: H from 15min, D from 4H.
+    Anchored scales (W, M, ...) are built from D.
+    '''
+    intraday = sorted(set(s for s in scales if is_intraday(s)), key=lambda s: to_offset(s).nanos)
+    others = [s for s in scales if s not in intraday]
+    if [s for s in others if not isinstance(to_offset(s), Tick)] and 'D' not in intraday:
+        intraday.append('D')
+
+    def source(scale, candidates):
+        nanos = to_offset(scale).nanos
+        for s in reversed(candidates):
+            if to_offset(s).nanos < nanos and nanos % to_offset(s).nanos == 0:
+                return s
+        return frequency
+
+    monthly = [(s, source(s, intraday[:i])) for i, s in enumerate(intraday)]
+    final = [(s, source(s, intraday) if isinstance(to_offset(s), Tick) else 'D') for s in others]
+    keep = set(s for s in intraday if s in scales) | set(src for s, src in final)
+    return monthly, final, keep
+
+
+@timed()
+def resample_timeframes(months, scales, frequency='min', currency=None):
+    '''
+    Builds all 'scales' in 1 pass over 'months', an iterable of raw ohlc dataframes (1 per month, in date order).
+    Each month is read once. Returns ({scale: ohlc}, last raw date). 'currency' is only for the metrics.
+    '''
+    monthly, final, keep = plan_timeframes(scales, frequency)
+    parts = dict((s, []) for s in keep)
+    last = None
+    for raw in months:
+        if raw.empty: continue
+        last = raw.index[-1]
+        frames = {frequency: raw}
+        for scale, source in monthly:
+            frames[scale] = resample_ohlc(frames[source], scale, currency)
+        for s in keep:
+            parts[s].append(frames[s])
+    if last is None:
+        return {}, None
+    results = dict((s, pd.concat(parts[s])) for s in keep)
+    for scale, source in final:
+        results[scale] = resample_ohlc(results[source], scale, currency)
+    return dict((s, results[s]) for s in scales), last
+
+
+@timed()
+def resample_store_timeframes(currency=None, frequency='min', scales=TIMEFRAMES, incremental=False):
+    '''
+    If currency == '' then all currencies
+    Resamples the raw timeseries to all 'scales' at once (see resample_timeframes()) and stores them in the database.
+    With incremental=True only the raw months after the watermarks (the last raw bar that was resampled before)
+    are fetched, and only the bins from the bin that holds the watermark onward are recomputed and stored.
+    '''
+    if currency: currencies = [currency]
+    else: currencies = CURRENCIES
+    writer = BulkWriter()
+    for cur in currencies:
+        # Bins of scales like 7min or 2D are aligned on the first raw date, so they're always rebuilt in full
+        watermarks = dict((s, get_watermark(cur, 'resampled', s) if incremental and is_aligned(s) else None) for s in scales)
+        boundaries = dict((s, bin_start(wm, s)) for s, wm in watermarks.items() if wm is not None)
+        begin = None
+        if len(boundaries) == len(scales):
+            # Fetch from before the first boundary bin starts, so every boundary bin is complete
+            begin = min(b - to_offset(s) for s, b in boundaries.items())
+        months = repaired_months(cur, iter_ohlc(currency=cur, type='raw', frequency=frequency, begin=begin), frequency)
+        results, last = resample_timeframes(months, scales, frequency, currency=cur)
+        for scale, ohlc in results.items():
+            watermark = watermarks[scale]
+            if watermark is not None:
+                if last <= watermark: continue
+                boundary = boundaries[scale]
+                ohlc = ohlc[ohlc.index >= boundary]
+                # Keep the stored bins before the boundary of the years that are rewritten
+                stored = get_ohlc(currency=cur, type='resampled', frequency=scale,
+                                  begin=str(ohlc.index[0].year), end=str(ohlc.index[-1].year))
+                ohlc = pd.concat([stored[stored.index < boundary], ohlc])
+            store_resampled_data(currency=cur, ohlc=ohlc, writer=writer, frequency=scale)
+            writer.flush()
+            set_watermark(cur, 'resampled', scale, last)
+
+
+def resample_store_raw_data(currency=None, frequency='min', scale='D', incremental=False):
     '''
     If currency == '' then all currencies
     Resamples a raw timeseries to hour, day,... and stores it in the database
@@ -75,44 +279,12 @@ def resample_store_raw_data(currency=None, frequency='min', scale='D'):
         L, ms	Millisecond frequency
         U, us	Microsecond frequency
         N, ns	Nanosecond frequency
+    See resample_store_timeframes() for incremental=True.
     '''
-    frame = []
-    if currency: currencies = [currency]
-    else: currencies = CURRENCIES
-    for cur in currencies:
-        for pt in ['open', 'high', 'low', 'close']:
-            raw = get_all_raw_data(currency=cur, frequency=frequency, pricetype=pt)
-            if pt == 'open': frame.append(raw.resample(scale).first())
-            if pt == 'high': frame.append(raw.resample(scale).max())
-            if pt == 'low': frame.append(raw.resample(scale).min())
-            if pt == 'close': frame.append(raw.resample(scale).last())
-        ohlc = pd.concat(frame, axis=1)
-        store_resampled_data(currency=cur, ohlc=ohlc)
-        frame = []
-
-
-def calculate_returns(currency=None, frequency='D', begin='1970', end='2020', pricetype=None, periods=1):
-    # Todo: should this method be here? Should I save the returns?
-    if currency: currencies = [currency]
-    else: currencies = CURRENCIES
-    if pricetype: pricetypes = [pricetype]
-    else: pricetypes = ['open', 'high', 'low', 'close']
-
-    cframes = []  # list of dataframes with currencies (ohlc)
-    pframes = []  # list of dataframes with price column ('open' or 'close' or ...)
-    for cur in currencies:
-        for pt in pricetypes:
-            prices = get_all_resampled_data(currency=cur, frequency='D', begin=begin, end=end, pricetype=pt)
-            pframes.append(prices.pct_change(periods=periods))
-        cframes.append(pd.concat(pframes, axis=1))
-        pframes = []  # list of dataframes with price column ('open' or 'close' or ...)
-    df = pd.concat(cframes, keys=currencies,axis=1)
-    return df.dropna(how='any')
+    resample_store_timeframes(currency=currency, frequency=frequency, scales=[scale], incremental=incremental)
 
 
 if __name__ == '__main__':
     # load_store_all_raw_data()
-    # resample_store_raw_data()
-    # print calculate_returns(currency='EURUSD', begin='2005', end='2007', periods=1)
-    print calculate_returns(begin='2007', end='2008', periods=1)
+    # resample_store_timeframes()
     pass
@@ -1,13 +1,9 @@
 from database.db_settings import CURRENCIES
-from database.db_workers import load_raw_data
-from database.db_queries import store_raw_data, get_raw_data
+from database.db_ingest import ingest_all_raw_data
+from database.db_queries import get_raw_data
 
 def load_store_all_currencies():
-    for cur in CURRENCIES:
-        for year in range(2000, 2018):
-            ohlc = load_raw_data(currency=cur, year=year, month=0)
-            if ohlc is not None:
-                store_raw_data(currency=cur, year=year, month=0, ohlc=ohlc)
+    ingest_all_raw_data(currencies=CURRENCIES, years=range(2000, 2018))
 
 
 